@@ -0,0 +1,53 @@
+"""
+Compare load / dump times of repka.codecs codecs on given json files
+
+Usage:
+
+poetry run python benchmarks/json_codecs.py data/songs.json data/users.json --number 10
+"""
+import argparse
+import json
+import timeit
+from typing import Dict, Sequence
+
+from repka.codecs import Codec, JsonCodec, OrjsonCodec, MarshalCodec, PickleCodec
+
+
+def available_codecs() -> Dict[str, Codec]:
+    codecs: Dict[str, Codec] = {"json": JsonCodec()}
+    try:
+        codecs["orjson"] = OrjsonCodec()
+    except ImportError:
+        pass
+    codecs["marshal"] = MarshalCodec()
+    codecs["pickle"] = PickleCodec()
+    return codecs
+
+
+def benchmark(filenames: Sequence[str], number: int) -> None:
+    print(f"{'file':<40} {'codec':<10} {'size, KB':>10} {'load, ms':>10} {'dump, ms':>10}")
+
+    for filename in filenames:
+        with open(filename, encoding="utf-8") as f:
+            data = json.load(f)
+
+        for name, codec in available_codecs().items():
+            content = codec.dumps(data)
+            load_time = timeit.timeit(lambda: codec.loads(content), number=number) / number
+            dump_time = timeit.timeit(lambda: codec.dumps(data), number=number) / number
+            print(
+                f"{filename[-40:]:<40} {name:<10} {len(content) / 1024:>10.1f} "
+                f"{load_time * 1000:>10.2f} {dump_time * 1000:>10.2f}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("filenames", nargs="+", help="json files to benchmark codecs on")
+    parser.add_argument("--number", type=int, default=10, help="number of runs per operation")
+    args = parser.parse_args()
+    benchmark(args.filenames, args.number)
+
+
+if __name__ == "__main__":
+    main()
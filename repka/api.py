@@ -3,3 +3,4 @@ from repka.repositories.aiopg_ import AiopgRepository as BaseRepository
 from repka.repositories.aiopg_ import AiopgRepository
 from repka.repositories.fake import FakeRepo
 from repka.repositories.base import IdModel
+from repka.repositories.sqlite_ import SqliteRepository
@@ -0,0 +1,112 @@
+"""
+Codecs used by repka.json_.DictJsonRepo to convert data to / from file content
+
+>>> codec = JsonCodec()
+>>> codec.loads(codec.dumps({"field": [1, 2]}))
+{'field': [1, 2]}
+"""
+import json
+import marshal
+import pickle
+from abc import ABC, abstractmethod
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+
+class Codec(ABC):
+    @abstractmethod
+    def dumps(self, data: Any) -> bytes:
+        """Convert data to file content"""
+
+    @abstractmethod
+    def loads(self, content: bytes) -> Any:
+        """Convert file content to data"""
+
+    def loads_buffer(self, buffer: memoryview) -> Any:
+        """
+        Convert file content from buffer (e.g. memory-mapped file) to data
+
+        Buffer is copied to bytes by default, codecs that can decode buffers override it
+        """
+        return self.loads(bytes(buffer))
+
+
+class JsonCodec(Codec):
+    """Stdlib json codec"""
+
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data).encode("utf-8")
+
+    def loads(self, content: bytes) -> Any:
+        return json.loads(content)
+
+    def loads_buffer(self, buffer: memoryview) -> Any:
+        """Stdlib json parses only str / bytes, so buffer is decoded to str (without bytes copy)"""
+        return json.loads(str(buffer, "utf-8"))
+
+
+class OrjsonCodec(Codec):
+    """
+    Fast json codec via orjson (https://github.com/ijl/orjson), install via `pip install orjson`
+
+    Unlike stdlib json, it supports only str dict keys and produces compact json
+    """
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise ImportError("orjson is not installed, install it via `pip install orjson`")
+
+    def dumps(self, data: Any) -> bytes:
+        return orjson.dumps(data)
+
+    def loads(self, content: bytes) -> Any:
+        return orjson.loads(content)
+
+    def loads_buffer(self, buffer: memoryview) -> Any:
+        return orjson.loads(buffer)
+
+
+class MarshalCodec(Codec):
+    """
+    Binary codec via stdlib marshal, the fastest one for python primitives
+
+    Format depends on python version, so it should be used only for caches / snapshots
+    """
+
+    def dumps(self, data: Any) -> bytes:
+        return marshal.dumps(data)
+
+    def loads(self, content: bytes) -> Any:
+        return marshal.loads(content)
+
+    def loads_buffer(self, buffer: memoryview) -> Any:
+        return marshal.loads(buffer)
+
+
+class PickleCodec(Codec):
+    """
+    Binary codec via stdlib pickle
+
+    Loading pickle can execute arbitrary code, so load only trusted files
+    """
+
+    def __init__(self, protocol: int = pickle.HIGHEST_PROTOCOL) -> None:
+        self.protocol = protocol
+
+    def dumps(self, data: Any) -> bytes:
+        return pickle.dumps(data, protocol=self.protocol)
+
+    def loads(self, content: bytes) -> Any:
+        return pickle.loads(content)
+
+    def loads_buffer(self, buffer: memoryview) -> Any:
+        return pickle.loads(buffer)
+
+
+def fastest_json_codec() -> Codec:
+    """OrjsonCodec if orjson is installed, JsonCodec otherwise"""
+    return OrjsonCodec() if orjson is not None else JsonCodec()
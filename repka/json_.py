@@ -1,23 +1,105 @@
+import asyncio
 import json
+import mmap
 import os
-from typing import Dict, Callable, Sequence, Union, TypeVar, Generic, Tuple
+import re
+import secrets
+import stat
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import (
+    Dict,
+    Callable,
+    Sequence,
+    Union,
+    TypeVar,
+    Generic,
+    Tuple,
+    Any,
+    Optional,
+    Iterator,
+    Iterable,
+    TextIO,
+    MutableMapping,
+    Mapping,
+    IO,
+)
+
+from repka.codecs import Codec, JsonCodec
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
 
 Exists = bool
 JsonSerializable = Union[Dict, Sequence, str, bool, int, float]
 JsonSerializableGeneric = TypeVar("JsonSerializableGeneric", bound=JsonSerializable)
+T = TypeVar("T")
 
 
 class DictJsonRepo(Generic[JsonSerializableGeneric]):
-    def __init__(self, directory: str = None) -> None:
+    def __init__(
+        self,
+        directory: str = None,
+        cache_size: int = 0,
+        cache_recheck_interval: float = 0,
+        codec: Codec = None,
+        extension_codecs: Mapping[str, Codec] = None,
+        use_mmap: bool = False,
+    ) -> None:
+        """
+        :param directory: Directory where files will be read / written, default is cwd
+        :param cache_size: Max number of files which content is cached in memory,
+            0 means cache is disabled
+        :param cache_recheck_interval: Min number of seconds between checks that cached file
+            is not changed
+        :param codec: Codec used by read / write methods, default is stdlib json codec
+        :param extension_codecs: Codecs used instead of {codec} for files with extensions,
+            e.g. {".pickle": PickleCodec()}
+        :param use_mmap: If True, files are memory-mapped and decoded from mapped buffer,
+            so processes reading the same file share its pages in OS page cache.
+            Stdlib json can't parse buffer, so JsonCodec still creates text of whole file,
+            use OrjsonCodec, MarshalCodec or PickleCodec to decode buffer without copying
+        """
         self.directory = directory or os.getcwd()
+        self.cache = FileCache(cache_size, cache_recheck_interval) if cache_size else None
+        self.codec = codec or JsonCodec()
+        self.extension_codecs = extension_codecs or {}
+        self.use_mmap = use_mmap
+        # Locks of json lines files held by append and compact, removed when nobody uses them
+        self._file_locks: MutableMapping[str, threading.Lock] = weakref.WeakValueDictionary()
+        self._file_locks_guard = threading.Lock()
 
     def read(self, filename: str) -> JsonSerializableGeneric:
-        with open(self._build_path(filename), encoding="utf-8") as f:
-            return json.load(f)
+        path = self._build_path(filename)
+
+        if self.cache is None:
+            return self._read(path)
+
+        entry = self.cache.get(path)
+        if entry:
+            return entry.data
+
+        file_stat = os.stat(path)
+        data = self._read(path)
+        self.cache.set(path, data, file_stat)
+        return data
 
     def write(self, data: JsonSerializableGeneric, filename: str) -> JsonSerializableGeneric:
-        with open(self._build_path(filename), "w", encoding="utf-8") as f:
-            json.dump(data, f)
+        path = self._build_path(filename)
+        # File isn't rewritten in place: processes that mapped it (use_mmap) keep old content
+        with _replacing_file(path, "wb") as f:
+            f.write(self.get_codec(filename).dumps(data))
+
+        if self.cache is not None:
+            self.cache.set(path, data, os.stat(path))
 
         return data
 
@@ -29,5 +111,476 @@ class DictJsonRepo(Generic[JsonSerializableGeneric]):
         else:
             return self.write(default_factory(), filename), False
 
+    def iter_items(self, filename: str, chunk_size: int = 64 * 1024) -> Iterator[Any]:
+        """
+        Read json file with top-level array or object item by item:
+        array elements or object (key, value) pairs
+
+        File is read by chunks of {chunk_size} chars,
+        so memory usage is proportional to the largest item, not to the file size
+        """
+        with open(self._build_path(filename), encoding="utf-8") as f:
+            yield from JsonItemsReader(f, chunk_size)
+
+    # ==============
+    # JSON LINES METHODS
+    # ==============
+
+    def append(self, record: JsonSerializable, filename: str, fsync: bool = False) -> None:
+        """Append {record} as json line to file without rewriting it"""
+        self.append_many([record], filename, fsync)
+
+    def append_many(
+        self, records: Iterable[JsonSerializable], filename: str, fsync: bool = False
+    ) -> None:
+        """
+        Append {records} as json lines to file without rewriting it
+
+        :param fsync: If True, wait until records are flushed to disk
+        """
+        data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+        if not data:
+            return
+
+        with self._locked_file(self._build_path(filename), "a+b") as f:
+            # Previous append could be interrupted by crash and leave incomplete line
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def iter_records(self, filename: str) -> Iterator[JsonSerializable]:
+        """
+        Read json lines file line by line
+
+        Lines that are not valid json (e.g. incomplete lines left by crash) are skipped
+        """
+        with open(self._build_path(filename), encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def compact(
+        self,
+        filename: str,
+        transform: Callable[[Iterator[JsonSerializable]], Iterable[JsonSerializable]] = None,
+    ) -> int:
+        """
+        Rewrite json lines file atomically (write temp file, fsync it and rename to {filename})
+
+        Invalid lines are dropped
+
+        :param transform: Function that receives records iterator and returns records to keep,
+            e.g. last record for each key
+        :return: Number of written records
+        """
+        path = self._build_path(filename)
+        # Appends are blocked until file is replaced, otherwise appended records would be lost
+        with self._locked_file(path, "rb"):
+            records: Iterable[JsonSerializable] = self.iter_records(filename)
+            if transform:
+                records = transform(iter(records))
+
+            count = 0
+            with _replacing_file(path, "w", fsync=True) as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                    count += 1
+        return count
+
     def _build_path(self, filename: str) -> str:
         return os.path.join(self.directory, filename)
+
+    def get_codec(self, filename: str) -> Codec:
+        """Get codec for file by its extension"""
+        return self.extension_codecs.get(os.path.splitext(filename)[1], self.codec)
+
+    def _read(self, path: str) -> JsonSerializableGeneric:
+        codec = self.get_codec(path)
+        with open(path, "rb") as f:
+            # Empty files can't be mapped
+            if self.use_mmap and os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    with memoryview(mapped) as buffer:
+                        return codec.loads_buffer(buffer)
+
+            return codec.loads(f.read())
+
+    @contextmanager
+    def _locked_file(self, path: str, mode: str) -> Iterator[IO]:
+        """
+        Open file holding its exclusive lock: thread lock and flock (on posix, across processes)
+
+        File is reopened if it was replaced (by compact()) while waiting for flock
+        """
+        with self._file_locks_guard:
+            lock = self._file_locks.get(path)
+            if lock is None:
+                lock = self._file_locks[path] = threading.Lock()
+
+        with lock:
+            while True:
+                f = open(path, mode)
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    if os.path.exists(path) and os.path.samestat(
+                        os.fstat(f.fileno()), os.stat(path)
+                    ):
+                        break
+                except BaseException:
+                    f.close()
+                    raise
+                f.close()
+
+            # flock is released on close
+            with f:
+                yield f
+
+
+class AsyncDictJsonRepo(Generic[JsonSerializableGeneric]):
+    """
+    Same as DictJsonRepo, but file reading / writing and parsing are executed in {executor}
+    (default asyncio executor if not set), so event loop is not blocked
+
+    Operations with the same file are serialized via per-file lock:
+    concurrent reads of the same file share single file read
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        cache_size: int = 0,
+        cache_recheck_interval: float = 0,
+        codec: Codec = None,
+        extension_codecs: Mapping[str, Codec] = None,
+        use_mmap: bool = False,
+        executor: Executor = None,
+    ) -> None:
+        self.sync_repo: DictJsonRepo[JsonSerializableGeneric] = DictJsonRepo(
+            directory, cache_size, cache_recheck_interval, codec, extension_codecs, use_mmap
+        )
+        self.executor = executor
+        # Locks are removed when nobody uses them
+        self._locks: MutableMapping[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self._reads: Dict[str, "asyncio.Future[JsonSerializableGeneric]"] = {}
+
+    async def read(self, filename: str) -> JsonSerializableGeneric:
+        path = self.sync_repo._build_path(filename)
+
+        read = self._reads.get(path)
+        if read is None:
+            read = asyncio.ensure_future(self._locked(path, self.sync_repo.read, filename))
+            self._reads[path] = read
+            read.add_done_callback(partial(self._remove_read, path))
+
+        # Cancellation of one reader shouldn't cancel read for other readers
+        return await asyncio.shield(read)
+
+    async def write(
+        self, data: JsonSerializableGeneric, filename: str
+    ) -> JsonSerializableGeneric:
+        return await self._locked(
+            self.sync_repo._build_path(filename), self.sync_repo.write, data, filename
+        )
+
+    async def read_or_write_default(
+        self, filename: str, default_factory: Callable[[], JsonSerializableGeneric]
+    ) -> Tuple[JsonSerializableGeneric, Exists]:
+        return await self._locked(
+            self.sync_repo._build_path(filename),
+            self.sync_repo.read_or_write_default,
+            filename,
+            default_factory,
+        )
+
+    async def append(self, record: JsonSerializable, filename: str, fsync: bool = False) -> None:
+        await self.append_many([record], filename, fsync)
+
+    async def append_many(
+        self, records: Iterable[JsonSerializable], filename: str, fsync: bool = False
+    ) -> None:
+        await self._locked(
+            self.sync_repo._build_path(filename),
+            self.sync_repo.append_many,
+            list(records),
+            filename,
+            fsync,
+        )
+
+    async def compact(
+        self,
+        filename: str,
+        transform: Callable[[Iterator[JsonSerializable]], Iterable[JsonSerializable]] = None,
+    ) -> int:
+        return await self._locked(
+            self.sync_repo._build_path(filename), self.sync_repo.compact, filename, transform
+        )
+
+    async def _locked(self, path: str, func: Callable[..., T], *args: Any) -> T:
+        """
+        Execute {func} in executor holding {path} lock
+
+        Lock is released when {func} finishes, not when caller is cancelled:
+        worker thread can't be stopped, so next operation would run concurrently with it
+        """
+        lock = self._locks.get(path)
+        if lock is None:
+            lock = self._locks[path] = asyncio.Lock()
+
+        await lock.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            execution = loop.run_in_executor(self.executor, partial(func, *args))
+        except BaseException:
+            lock.release()
+            raise
+        execution.add_done_callback(lambda _: lock.release())
+        return await asyncio.shield(execution)
+
+    def _remove_read(self, path: str, read: "asyncio.Future[JsonSerializableGeneric]") -> None:
+        if self._reads.get(path) is read:
+            del self._reads[path]
+
+
+@contextmanager
+def _replacing_file(path: str, mode: str, fsync: bool = False) -> Iterator[IO]:
+    """
+    Open temp file in directory of {path}, rename it to {path} on success (atomically)
+
+    Temp file gets permissions of replaced file (or default ones for new file)
+
+    :param fsync: If True, flush file and its rename to disk
+    """
+    directory = os.path.dirname(path)
+    fd, temp_path = _create_temp_file(path)
+    try:
+        try:
+            os.fchmod(fd, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+
+        encoding = None if "b" in mode else "utf-8"
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    if fsync:
+        _fsync_directory(directory)
+
+
+def _create_temp_file(path: str) -> Tuple[int, str]:
+    """
+    Create temp file next to {path} with default permissions
+
+    Unlike mkstemp (file readable only by owner) mode is 0o666 masked by process umask,
+    which is applied by OS: umask can't be read without setting it for all threads
+
+    :return: File descriptor and path of temp file
+    """
+    directory, name = os.path.split(path)
+    while True:
+        temp_path = os.path.join(directory, f".{name}.{secrets.token_hex(4)}.tmp")
+        try:
+            return os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+
+def _fsync_directory(directory: str) -> None:
+    """Flush directory entries (e.g. renamed file) to disk, not supported on Windows"""
+    if os.name != "posix":
+        return
+
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = re.compile(r"[0-9.eE+\-]*")
+
+
+class JsonItemsReader:
+    """
+    Iterate over top-level array elements or object (key, value) pairs of json file
+    reading it by chunks
+
+    Items are decoded by stdlib json decoder:
+
+    >>> import io
+    >>> list(JsonItemsReader(io.StringIO('[1, {"a": [2]}, "3"]'), chunk_size=2))
+    [1, {'a': [2]}, '3']
+    >>> list(JsonItemsReader(io.StringIO('{"a": 1, "b": null}'), chunk_size=2))
+    [('a', 1), ('b', None)]
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int = 64 * 1024) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self) -> Iterator[Any]:
+        is_object = self._expect("[{") == "{"
+        close = "}" if is_object else "]"
+
+        if self._peek() == close:
+            return
+
+        while True:
+            if is_object:
+                key = self._decode()
+                if not isinstance(key, str):
+                    raise ValueError(f"Expected object key string, got {key!r}")
+                self._expect(":")
+                yield key, self._decode()
+            else:
+                yield self._decode()
+
+            if self._expect("," + close) == close:
+                return
+
+    def _read_more(self) -> bool:
+        """
+        Drop consumed part of buffer and read next chunk, return False if file is over
+
+        At least buffer length is read, so an item spanning many chunks is decoded
+        O(log(item size)) times
+        """
+        if self._eof:
+            return False
+
+        consumed, self._pos = self._pos, 0
+        self._buffer = self._buffer[consumed:]
+        chunk = self.file.read(max(self.chunk_size, len(self._buffer)))
+        if not chunk:
+            self._eof = True
+            return False
+
+        self._buffer += chunk
+        return True
+
+    def _peek(self) -> str:
+        """Skip whitespaces and return next char, empty string if file is over"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()  # type: ignore
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                return ""
+
+    def _expect(self, chars: str) -> str:
+        """Consume next char, which should be one of {chars}"""
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r}, got {char or 'end of file'!r}")
+        self._pos += 1
+        return char
+
+    def _decode(self) -> Any:
+        """Decode next json value reading more chunks if value is incomplete"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._read_more():
+                    continue
+                raise
+
+            # Number followed only by number chars can be cut by chunk boundary, e.g. 12|34 or 1.|5
+            tail_end = _NUMBER_CHARS.match(self._buffer, end).end()  # type: ignore
+            if tail_end == len(self._buffer) and self._read_more():
+                continue
+
+            self._pos = end
+            return value
+
+
+@dataclass
+class FileCacheEntry:
+    data: Any
+    mtime_ns: int
+    size: int
+    checked_at: float
+
+
+class FileCache:
+    """
+    LRU cache of file contents
+
+    Entries are invalidated if file mtime or size is changed;
+    files are checked at most once per {recheck_interval} seconds
+
+    Cached data is shared between readers, so it shouldn't be mutated
+    """
+
+    def __init__(self, max_size: int, recheck_interval: float = 0) -> None:
+        self.max_size = max_size
+        self.recheck_interval = recheck_interval
+        self._entries: "OrderedDict[str, FileCacheEntry]" = OrderedDict()
+        # Cache can be used from multiple threads (e.g. by AsyncDictJsonRepo)
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[FileCacheEntry]:
+        """Get entry with actual file content or None"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+
+            now = time.monotonic()
+            if now - entry.checked_at >= self.recheck_interval:
+                try:
+                    file_stat = os.stat(path)
+                except FileNotFoundError:
+                    file_stat = None
+
+                actual = (file_stat.st_mtime_ns, file_stat.st_size) if file_stat else None
+                if actual != (entry.mtime_ns, entry.size):
+                    del self._entries[path]
+                    return None
+                entry.checked_at = now
+
+            self._entries.move_to_end(path)
+            return entry
+
+    def set(self, path: str, data: Any, file_stat: os.stat_result) -> None:
+        """
+        Cache file content
+
+        :param file_stat: File stat taken before file was read, so changes made during read
+            will invalidate the entry
+        """
+        entry = FileCacheEntry(
+            data, file_stat.st_mtime_ns, file_stat.st_size, checked_at=time.monotonic()
+        )
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path: str) -> None:
+        """Remove file content from cache"""
+        with self._lock:
+            self._entries.pop(path, None)
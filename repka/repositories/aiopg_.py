@@ -1,14 +1,46 @@
+import asyncio
+import itertools
+import re
 from abc import ABC
+from contextlib import asynccontextmanager
 from contextvars import ContextVar
-from typing import Union, Optional, Mapping, Any, AsyncIterator
+from typing import Union, Optional, Mapping, Any, AsyncIterator, Sequence, Tuple, Dict, List
 
+import psycopg2
+from aiopg import Connection
 from aiopg.sa import SAConnection
 from aiopg.sa.result import RowProxy, ResultProxy
 from aiopg.sa.transaction import Transaction as SATransaction
+from sqlalchemy.engine import Dialect
 
-from repka.repositories.base import GenericIdModel, AsyncBaseRepo, AsyncQueryExecutor
+from repka.repositories.base import (
+    GenericIdModel,
+    AsyncBaseRepo,
+    AsyncQueryExecutor,
+    QueryTimeoutError,
+)
+from repka.repositories.notify import NotifyingQueryExecutor
 from repka.repositories.queries import SqlAlchemyQuery
 
+# Named param of compiled query (%(name)s) or escaped percent (%%)
+_PYFORMAT_TOKEN = re.compile(r"%%|%\((\w+)\)s")
+
+# Savepoint of batch query, batch is rolled back to it on error (aiopg savepoints are sa_savepoint_N)
+_BATCH_SAVEPOINT = "repka_batch"
+
+# Suffixes of server-side cursor names, cursors of nested fetch_stream() calls don't clash
+_cursor_ids = itertools.count()
+
+# statement_timeout (ms, None is DEFAULT) set by SET LOCAL per level of transactions
+# started by executors (outermost first) per connection, _UNKNOWN_TIMEOUT if level is unknown
+_transaction_timeouts: ContextVar[Mapping[Connection, List[Any]]] = ContextVar(
+    "repka_aiopg_transaction_timeouts", default={}
+)
+
+# statement_timeout of transaction after SET LOCAL in its savepoint:
+# it is kept if savepoint is released and reverted if savepoint is rolled back
+_UNKNOWN_TIMEOUT = object()
+
 
 class AiopgRepository(AsyncBaseRepo[GenericIdModel], ABC):
     """
@@ -27,41 +59,244 @@ class AiopgRepository(AsyncBaseRepo[GenericIdModel], ABC):
         else:
             return self.connection_or_context_var.get()
 
+    @property
+    def notify_channel(self) -> Optional[str]:
+        """
+        Channel of NOTIFY sent by write methods with table name and affected ids, disabled if None
+        Notifications are applied to caches by repka.repositories.notify.CacheInvalidationListener
+        """
+        return None
+
     @property
     def query_executor(self) -> AsyncQueryExecutor:
-        return AiopgQueryExecutor(self._connection)
+        query_executor = AiopgQueryExecutor(self._connection, self._timeout)
+        if self.notify_channel:
+            return NotifyingQueryExecutor(query_executor, self.notify_channel)
+        return query_executor
 
 
 class AiopgQueryExecutor(AsyncQueryExecutor):
-    def __init__(self, connection: SAConnection) -> None:
+    # Rows fetched from server-side cursor per round trip by fetch_stream()
+    fetch_size = 1000
+
+    def __init__(self, connection: SAConnection, timeout: float = None) -> None:
+        """:param timeout: Statement timeout in seconds, disabled if None or 0"""
         self._connection = connection
+        self.timeout = timeout
 
     async def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
-        rows: ResultProxy = await self._connection.execute(query, **sa_params)
+        rows = await self._execute(query, **sa_params)
         row: RowProxy = await rows.first()
         return row
 
     async def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> AsyncIterator[Mapping]:
-        return await self._connection.execute(query, **sa_params)
+        return await self._execute(query, **sa_params)
 
     async def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
-        return await self._connection.scalar(query, **sa_params)
+        rows = await self._execute(query, **sa_params)
+        return await rows.scalar()
+
+    async def fetch_stream(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        """aiopg fetches all rows of query at once, so rows are streamed via server-side cursor"""
+        return self._cursor(query, sa_params)
 
     async def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
-        rows = await self._connection.execute(query, **sa_params)
+        rows = await self._execute(query, **sa_params)
         row = await rows.first()
         return row
 
     async def insert_many(
         self, query: SqlAlchemyQuery, **sa_params: Any
     ) -> AsyncIterator[Mapping]:
-        return await self._connection.execute(query, **sa_params)
+        return await self._execute(query, **sa_params)
+
+    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        result = await self._execute(query, **sa_params)
+        return result.rowcount
+
+    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        result = await self._execute(query, **sa_params)
+        return result.rowcount
+
+    @asynccontextmanager
+    async def execute_in_transaction(self) -> AsyncIterator[SATransaction]:
+        async with self._tracking_statement_timeout(), self._connection.begin() as transaction:
+            yield transaction
+
+    @property
+    def connection_key(self) -> Any:
+        return self._connection
+
+    async def execute_batch(self, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]) -> None:
+        """
+        Execute queries via single multi-statement query (single round trip)
+
+        Savepoint is created and released by the same multi-statement query,
+        if batch fails, it is rolled back to savepoint and queries are executed one by one
+        to find failed query. Single query is executed as is.
+        Must be called in transaction (savepoint is not allowed out of transaction block)
+        """
+        if len(queries) == 1:
+            await super().execute_batch(queries)
+            return
+
+        sql, params = compile_batch(queries, self._connection._dialect)
+        try:
+            await self._execute(
+                f"SAVEPOINT {_BATCH_SAVEPOINT};\n{sql};\nRELEASE SAVEPOINT {_BATCH_SAVEPOINT}",
+                params,
+            )
+        except Exception:
+            await self._connection.execute(f"ROLLBACK TO SAVEPOINT {_BATCH_SAVEPOINT}")
+            await super().execute_batch(queries)
+            await self._connection.execute(f"RELEASE SAVEPOINT {_BATCH_SAVEPOINT}")
 
-    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> None:
-        return await self._connection.execute(query, **sa_params)
+    async def _execute(self, query: Any, *multiparams: Any, **sa_params: Any) -> ResultProxy:
+        """
+        Execute query with statement timeout of executor
 
-    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> None:
-        await self._connection.execute(query, **sa_params)
+        If timeout is set, query is cancelled on backend when awaiting task is cancelled
+        (aiopg closes connection on cancellation otherwise)
+        """
+        reset_timeout = await self._set_statement_timeout()
+        try:
+            if not self.timeout:
+                return await self._connection.execute(query, *multiparams, **sa_params)
+
+            execution = asyncio.ensure_future(
+                self._connection.execute(query, *multiparams, **sa_params)
+            )
+            try:
+                return await asyncio.shield(execution)
+            except asyncio.CancelledError:
+                if execution.done():
+                    # aiopg raises CancelledError if query is cancelled by statement_timeout
+                    raise QueryTimeoutError(self.timeout) from None
+                await self._cancel_backend_query(execution)
+                raise
+        finally:
+            if reset_timeout and not self._connection.closed:
+                await self._connection.execute("RESET statement_timeout")
+
+    async def _set_statement_timeout(self) -> bool:
+        """
+        Set statement_timeout of connection to executor timeout (DEFAULT if timeout is disabled)
+
+        In transaction it is set by SET LOCAL (it is reset on transaction end) if it differs
+        from current value, which is known in transactions started by execute_in_transaction only.
+        Out of transaction it is set for session if timeout is set, so it must be reset after query
+        (connection returned to pool keeps DEFAULT)
+
+        :return: True if session statement_timeout is set
+        """
+        timeout_ms = int(self.timeout * 1000) if self.timeout else None
+        if not self._connection.in_transaction:
+            if timeout_ms is None:
+                return False
+            await self._connection.execute(f"SET statement_timeout = {timeout_ms}")
+            return True
+
+        levels = _transaction_timeouts.get().get(self._connection.connection)
+        if levels and levels[-1] == timeout_ms:
+            return False
+
+        value = "DEFAULT" if timeout_ms is None else timeout_ms
+        await self._connection.execute(f"SET LOCAL statement_timeout = {value}")
+        if levels:
+            levels[:-1] = [_UNKNOWN_TIMEOUT] * (len(levels) - 1)
+            levels[-1] = timeout_ms
+        return False
+
+    @asynccontextmanager
+    async def _tracking_statement_timeout(self) -> AsyncIterator[None]:
+        """
+        Track statement_timeout set by SET LOCAL in transaction (or savepoint) started in block
+
+        Transaction starts with statement_timeout of outer one, DEFAULT for outermost one
+        (unknown if it is started in transaction started by aiopg directly)
+        """
+        connection = self._connection.connection
+        levels = _transaction_timeouts.get().get(connection)
+        token = None
+        if not levels:
+            levels = []
+            token = _transaction_timeouts.set({**_transaction_timeouts.get(), connection: levels})
+        if levels:
+            levels.append(levels[-1])
+        else:
+            levels.append(_UNKNOWN_TIMEOUT if self._connection.in_transaction else None)
+        try:
+            yield
+        finally:
+            levels.pop()
+            if token:
+                _transaction_timeouts.reset(token)
+
+    async def _cursor(self, query: SqlAlchemyQuery, sa_params: Mapping) -> AsyncIterator[Mapping]:
+        """
+        Fetch rows from server-side cursor by chunks of {fetch_size}
+
+        Cursors work only in transaction, so transaction is started (or savepoint if already in one)
+        """
+        sql, params = compile_batch([(query, sa_params)], self._connection._dialect)
+        name = f"repka_cursor_{next(_cursor_ids)}"
+        async with self._tracking_statement_timeout(), self._connection.begin_nested():
+            await self._execute(f"DECLARE {name} NO SCROLL CURSOR FOR {sql}", params)
+            while True:
+                result = await self._execute(f"FETCH {self.fetch_size} FROM {name}")
+                rows = await result.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            await self._execute(f"CLOSE {name}")
+
+    async def _cancel_backend_query(self, execution: "asyncio.Future[Any]") -> None:
+        """Send cancel request to backend and wait for query end, connection stays usable"""
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._connection.connection.raw.cancel)
+        except psycopg2.Error:
+            execution.cancel()
+        await asyncio.gather(execution, return_exceptions=True)
+
+
+def compile_batch(
+    queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]], dialect: Dialect
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Compile queries to single multi-statement query with pyformat params
+
+    Params of every query are prefixed with query index to avoid name collisions
+
+    >>> import sqlalchemy as sa
+    >>> from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+    >>> t = sa.table("t", sa.column("a"))
+    >>> sql, params = compile_batch(
+    ...     [(t.delete().where(t.c.a == 1), {}), (sa.text("select :a || '%'"), {"a": "b"})],
+    ...     PGDialect_psycopg2(),
+    ... )
+    >>> print(sql)
+    DELETE FROM t WHERE t.a = %(q0_a_1)s;
+    select %(q1_a)s || '%%'
+    >>> params
+    {'q0_a_1': 1, 'q1_a': 'b'}
+    """
+    statements = []
+    batch_params = {}
+    for index, (query, sa_params) in enumerate(queries):
+        compiled = query.compile(dialect=dialect)
+        prefix = f"q{index}_"
+        for key, value in compiled.construct_params(sa_params).items():
+            bind_processor = compiled._bind_processors.get(key)
+            batch_params[prefix + key] = bind_processor(value) if bind_processor else value
+        statements.append(
+            _PYFORMAT_TOKEN.sub(
+                lambda match: f"%({prefix}{match[1]})s" if match[1] else match[0],
+                compiled.string,
+            )
+        )
 
-    def execute_in_transaction(self) -> SATransaction:
-        return self._connection.begin()
+    return ";\n".join(statements), batch_params
@@ -0,0 +1,224 @@
+import asyncio
+from abc import ABC
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Union, Optional, Mapping, Any, AsyncIterator, Tuple, List, Dict
+
+import asyncpg
+from asyncpg.pool import Pool
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+
+from repka.repositories.base import (
+    GenericIdModel,
+    AsyncBaseRepo,
+    AsyncQueryExecutor,
+    QueryTimeoutError,
+)
+from repka.repositories.queries import SqlAlchemyQuery
+from repka.utils import model_to_primitive
+
+PoolOrConnection = Union[Pool, asyncpg.Connection]
+
+# Connections acquired from pools by execute_in_transaction(): pool => connection
+# Repository methods called inside the transaction block use these connections
+_transaction_connections: ContextVar[Mapping[Pool, asyncpg.Connection]] = ContextVar(
+    "repka_asyncpg_transaction_connections", default={}
+)
+
+# Dialect is used only for query compilation, pyformat params are converted to asyncpg $n params
+_dialect = PGDialect_psycopg2(paramstyle="pyformat")
+
+
+class AsyncpgRepository(AsyncBaseRepo[GenericIdModel], ABC):
+    """
+    Execute sql-queries, convert sql-row-dicts to/from pydantic models via asyncpg
+    """
+
+    def __init__(
+        self,
+        pool_or_connection_or_context_var: Union[PoolOrConnection, ContextVar[PoolOrConnection]],
+    ) -> None:
+        self.pool_or_connection_or_context_var = pool_or_connection_or_context_var
+
+    @property
+    def _pool_or_connection(self) -> PoolOrConnection:
+        if isinstance(self.pool_or_connection_or_context_var, ContextVar):
+            return self.pool_or_connection_or_context_var.get()
+        else:
+            return self.pool_or_connection_or_context_var
+
+    @property
+    def query_executor(self) -> AsyncQueryExecutor:
+        return AsyncpgQueryExecutor(self._pool_or_connection, self._timeout)
+
+    def serialize(self, entity: GenericIdModel) -> Dict:
+        """
+        Convert pydantic model to dict with python primitives
+
+        asyncpg uses binary protocol, so it accepts only python objects (e.g. date, not str)
+        """
+        return model_to_primitive(
+            entity, without_id=True, exclude=self._join_fields(), keep_python_primitives=True
+        )
+
+
+class AsyncpgQueryExecutor(AsyncQueryExecutor):
+    """
+    Execute queries via asyncpg
+
+    SQLAlchemy queries are compiled to SQL with $n params,
+    asyncpg caches prepared statements for them by itself
+
+    Statement timeout is passed to asyncpg,
+    it cancels query on backend on timeout or cancellation of awaiting task
+    """
+
+    # Rows prefetched by cursor in fetch_all()
+    prefetch = 1000
+
+    def __init__(self, pool_or_connection: PoolOrConnection, timeout: float = None) -> None:
+        """:param timeout: Statement timeout in seconds, disabled if None or 0"""
+        self._pool_or_connection = pool_or_connection
+        self.timeout = timeout or None
+
+    async def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
+        sql, args = compile_query(query, sa_params)
+        async with self._acquire_for_query() as connection:
+            return await connection.fetchrow(sql, *args, timeout=self.timeout)
+
+    async def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> AsyncIterator[Mapping]:
+        return self._cursor(*compile_query(query, sa_params))
+
+    async def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
+        sql, args = compile_query(query, sa_params)
+        async with self._acquire_for_query() as connection:
+            return await connection.fetchval(sql, *args, timeout=self.timeout)
+
+    async def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
+        sql, args = compile_query(query, sa_params)
+        async with self._acquire_for_query() as connection:
+            return await connection.fetchrow(sql, *args, timeout=self.timeout)
+
+    async def insert_many(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        sql, args = compile_query(query, sa_params)
+        async with self._acquire_for_query() as connection:
+            rows = await connection.fetch(sql, *args, timeout=self.timeout)
+        return _list_aiter(rows)
+
+    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        sql, args = compile_query(query, sa_params)
+        async with self._acquire_for_query() as connection:
+            status = await connection.execute(sql, *args, timeout=self.timeout)
+        return _status_rowcount(status)
+
+    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        sql, args = compile_query(query, sa_params)
+        async with self._acquire_for_query() as connection:
+            status = await connection.execute(sql, *args, timeout=self.timeout)
+        return _status_rowcount(status)
+
+    @asynccontextmanager
+    async def execute_in_transaction(self) -> AsyncIterator[Any]:
+        """
+        Execute queries in transaction, nested calls create savepoints
+
+        If executor uses pool, connection is acquired for the whole transaction
+        """
+        async with self._acquire() as connection:
+            token = None
+            if isinstance(self._pool_or_connection, Pool):
+                token = _transaction_connections.set(
+                    {**_transaction_connections.get(), self._pool_or_connection: connection}
+                )
+            try:
+                async with connection.transaction() as transaction:
+                    yield transaction
+            finally:
+                if token:
+                    _transaction_connections.reset(token)
+
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        """Get connection of current transaction, pool connection or executor connection"""
+        if not isinstance(self._pool_or_connection, Pool):
+            yield self._pool_or_connection
+        elif self._pool_or_connection in _transaction_connections.get():
+            yield _transaction_connections.get()[self._pool_or_connection]
+        else:
+            async with self._pool_or_connection.acquire() as connection:
+                yield connection
+
+    @asynccontextmanager
+    async def _acquire_for_query(self) -> AsyncIterator[asyncpg.Connection]:
+        """Get connection by _acquire(), asyncpg query timeout is raised as QueryTimeoutError"""
+        async with self._acquire() as connection:
+            try:
+                yield connection
+            except asyncio.TimeoutError as error:
+                if self.timeout is None:
+                    raise
+                raise QueryTimeoutError(self.timeout) from error
+
+    async def _cursor(self, sql: str, args: List[Any]) -> AsyncIterator[Mapping]:
+        """
+        Stream rows via server-side cursor
+
+        Cursors work only in transaction, so transaction is started (or savepoint if already in one)
+        """
+        async with self._acquire_for_query() as connection:
+            async with connection.transaction():
+                cursor = connection.cursor(
+                    sql, *args, prefetch=self.prefetch, timeout=self.timeout
+                )
+                async for row in cursor:
+                    yield row
+
+
+def compile_query(query: SqlAlchemyQuery, sa_params: Mapping = None) -> Tuple[str, List[Any]]:
+    """
+    Compile SQLAlchemy query to SQL with asyncpg params ($1, $2, ...) and list of param values
+
+    >>> import sqlalchemy as sa
+    >>> compile_query(sa.text("select :aue as col, :aue + 1"), {"aue": 1})
+    ('select $1 as col, $1 + 1', [1])
+    >>> t = sa.Table("t", sa.MetaData(), sa.Column("a", sa.Integer), sa.Column("b", onupdate=0))
+    >>> compile_query(t.update().values(a=1))
+    ('UPDATE t SET a=$1, b=$2', [1, 0])
+    """
+    compiled = query.compile(dialect=_dialect)
+    params = compiled.construct_params(sa_params)
+
+    # Python side column defaults (default=, onupdate=) are set by SQLAlchemy on execution,
+    # so set them manually
+    defaults = [
+        *((column, column.default) for column in getattr(compiled, "insert_prefetch", ())),
+        *((column, column.onupdate) for column in getattr(compiled, "update_prefetch", ())),
+    ]
+    for column, default in defaults:
+        params[column.key] = default.arg if default.is_scalar else default.arg(None)
+
+    args = []
+    positions = {}
+    for position, (key, value) in enumerate(params.items(), start=1):
+        bind_processor = compiled._bind_processors.get(key)
+        args.append(bind_processor(value) if bind_processor else value)
+        positions[key] = f"${position}"
+
+    return compiled.string % positions, args
+
+
+def _status_rowcount(status: str) -> int:
+    """
+    Get number of affected rows from command status returned by asyncpg execute()
+
+    >>> _status_rowcount("DELETE 3")
+    3
+    """
+    return int(status.rsplit(" ", 1)[-1])
+
+
+async def _list_aiter(rows: List[Mapping]) -> AsyncIterator[Mapping]:
+    for row in rows:
+        yield row
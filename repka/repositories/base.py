@@ -1,4 +1,10 @@
+import asyncio
+import copy
+import sys
+import traceback
 from abc import abstractmethod, ABC
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
 from typing import (
     TypeVar,
@@ -14,14 +20,28 @@ from typing import (
     Mapping,
     Set,
     AsyncIterator,
+    Union,
+    overload,
+    Callable,
+    Iterable,
+    Awaitable,
 )
 
 import sqlalchemy as sa
 import typing_inspect
 from pydantic import BaseModel
 from sqlalchemy import Table
-from sqlalchemy.sql.elements import BinaryExpression
-
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import BinaryExpression, ColumnElement
+from sqlalchemy.sql.util import find_tables
+from typing_extensions import Literal
+
+from repka.repositories.cache import QueryCache, query_cache_key
+from repka.repositories.columns import ColumnsBuffer, ColumnValues
+from repka.repositories.lazy import LazyEntity
+from repka.repositories.export import ExportFormat, ExportSink, ExportWriter, RecordEncoder
+from repka.repositories.parallel import ProcessPoolDeserializer
 from repka.repositories.queries import (
     SelectQuery,
     Filters,
@@ -31,8 +51,16 @@ from repka.repositories.queries import (
     DeleteQuery,
     SqlAlchemyQuery,
     InsertManyQuery,
+    Join,
+    JoinedSelectQuery,
+)
+from repka.utils import (
+    model_to_primitive,
+    is_field_equal_to_default,
+    mixed_zip,
+    aiter_to_list,
+    chunked,
 )
-from repka.utils import model_to_primitive, is_field_equal_to_default, mixed_zip, aiter_to_list
 
 Created = bool
 
@@ -44,9 +72,23 @@ class IdModel(BaseModel):
 
 
 GenericIdModel = TypeVar("GenericIdModel", bound=IdModel)
+T = TypeVar("T")
+AsyncRepo = TypeVar("AsyncRepo", bound="AsyncBaseRepo")
+
+
+class QueryTimeoutError(asyncio.TimeoutError):
+    """Query was cancelled because it exceeded statement timeout of executor"""
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__(f"Query exceeded statement timeout of {timeout}s")
+        self.timeout = timeout
 
 
 class AsyncQueryExecutor:
+    # Statement timeout in seconds, disabled if None or 0
+    # Query exceeding it is cancelled on DB side and QueryTimeoutError is raised
+    timeout: Optional[float] = None
+
     @abstractmethod
     async def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
         """Execute SELECT query and return first result row"""
@@ -59,6 +101,15 @@ class AsyncQueryExecutor:
     async def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
         """Execute SELECT query and return first column of first result row"""
 
+    async def fetch_stream(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        """
+        Execute SELECT query and return result rows fetched from DB by chunks, rows are not cached
+        Same as fetch_all() by default, executors fetching all rows at once override it
+        """
+        return await self.fetch_all(query, **sa_params)
+
     @abstractmethod
     async def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
         """Execute INSERT query and return returning columns"""
@@ -70,21 +121,316 @@ class AsyncQueryExecutor:
         """Execute INSERT query and return list of returning columns"""
 
     @abstractmethod
-    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> None:
-        """Execute UPDATE query"""
+    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        """Execute UPDATE query and return number of updated rows"""
 
     @abstractmethod
-    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> None:
-        """Execute DELETE query"""
+    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        """Execute DELETE query and return number of deleted rows"""
 
     @abstractmethod
     def execute_in_transaction(self) -> Any:
         """Execute queries in transaction"""
 
+    @property
+    def connection_key(self) -> Any:
+        """
+        Connection used by executor, queries of pipelined transaction are queued per connection
+        Pipelining is disabled if None
+        """
+        return None
+
+    async def execute_batch(self, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]) -> None:
+        """
+        Execute queries without results (UPDATE, DELETE) in order
+
+        Queries are executed one by one by default, executors may send them in single batch
+
+        :raise PipelineError with index of failed query
+        """
+        for index, (query, sa_params) in enumerate(queries):
+            try:
+                await self.update(query, **sa_params)
+            except Exception as error:
+                raise PipelineError(error, index) from error
+
+
+# ==============
+# PIPELINING
+# ==============
+
 
-class AsyncBaseRepo(Generic[GenericIdModel], ABC):
+class PipelineError(Exception):
     """
-    Execute sql-queries, convert sql-row-dicts to/from pydantic models in async way
+    Error of query queued by pipelined transaction
+
+    {query} and {origin} (stack of repository call that queued the query) are set if failed query is known
+    """
+
+    def __init__(self, error: Exception, index: Optional[int] = None) -> None:
+        super().__init__(error)
+        self.error = error
+        self.index = index
+        self.query: Optional[SqlAlchemyQuery] = None
+        self.origin: Optional[traceback.StackSummary] = None
+
+    def __str__(self) -> str:
+        if not self.origin:
+            return str(self.error)
+        origin = "".join(self.origin.format())
+        return f"{self.error}\nQuery was queued at (most recent call first):\n{origin}"
+
+
+@dataclass
+class QueuedQuery:
+    query: SqlAlchemyQuery
+    sa_params: Mapping
+    origin: traceback.StackSummary
+
+
+class QueryPipeline:
+    """Queries without results queued by pipelined transaction"""
+
+    # Frames of repository call stored for error reporting
+    origin_frames = 8
+
+    def __init__(self, query_executor: AsyncQueryExecutor) -> None:
+        self.query_executor = query_executor
+        self.queries: List[QueuedQuery] = []
+
+    def queue(self, query: SqlAlchemyQuery, sa_params: Mapping, stack_skip: int = 1) -> None:
+        """
+        Queue query, stack of caller is saved to report errors
+
+        :param stack_skip: Number of caller frames that are not saved
+        """
+        frame = sys._getframe(stack_skip + 1)
+        origin = traceback.StackSummary.extract(
+            traceback.walk_stack(frame), limit=self.origin_frames, lookup_lines=False
+        )
+        self.queries.append(QueuedQuery(query, sa_params, origin))
+
+    async def flush(self) -> None:
+        """
+        Execute queued queries
+
+        :raise PipelineError with failed query and origin of its repository call
+        """
+        queued, self.queries = self.queries, []
+        if not queued:
+            return
+
+        try:
+            await self.query_executor.execute_batch([(q.query, q.sa_params) for q in queued])
+        except PipelineError as error:
+            if error.index is not None:
+                error.query = queued[error.index].query
+                error.origin = queued[error.index].origin
+            raise
+
+    def discard(self) -> None:
+        self.queries = []
+
+
+# Pipelines of pipelined transactions: executor connection key => pipeline
+_pipelines: ContextVar[Mapping[Any, QueryPipeline]] = ContextVar("repka_pipelines", default={})
+
+
+class PipelinedQueryExecutor(AsyncQueryExecutor):
+    """
+    Queue queries without results (UPDATE, DELETE) to {pipeline},
+    queued queries are executed before other queries and on commit
+
+    Number of affected rows is unknown for queued queries, so update() and delete() return -1
+    """
+
+    def __init__(self, query_executor: AsyncQueryExecutor, pipeline: QueryPipeline) -> None:
+        self.query_executor = query_executor
+        self.pipeline = pipeline
+
+    async def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
+        await self.pipeline.flush()
+        return await self.query_executor.fetch_one(query, **sa_params)
+
+    async def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> AsyncIterator[Mapping]:
+        await self.pipeline.flush()
+        return await self.query_executor.fetch_all(query, **sa_params)
+
+    async def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
+        await self.pipeline.flush()
+        return await self.query_executor.fetch_val(query, **sa_params)
+
+    async def fetch_stream(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        await self.pipeline.flush()
+        return await self.query_executor.fetch_stream(query, **sa_params)
+
+    async def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
+        await self.pipeline.flush()
+        return await self.query_executor.insert(query, **sa_params)
+
+    async def insert_many(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        await self.pipeline.flush()
+        return await self.query_executor.insert_many(query, **sa_params)
+
+    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        self.pipeline.queue(query, sa_params)
+        return -1
+
+    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        self.pipeline.queue(query, sa_params)
+        return -1
+
+    @asynccontextmanager
+    async def execute_in_transaction(self) -> AsyncIterator[Any]:
+        """
+        Execute queries in nested transaction
+
+        Queries queued in the block are executed before block commit, dropped on block error
+        """
+        await self.pipeline.flush()
+        async with self.query_executor.execute_in_transaction() as transaction:
+            try:
+                yield transaction
+            except BaseException:
+                self.pipeline.discard()
+                raise
+            await self.pipeline.flush()
+
+    @property
+    def connection_key(self) -> Any:
+        return self.query_executor.connection_key
+
+    async def execute_batch(self, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]) -> None:
+        await self.query_executor.execute_batch(queries)
+
+
+def _total_count(counts: Sequence[int]) -> int:
+    """Total number of affected rows, -1 if number is unknown for any query (it was queued)"""
+    return -1 if -1 in counts else sum(counts)
+
+
+def pipelined(query_executor: AsyncQueryExecutor) -> AsyncQueryExecutor:
+    """Wrap {query_executor} to queue queries to pipeline if called in pipelined transaction"""
+    key = query_executor.connection_key
+    pipeline = _pipelines.get().get(key) if key is not None else None
+    return PipelinedQueryExecutor(query_executor, pipeline) if pipeline else query_executor
+
+
+# Caches of repositories used in current execute_in_transaction() block: (cache, table name)
+# Cache is not used in transactions, these tables are invalidated on transaction end
+_transaction_tables: ContextVar[Optional[Set[Tuple[QueryCache, str]]]] = ContextVar(
+    "repka_transaction_tables", default=None
+)
+
+
+class CachingQueryExecutor(AsyncQueryExecutor):
+    """
+    Return results of SELECT queries from {cache},
+    invalidate tables written by INSERT, UPDATE and DELETE queries
+    """
+
+    def __init__(self, query_executor: AsyncQueryExecutor, cache: QueryCache) -> None:
+        self.query_executor = query_executor
+        self.cache = cache
+
+    async def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
+        return await self._fetch_cached(self.query_executor.fetch_one, query, sa_params)
+
+    async def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> AsyncIterator[Mapping]:
+        async def _fetch_rows(query: SqlAlchemyQuery, **sa_params: Any) -> List[Mapping]:
+            return await aiter_to_list(await self.query_executor.fetch_all(query, **sa_params))
+
+        rows = await self._fetch_cached(_fetch_rows, query, sa_params)
+        return _list_aiter(rows)
+
+    async def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
+        return await self._fetch_cached(self.query_executor.fetch_val, query, sa_params)
+
+    async def fetch_stream(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        # Streamed rows are not cached: caching requires all of them in memory
+        return await self.query_executor.fetch_stream(query, **sa_params)
+
+    async def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
+        return await self._write(self.query_executor.insert, query, sa_params)
+
+    async def insert_many(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        return await self._write(self.query_executor.insert_many, query, sa_params)
+
+    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        return await self._write(self.query_executor.update, query, sa_params)
+
+    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        return await self._write(self.query_executor.delete, query, sa_params)
+
+    def execute_in_transaction(self) -> Any:
+        return self.query_executor.execute_in_transaction()
+
+    @property
+    def connection_key(self) -> Any:
+        return self.query_executor.connection_key
+
+    async def execute_batch(self, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]) -> None:
+        try:
+            await self.query_executor.execute_batch(queries)
+        finally:
+            for query, _ in queries:
+                self._invalidate(query)
+
+    async def _fetch_cached(
+        self, fetch: Callable[..., Awaitable[T]], query: SqlAlchemyQuery, sa_params: Mapping
+    ) -> T:
+        if isinstance(query, UpdateBase):
+            # UPDATE ... RETURNING, DELETE ... RETURNING, etc.
+            return await self._write(fetch, query, sa_params)
+        if not isinstance(query, Select):
+            return await fetch(query, **sa_params)
+
+        key = query_cache_key(query, sa_params)
+        tables = sorted({table.name for table in find_tables(query, include_joins=True)})
+        found, value = self.cache.get(key, tables)
+        if found:
+            return value
+
+        versions = self.cache.get_versions(tables)
+        value = await fetch(query, **sa_params)
+        self.cache.set(key, tables, value, versions)
+        return value
+
+    async def _write(
+        self, write: Callable[..., Awaitable[T]], query: SqlAlchemyQuery, sa_params: Mapping
+    ) -> T:
+        """
+        Execute write query and invalidate its table after it (even if it failed):
+        results of reads executed concurrently with the write could be cached before its commit
+        """
+        try:
+            return await write(query, **sa_params)
+        finally:
+            self._invalidate(query)
+
+    def _invalidate(self, query: SqlAlchemyQuery) -> None:
+        table = getattr(query, "table", None)
+        if table is not None:
+            self.cache.invalidate(table.name)
+
+
+async def _list_aiter(items: List[T]) -> AsyncIterator[T]:
+    for item in items:
+        yield item
+
+
+class BaseRepo(Generic[GenericIdModel], ABC):
+    """
+    Repository configuration shared by async and sync repositories:
+    table definition and conversion of sql-row-dicts to/from pydantic models
     """
 
     # =============
@@ -105,20 +451,178 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
         """
         return []
 
+    # Max number of ids passed to single query by get_by_ids_map() and prefetch()
+    ids_chunk_size = 10_000
+
+    @property
+    def refresh_on_update(self) -> Sequence[str]:
+        """
+        Columns computed by DB on update (e.g. updated_at set by trigger)
+        These columns are returned by UPDATE query and set to entity after update
+        """
+        return []
+
+    @property
+    def query_cache(self) -> Optional[QueryCache]:
+        """
+        Cache of SELECT query results (get_all(), exists(), etc.), disabled if None
+        Cache entries of table are invalidated by write methods (insert*, update*, delete*)
+        of repositories using the same cache, cache is not used in execute_in_transaction()
+        """
+        return None
+
+    @property
+    def joins(self) -> Sequence[Join]:
+        """
+        Tables joined by *_joined methods (e.g. get_all_joined()),
+        their rows are set to entity fields as nested models in single query
+
+        Usage:
+
+        class OrderRepo(AiopgRepository[Order]):
+            table = orders_table
+            joins = [
+                Join(customers_table, orders_table.c.customer_id == customers_table.c.id, "customer", Customer)
+            ]
+        """
+        return []
+
     def serialize(self, entity: GenericIdModel) -> Dict:
         """Convert pydantic model to dict"""
-        return model_to_primitive(entity, without_id=True)
+        return model_to_primitive(entity, without_id=True, exclude=self._join_fields())
 
     def deserialize(self, **kwargs: Any) -> GenericIdModel:
         """Create pydantic model from kwargs"""
         entity_type = self._get_generic_type()
         return entity_type(**kwargs)
 
+    def update_by_id_query(self, entity: GenericIdModel, values: Mapping) -> SqlAlchemyQuery:
+        """Create UPDATE query of entity {values} returning {refresh_on_update} columns"""
+        assert entity.id
+        returning_columns = [self.table.c[column] for column in self.refresh_on_update]
+        return UpdateQuery.by_id(
+            entity.id, self.table, values, returning_columns=returning_columns
+        )()
+
+    def refresh_entity(self, entity: GenericIdModel, row: Optional[Mapping]) -> GenericIdModel:
+        """Set {refresh_on_update} columns returned by UPDATE query to entity"""
+        if row:
+            for column in self.refresh_on_update:
+                setattr(entity, column, row[column])
+        return entity
+
+    def resolve_columns(self, columns: Columns) -> List[sa.Column]:
+        """Get table columns by names (columns are returned as is)"""
+        return [self.table.c[column] if isinstance(column, str) else column for column in columns]
+
+    def aggregate_query(
+        self,
+        metrics: Mapping[str, ColumnElement],
+        group_by: Columns = None,
+        filters: Filters = None,
+        orders: Columns = None,
+    ) -> SqlAlchemyQuery:
+        """Create SELECT query of {group_by} columns and labeled {metrics}"""
+        group_columns = self.resolve_columns(group_by or [])
+        select_columns = [
+            *group_columns,
+            *(metric.label(name) for name, metric in metrics.items()),
+        ]
+        return SelectQuery(
+            self.table, filters or [], orders or [], select_columns, group_columns
+        )()
+
+    def ids_filter(self, entity_ids: Sequence[int]) -> BinaryExpression:
+        """
+        Filter entities with id in {entity_ids}
+
+        Ids are passed as single array param (id = ANY(:ids)), so query size doesn't depend
+        on number of ids. Override it for databases without arrays (e.g. with table.c.id.in_)
+        """
+        ids_param = sa.literal(list(entity_ids), type_=sa.ARRAY(self.table.c.id.type))
+        return self.table.c.id == sa.any_(ids_param)
+
+    @property
+    @abstractmethod
+    def query_executor(self) -> Any:
+        """Query executor instance"""
+
+    # ==============
+    # PROTECTED & PRIVATE METHODS
+    # ==============
+
+    def _join_fields(self) -> List[str]:
+        """Entity fields of joined models, they are not stored in table"""
+        return [join.field for join in self.joins]
+
+    def _deserialize_joined(self, row: Mapping) -> GenericIdModel:
+        """Create entity with nested models of joined tables from row of JoinedSelectQuery"""
+        values = {column.key: row[column.key] for column in self.table.c}
+        for join in self.joins:
+            join_values = {column.key: row[join.label(column)] for column in join.table.c}
+            has_row = any(value is not None for value in join_values.values())
+            values[join.field] = join.model_type(**join_values) if has_row else None
+        return self.deserialize(**values)
+
+    def _export_record(self, entity: GenericIdModel) -> Dict:
+        """Serialize entity for export()"""
+        return {"id": entity.id, **self.serialize(entity)}
+
+    def _process_pool_model_type(self) -> Type[GenericIdModel]:
+        """Entity type created by process pool workers (they don't have repository instance)"""
+        if type(self).deserialize is not BaseRepo.deserialize:
+            raise ValueError(
+                "process_pool can't be used with overridden deserialize(): "
+                "entities are created as entity_type(**row) by worker processes"
+            )
+        return self._get_generic_type()
+
+    def _lazy_model_type(self) -> Type[GenericIdModel]:
+        """Entity type which fields are used by LazyEntity to convert row values"""
+        if type(self).deserialize is not BaseRepo.deserialize:
+            raise ValueError(
+                "get_all_lazy() can't be used with overridden deserialize(): "
+                "fields of lazy entities are converted by entity_type fields bypassing it"
+            )
+        return self._get_generic_type()
+
+    def _get_generic_type(self) -> Type[GenericIdModel]:
+        """
+        Get generic type of inherited BaseRepository:
+
+        >>> class TransactionRepo(AiopgRepository[Transaction]):
+        ...     table = transactions_table
+        ... # doctest: +SKIP
+        >>> assert TransactionRepo().__get_generic_type() is Transaction # doctest: +SKIP
+        """
+        return cast(
+            Type[GenericIdModel],
+            typing_inspect.get_args(typing_inspect.get_generic_bases(self)[-1])[0],
+        )
+
+
+class AsyncBaseRepo(BaseRepo[GenericIdModel], ABC):
+    """
+    Execute sql-queries, convert sql-row-dicts to/from pydantic models in async way
+    """
+
     @property
     @abstractmethod
     def query_executor(self) -> AsyncQueryExecutor:
         """repka.repositories.base.AsyncQueryExecutor instance"""
 
+    @property
+    def query_timeout(self) -> Optional[float]:
+        """
+        Default statement timeout of queries in seconds, disabled if None
+        Query exceeding it is cancelled on DB side and QueryTimeoutError is raised,
+        timeout of particular calls is set by with_timeout()
+        """
+        return None
+
+    # Timeout set by with_timeout(), overrides {query_timeout}
+    _call_timeout: Optional[float] = None
+
     # ==============
     # SELECT METHODS
     # ==============
@@ -128,9 +632,17 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
     ) -> Optional[GenericIdModel]:
         """Get first entity from DB matching filters and orders"""
         query = SelectQuery(self.table, filters, orders or [])()
-        row = await self.query_executor.fetch_one(query)
+        row = await self._query_executor.fetch_one(query)
         return self.deserialize(**row) if row else None
 
+    async def first_joined(
+        self, *filters: BinaryExpression, orders: Columns = None
+    ) -> Optional[GenericIdModel]:
+        """Same as first() but entity fields of {joins} are set via single joined query"""
+        query = JoinedSelectQuery(self.table, self.joins, filters, orders or [])()
+        row = await self._query_executor.fetch_one(query)
+        return self._deserialize_joined(row) if row else None
+
     async def get_by_id(self, entity_id: int) -> Optional[GenericIdModel]:
         """Get entity from DB with id = {entity_id}"""
         return await self.first(self.table.c.id == entity_id)
@@ -148,19 +660,105 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
         return entity, True
 
     async def get_all(
-        self, filters: Filters = None, orders: Columns = None
+        self,
+        filters: Filters = None,
+        orders: Columns = None,
+        process_pool: ProcessPoolDeserializer = None,
     ) -> List[GenericIdModel]:
-        """Get all entities from DB matching filters and orders"""
-        return await aiter_to_list(await self.get_all_aiter(filters, orders))
+        """
+        Get all entities from DB matching filters and orders
+
+        :param process_pool: Create entities from batches of rows in process pool
+            (for large result sets, repository deserialize() is not used)
+        """
+        return await aiter_to_list(await self.get_all_aiter(filters, orders, process_pool))
 
     async def get_all_aiter(
-        self, filters: Filters = None, orders: Columns = None
+        self,
+        filters: Filters = None,
+        orders: Columns = None,
+        process_pool: ProcessPoolDeserializer = None,
     ) -> AsyncIterator[GenericIdModel]:
         """Get all entities from DB matching filters and orders as an async iterator"""
         query = SelectQuery(self.table, filters or [], orders or [])()
-        rows = await self.query_executor.fetch_all(query)
+        rows = await self._query_executor.fetch_all(query)
+        if process_pool:
+            return process_pool.deserialize_aiter(self._process_pool_model_type(), rows)
         return self._rows_to_entities(rows)
 
+    async def get_all_joined(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> List[GenericIdModel]:
+        """Same as get_all() but entity fields of {joins} are set via single joined query"""
+        return await aiter_to_list(await self.get_all_joined_aiter(filters, orders))
+
+    async def get_all_joined_aiter(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> AsyncIterator[GenericIdModel]:
+        """Same as get_all_joined() but returns an async iterator"""
+        query = JoinedSelectQuery(self.table, self.joins, filters or [], orders or [])()
+        rows = await self._query_executor.fetch_all(query)
+        return (self._deserialize_joined(row) async for row in rows)
+
+    async def get_all_lazy(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> List[LazyEntity[GenericIdModel]]:
+        """
+        Same as get_all() but returns row-backed entity proxies (LazyEntity),
+        which convert fields on access and create entity only when needed (e.g. on update)
+        """
+        return await aiter_to_list(await self.get_all_lazy_aiter(filters, orders))
+
+    async def get_all_lazy_aiter(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> AsyncIterator[LazyEntity[GenericIdModel]]:
+        """
+        Same as get_all_lazy() but returns an async iterator
+
+        :raise ValueError if repository overrides deserialize()
+        """
+        entity_type = self._lazy_model_type()
+        query = SelectQuery(self.table, filters or [], orders or [])()
+        rows = await self._query_executor.fetch_all(query)
+        return self._rows_to_lazy_entities(entity_type, rows)
+
+    async def get_columns(
+        self,
+        columns: Columns,
+        filters: Filters = None,
+        orders: Columns = None,
+        use_numpy: bool = None,
+    ) -> Dict[str, ColumnValues]:
+        """
+        Get values of {columns} of rows matching filters and orders without entities creation
+
+        :param use_numpy: Return numpy arrays, default is True if numpy is installed
+        :return: Dict of column name => array.array for numeric columns (list for others)
+            or numpy array
+        """
+        chunks = await self.get_columns_aiter(columns, filters, orders, None, use_numpy)
+        [chunk] = await aiter_to_list(chunks)
+        return chunk
+
+    async def get_columns_aiter(
+        self,
+        columns: Columns,
+        filters: Filters = None,
+        orders: Columns = None,
+        chunk_size: Optional[int] = 100_000,
+        use_numpy: bool = None,
+    ) -> AsyncIterator[Dict[str, ColumnValues]]:
+        """
+        Same as get_columns() but returns an async iterator of chunks with {chunk_size} rows,
+        so result doesn't have to fit in memory. All rows are returned in single chunk if None
+        """
+        select_columns = self.resolve_columns(columns)
+        query = SelectQuery(self.table, filters or [], orders or [], select_columns)()
+        rows = await self._query_executor.fetch_all(query)
+        return self._rows_to_column_chunks(
+            rows, ColumnsBuffer(select_columns, use_numpy), chunk_size
+        )
+
     async def get_by_ids(self, entity_ids: Sequence[int]) -> List[GenericIdModel]:
         """Get all entities from DB with id from {entity_ids}"""
         return await aiter_to_list(await self.get_by_ids_aiter(entity_ids))
@@ -169,6 +767,47 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
         """Get all entities from DB with id from {entity_ids} as an async iterator"""
         return await self.get_all_aiter(filters=[self.table.c.id.in_(entity_ids)])
 
+    async def get_by_ids_map(
+        self, entity_ids: Iterable[Optional[int]], chunk_size: int = None
+    ) -> Dict[int, GenericIdModel]:
+        """
+        Get entities with distinct ids from {entity_ids} (None ids are skipped) as id => entity dict
+
+        :param chunk_size: Max number of ids passed to single query, {ids_chunk_size} by default
+        """
+        unique_ids = list(dict.fromkeys(id_ for id_ in entity_ids if id_ is not None))
+        entities: Dict[int, GenericIdModel] = {}
+        for chunk in chunked(unique_ids, chunk_size or self.ids_chunk_size):
+            async for entity in await self.get_all_aiter(filters=[self.ids_filter(chunk)]):
+                entities[cast(int, entity.id)] = entity
+        return entities
+
+    async def prefetch(
+        self, entities: Iterable[Any], field: str, attach_to: str = None, chunk_size: int = None
+    ) -> Dict[int, GenericIdModel]:
+        """
+        Load entities of this repository referenced by {field} of {entities} (e.g. orders.customer_id)
+        via get_by_ids_map() instead of query per entity
+
+        Usage:
+
+        customers = await customer_repo.prefetch(orders, "customer_id")
+        for order in orders:
+            customer = customers.get(order.customer_id)
+
+        :param attach_to: Set referenced entity (or None if not found) to this field of {entities}.
+            Field should be excluded from serialization of entities (e.g. via repo.serialize)
+        :return: Referenced entities by id
+        """
+        entities = list(entities)
+        related = await self.get_by_ids_map(
+            (getattr(entity, field) for entity in entities), chunk_size
+        )
+        if attach_to:
+            for entity in entities:
+                setattr(entity, attach_to, related.get(getattr(entity, field)))
+        return related
+
     async def get_all_ids(
         self, filters: Sequence[BinaryExpression] = None, orders: Columns = None
     ) -> Sequence[int]:
@@ -176,7 +815,7 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
         query = SelectQuery(
             self.table, filters or [], orders or [], select_columns=[self.table.c.id]
         )()
-        rows = await self.query_executor.fetch_all(query)
+        rows = await self._query_executor.fetch_all(query)
         return [row["id"] async for row in rows]
 
     async def exists(self, *filters: BinaryExpression) -> bool:
@@ -184,9 +823,89 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
         query = SelectQuery(
             self.table, filters, select_columns=[sa.func.count(self.table.c.id)]
         )()
-        result = await self.query_executor.fetch_val(query)
+        result = await self._query_executor.fetch_val(query)
         return bool(result)
 
+    @overload
+    async def aggregate(
+        self,
+        metrics: Mapping[str, ColumnElement],
+        group_by: Columns = None,
+        filters: Filters = None,
+        orders: Columns = None,
+    ) -> List[Dict[str, Any]]:
+        ...
+
+    @overload
+    async def aggregate(
+        self,
+        metrics: Mapping[str, ColumnElement],
+        group_by: Columns = None,
+        filters: Filters = None,
+        orders: Columns = None,
+        *,
+        record_type: Callable[..., T],
+    ) -> List[T]:
+        ...
+
+    async def aggregate(
+        self,
+        metrics: Mapping[str, ColumnElement],
+        group_by: Columns = None,
+        filters: Filters = None,
+        orders: Columns = None,
+        *,
+        record_type: Callable[..., Any] = None,
+    ) -> List[Any]:
+        """
+        Aggregate rows matching filters on DB side
+
+        Usage:
+
+        price_by_date = await repo.aggregate(
+            {"total": sa.func.sum(table.c.price), "count": sa.func.count()},
+            group_by=[table.c.date],
+        )  # [{"date": date(2020, 1, 1), "total": 300, "count": 2}, ...]
+
+        :param metrics: Result name => aggregate expression
+        :param group_by: Columns (or column names) to group rows by, they are included in results
+        :param orders: Result orders, e.g. table.c.date or sa.desc("total")
+        :param record_type: Type of results (e.g. pydantic model or NamedTuple),
+            result is created via record_type(**row); plain dicts are returned if not set
+        """
+        query = self.aggregate_query(metrics, group_by, filters, orders)
+        rows = await self._query_executor.fetch_all(query)
+        return [record_type(**row) if record_type else dict(row) async for row in rows]
+
+    async def export(
+        self,
+        sink: ExportSink,
+        filters: Filters = None,
+        orders: Columns = None,
+        fmt: ExportFormat = "csv",
+        buffer_size: int = 64 * 1024,
+    ) -> int:
+        """
+        Stream entities matching filters and orders to {sink} as CSV or JSON Lines
+        Rows are fetched by chunks bypassing {query_cache} (see AsyncQueryExecutor.fetch_stream),
+        entities are encoded via serialize() (with id) one by one,
+        at most {buffer_size} chars are buffered before write to sink
+
+        :param sink: File path, file object or async writer (asyncio.StreamWriter, aiofiles file, etc.)
+        :return: Number of exported entities
+        """
+        query = SelectQuery(self.table, filters or [], orders or [])()
+        rows = await self._query_executor.fetch_stream(query)
+        encoder = RecordEncoder(fmt)
+        count = 0
+        with ExportWriter(sink, buffer_size) as writer:
+            async for entity in self._rows_to_entities(rows):
+                if writer.write(encoder.encode(self._export_record(entity))):
+                    await writer.flush_async()
+                count += 1
+            await writer.flush_async()
+        return count
+
     # ==============
     # INSERT METHODS
     # ==============
@@ -210,12 +929,8 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
     # ==============
 
     async def update(self, entity: GenericIdModel) -> GenericIdModel:
-        """Update entity in DB"""
-        assert entity.id
-        update_values = self.serialize(entity)
-        query = UpdateQuery.by_id(entity.id, self.table, update_values)()
-        await self.query_executor.update(query)
-        return entity
+        """Update entity in DB, {refresh_on_update} columns are set from DB"""
+        return await self._update_by_id(entity, self.serialize(entity))
 
     async def update_partial(
         self, entity: GenericIdModel, **updated_values: Any
@@ -229,10 +944,7 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
         serialized_entity = self.serialize(entity)
         serialized_values = {key: serialized_entity[key] for key in updated_values.keys()}
 
-        query = UpdateQuery.by_id(entity.id, self.table, serialized_values)()
-        await self.query_executor.update(query)
-
-        return entity
+        return await self._update_by_id(entity, serialized_values)
 
     async def update_many(self, entities: List[GenericIdModel]) -> List[GenericIdModel]:
         """
@@ -251,10 +963,34 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
 
         return entities
 
-    async def update_values(self, values: dict, filters: Filters) -> None:
-        """Update particular entity fields for entities matching filters (perform SQL UPDATE)"""
-        query = UpdateQuery(self.table, values, filters)()
-        await self.query_executor.update(query)
+    @overload
+    async def update_values(
+        self, values: dict, filters: Filters, returning: Literal[False] = False
+    ) -> int:
+        ...
+
+    @overload
+    async def update_values(
+        self, values: dict, filters: Filters, returning: Literal[True]
+    ) -> List[GenericIdModel]:
+        ...
+
+    async def update_values(
+        self, values: dict, filters: Filters, returning: bool = False
+    ) -> Union[int, List[GenericIdModel]]:
+        """
+        Update particular entity fields for entities matching filters (perform SQL UPDATE)
+
+        :param returning: Return updated entities (via UPDATE ... RETURNING) instead of count
+        :return: Number of updated rows or updated entities
+        """
+        if not returning:
+            query = UpdateQuery(self.table, values, filters)()
+            return await self._query_executor.update(query)
+
+        query = UpdateQuery(self.table, values, filters, returning_columns=[self.table])()
+        rows = await self._query_executor.fetch_all(query)
+        return await aiter_to_list(self._rows_to_entities(rows))
 
     async def update_or_insert_first_by_field(
         self, entity: GenericIdModel, field: str
@@ -299,24 +1035,57 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
     # DELETE METHODS
     # ==============
 
-    async def delete(self, *filters: Optional[BinaryExpression]) -> None:
-        """Delete entities matching filters from DB"""
+    async def delete(self, *filters: Optional[BinaryExpression]) -> int:
+        """
+        Delete entities matching filters from DB
+
+        :return: Number of deleted rows
+        """
         query = DeleteQuery(self.table, filters)()
-        await self.query_executor.delete(query)
+        return await self._query_executor.delete(query)
 
-    async def delete_by_id(self, entity_id: int) -> None:
+    async def delete_returning_ids(self, *filters: Optional[BinaryExpression]) -> List[int]:
+        """Same as delete() but returns ids of deleted entities (via DELETE ... RETURNING)"""
+        query = DeleteQuery(self.table, filters, returning_columns=[self.table.c.id])()
+        rows = await self._query_executor.fetch_all(query)
+        return [row["id"] async for row in rows]
+
+    async def delete_by_id(self, entity_id: int) -> int:
         """Delete entity by id from DB"""
         return await self.delete(self.table.c.id == entity_id)
 
-    async def delete_by_ids(self, entity_ids: Sequence[int]) -> None:
-        """Delete multiple entities from DB with id in {entity_ids}"""
-        return await self.delete(self.table.c.id.in_(entity_ids))
+    async def delete_by_ids(
+        self, entity_ids: Sequence[int], chunk_size: int = None, commit_per_chunk: bool = False
+    ) -> int:
+        """
+        Delete multiple entities from DB with id in {entity_ids}
+
+        :param chunk_size: Delete entities by chunks of {chunk_size} ids via separate queries,
+            all entities are deleted via single query if not set
+        :param commit_per_chunk: If True, chunks are not wrapped in transaction,
+            so each chunk is committed separately (unless method is called in transaction)
+            and row locks are released after each chunk
+        :return: Number of deleted rows, -1 if it is unknown (deletes are queued by pipeline)
+        """
+        if not entity_ids:
+            return 0
+
+        if not chunk_size or len(entity_ids) <= chunk_size:
+            return await self.delete(self.ids_filter(entity_ids))
+
+        chunks = chunked(entity_ids, chunk_size)
+        if commit_per_chunk:
+            return _total_count([await self.delete(self.ids_filter(chunk)) for chunk in chunks])
+
+        async with self.execute_in_transaction():
+            return _total_count([await self.delete(self.ids_filter(chunk)) for chunk in chunks])
 
     # ==============
     # OTHER METHODS
     # ==============
 
-    def execute_in_transaction(self) -> Any:
+    @asynccontextmanager
+    async def execute_in_transaction(self, pipeline: bool = False) -> AsyncIterator[Any]:
         """
         Execute queries in transaction
 
@@ -326,26 +1095,97 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
             repo.delete(...)
             repo.insert(...)
             ...
+
+        :param pipeline: Queue queries without results (update, delete, update_values, etc.)
+            of repositories using the same connection and send them in single batch
+            before next query with results or commit. Number of affected rows is unknown
+            for queued queries, so methods return -1.
+            Errors of queued queries are raised as PipelineError by next query or on commit.
+            Pipelining works only for executors that support it (AiopgQueryExecutor)
         """
-        return self.query_executor.execute_in_transaction()
+        query_executor = self.query_executor
+        key = query_executor.connection_key
+        async with self._tracking_transaction_tables():
+            async with pipelined(query_executor).execute_in_transaction() as transaction:
+                if not pipeline or key is None or key in _pipelines.get():
+                    yield transaction
+                    return
+
+                query_pipeline = QueryPipeline(query_executor)
+                token = _pipelines.set({**_pipelines.get(), key: query_pipeline})
+                try:
+                    yield transaction
+                    await query_pipeline.flush()
+                finally:
+                    _pipelines.reset(token)
+
+    def with_timeout(self: "AsyncRepo", timeout: float) -> "AsyncRepo":
+        """
+        Copy of repository which queries use statement timeout of {timeout} seconds
+        instead of {query_timeout}, 0 disables timeout
+
+        Usage:
+
+        tasks = await repo.with_timeout(0.5).get_all(filters)
+        """
+        repo = copy.copy(self)
+        repo._call_timeout = timeout
+        return repo
 
     # ==============
     # PROTECTED & PRIVATE METHODS
     # ==============
 
-    def _get_generic_type(self) -> Type[GenericIdModel]:
-        """
-        Get generic type of inherited BaseRepository:
+    @property
+    def _timeout(self) -> Optional[float]:
+        """Statement timeout passed to {query_executor}"""
+        if self._call_timeout is not None:
+            return self._call_timeout
+        return self.query_timeout
 
-        >>> class TransactionRepo(AiopgRepository[Transaction]):
-        ...     table = transactions_table
-        ... # doctest: +SKIP
-        >>> assert TransactionRepo().__get_generic_type() is Transaction # doctest: +SKIP
+    @property
+    def _query_executor(self) -> AsyncQueryExecutor:
         """
-        return cast(
-            Type[GenericIdModel],
-            typing_inspect.get_args(typing_inspect.get_generic_bases(self)[-1])[0],
-        )
+        Query executor, which queues queries to pipeline in pipelined transaction
+        and uses {query_cache} out of transaction
+        """
+        query_executor = pipelined(self.query_executor)
+        cache = self.query_cache
+        if cache is None:
+            return query_executor
+
+        transaction_tables = _transaction_tables.get()
+        if transaction_tables is not None:
+            transaction_tables.add((cache, self.table.name))
+            return query_executor
+        return CachingQueryExecutor(query_executor, cache)
+
+    @asynccontextmanager
+    async def _tracking_transaction_tables(self) -> AsyncIterator[None]:
+        """
+        Collect tables of caching repositories used in outermost transaction
+        and invalidate them on its end (their uncommitted changes could be read by other queries)
+        """
+        if _transaction_tables.get() is not None:
+            yield
+            return
+
+        token = _transaction_tables.set(set())
+        try:
+            yield
+        finally:
+            for cache, table in _transaction_tables.get() or ():
+                cache.invalidate(table)
+            _transaction_tables.reset(token)
+
+    async def _update_by_id(self, entity: GenericIdModel, values: Mapping) -> GenericIdModel:
+        query = self.update_by_id_query(entity, values)
+        if not self.refresh_on_update:
+            await self._query_executor.update(query)
+            return entity
+
+        row = await self._query_executor.fetch_one(query)
+        return self.refresh_entity(entity, row)
 
     async def _rows_to_entities(
         self, rows: AsyncIterator[Mapping]
@@ -356,23 +1196,42 @@ class AsyncBaseRepo(Generic[GenericIdModel], ABC):
         async for row in rows:
             yield cast(GenericIdModel, self.deserialize(**row))
 
+    async def _rows_to_column_chunks(
+        self, rows: AsyncIterator[Mapping], buffer: ColumnsBuffer, chunk_size: Optional[int]
+    ) -> AsyncIterator[Dict[str, ColumnValues]]:
+        async for row in rows:
+            buffer.append(row)
+            if len(buffer) == chunk_size:
+                yield buffer.flush()
+        if len(buffer) or chunk_size is None:
+            yield buffer.flush()
+
+    async def _rows_to_lazy_entities(
+        self, entity_type: Type[GenericIdModel], rows: AsyncIterator[Mapping]
+    ) -> AsyncIterator[LazyEntity[GenericIdModel]]:
+        async for row in rows:
+            yield LazyEntity(entity_type, row, self.deserialize)
+
 
 @dataclass
 class InsertImpl:
     """Entity DB insertion implementation"""
 
-    repo: AsyncBaseRepo
+    repo: BaseRepo
 
     async def insert(self, entity: GenericIdModel) -> GenericIdModel:
         """Perform entity insertion"""
-        query = InsertQuery(
-            self.repo.table, self._serialize_for_insertion(entity), self.insert_returning_columns
-        )()
-
-        row = await self.repo.query_executor.insert(query)
+        query_executor = cast(AsyncBaseRepo, self.repo)._query_executor
+        row = await query_executor.insert(self.insert_query(entity))
 
         return self._set_ignored_fields(entity, row)
 
+    def insert_query(self, entity: GenericIdModel) -> SqlAlchemyQuery:
+        """Create INSERT query returning id and ignored fields"""
+        return InsertQuery(
+            self.repo.table, self._serialize_for_insertion(entity), self.insert_returning_columns
+        )()
+
     def _serialize_for_insertion(self, entity: GenericIdModel) -> Dict[str, Any]:
         """
         Remove ignored fields from serialized entity
@@ -432,18 +1291,26 @@ class InsertManyImpl(InsertImpl):
 
             return _empty_aiter()
 
+        query_executor = cast(AsyncBaseRepo, self.repo)._query_executor
+        rows = await query_executor.insert_many(self.insert_many_query(entities))
+
+        return self._updated_entities_aiter(entities, rows)
+
+    def insert_many_query(self, entities: Sequence[GenericIdModel]) -> SqlAlchemyQuery:
+        """
+        Create INSERT query for multiple entities returning ids and ignored fields
+
+        :raises ValueError if some entities' fields from self.ignore_default have default values
+        while other fields have non-default values
+        """
         self._check_server_defaults(entities)
 
-        query = InsertManyQuery(
+        return InsertManyQuery(
             self.repo.table,
             [self._serialize_for_insertion(entity) for entity in entities],
             self.insert_returning_columns,
         )()
 
-        rows = await self.repo.query_executor.insert_many(query)
-
-        return self._updated_entities_aiter(entities, rows)
-
     def _check_server_defaults(self, entities: Sequence[GenericIdModel]) -> None:
         """Check all entity values either equal to default values or not"""
         server_default_fields = [
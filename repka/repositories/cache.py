@@ -0,0 +1,146 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Mapping, Tuple
+
+from repka.repositories.queries import SqlAlchemyQuery
+
+
+@dataclass
+class QueryCacheEntry:
+    value: Any
+    versions: Tuple[int, ...]
+    expires_at: float
+    size: int
+
+
+class QueryCache:
+    """
+    Cache of SELECT query results keyed by compiled SQL and params
+
+    Every table has version counter, which is incremented by repository writes to the table
+    (insert*, update*, delete* methods); entry is valid only if versions of its tables are unchanged.
+    Entries are evicted in LRU order when total size exceeds {max_memory}
+
+    Cache can be shared between repositories, enable it via {query_cache} repository property:
+
+    cache = QueryCache(ttl=30)
+
+    class TaskRepo(AiopgRepository[Task]):
+        table = tasks_table
+        query_cache = cache
+    """
+
+    def __init__(self, ttl: float = 60, max_memory: int = 64 * 1024 * 1024) -> None:
+        """
+        :param ttl: Max seconds entry is used, entries changed by other apps are stale until expiration
+        :param max_memory: Max approximate size of cached results in bytes
+        """
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.memory = 0
+        self._entries: "OrderedDict[Hashable, QueryCacheEntry]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        # Incremented by invalidate_all(), so results of queries started before it are not cached
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, tables: List[str]) -> Tuple[bool, Any]:
+        """Get (True, cached value) or (False, None) if value is not cached, stale or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expired = entry.expires_at <= time.monotonic()
+            if expired or entry.versions != self._get_versions(tables):
+                self._pop(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry.value
+
+    def set(
+        self, key: Hashable, tables: List[str], value: Any, versions: Tuple[int, ...] = None
+    ) -> None:
+        """
+        Cache value of query reading {tables}
+
+        :param versions: Table versions before query execution, value isn't cached if they changed
+        """
+        size = estimate_size(value)
+        with self._lock:
+            current_versions = self._get_versions(tables)
+            if size > self.max_memory or (versions is not None and versions != current_versions):
+                return
+            self._pop(key)
+            expires_at = time.monotonic() + self.ttl
+            self._entries[key] = QueryCacheEntry(value, current_versions, expires_at, size)
+            self.memory += size
+            while self.memory > self.max_memory:
+                self._pop(next(iter(self._entries)))
+
+    def get_versions(self, tables: List[str]) -> Tuple[int, ...]:
+        with self._lock:
+            return self._get_versions(tables)
+
+    def invalidate(self, *tables: str) -> None:
+        """Increment versions of tables, so their cached results become stale"""
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def invalidate_all(self) -> None:
+        """Make all cached results stale (e.g. when table changes could be missed)"""
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self.memory = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_versions(self, tables: List[str]) -> Tuple[int, ...]:
+        return (self._epoch, *(self._versions.get(table, 0) for table in tables))
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.memory -= entry.size
+
+
+def query_cache_key(query: SqlAlchemyQuery, sa_params: Mapping) -> Hashable:
+    """
+    Cache key of query: compiled SQL and params
+
+    >>> import sqlalchemy as sa
+    >>> t = sa.table("t", sa.column("a"))
+    >>> query_cache_key(sa.select([t.c.a]).where(t.c.a == 1), {})
+    ('SELECT t.a \\nFROM t \\nWHERE t.a = :a_1', "[('a_1', 1)]")
+    """
+    compiled = query.compile()
+    params = compiled.construct_params(sa_params)
+    return str(compiled), repr(sorted(params.items()))
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Approximate size of query result (row, rows or value) in bytes
+
+    >>> estimate_size([{"a": 1}]) > estimate_size([])
+    True
+    """
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return sys.getsizeof(value)
+    try:
+        values = list(value.values()) if hasattr(value, "values") else list(value)
+    except TypeError:
+        return sys.getsizeof(value)
+    return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in values)
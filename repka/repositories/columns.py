@@ -0,0 +1,95 @@
+"""
+Accumulation of selected columns to per-column arrays (used by repo.get_columns)
+
+>>> import sqlalchemy as sa
+>>> table = sa.table("t", sa.column("a", sa.Integer), sa.column("b", sa.String))
+>>> buffer = ColumnsBuffer([table.c.a, table.c.b], use_numpy=False)
+>>> buffer.append({"a": 1, "b": "aue"})
+>>> buffer.flush()
+{'a': array('q', [1]), 'b': ['aue']}
+"""
+import array
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Union
+
+import sqlalchemy as sa
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None  # type: ignore
+
+# array.array, list (for non-numeric columns and columns with NULLs) or numpy.ndarray
+ColumnValues = Any
+Buffer = Union[array.array, List[Any]]
+
+# array.array typecode => numpy dtype
+_NUMPY_DTYPES = {"q": "int64", "d": "float64", "b": "bool"}
+
+
+def column_typecode(column: sa.Column) -> Optional[str]:
+    """array.array typecode of column values, None for non-numeric columns"""
+    if isinstance(column.type, sa.Boolean):
+        return "b"
+    if isinstance(column.type, sa.Integer):
+        return "q"
+    if isinstance(column.type, (sa.Float, sa.Numeric)):
+        return "d"
+    return None
+
+
+class ColumnsBuffer:
+    """
+    Accumulate row values to per-column buffers
+
+    Numeric columns are accumulated to array.array, other columns to lists.
+    Numeric column with NULL (or other not numeric value) is accumulated to list too.
+    """
+
+    def __init__(self, columns: Sequence[sa.Column], use_numpy: bool = None) -> None:
+        """
+        :param use_numpy: Return numpy arrays on flush, default is True if numpy is installed
+        """
+        self.columns = columns
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        if self.use_numpy and numpy is None:
+            raise ImportError("numpy is not installed, install it via `pip install numpy`")
+
+        self._typecodes = [column_typecode(column) for column in columns]
+        self._buffers: List[Buffer] = []
+        self._size = 0
+        self._reset()
+
+    def append(self, row: Mapping) -> None:
+        for index, column in enumerate(self.columns):
+            buffer = self._buffers[index]
+            value = row[column.key]
+            try:
+                buffer.append(value)
+            except TypeError:
+                buffer = self._buffers[index] = [*buffer, value]
+        self._size += 1
+
+    def __len__(self) -> int:
+        return self._size
+
+    def flush(self) -> Dict[str, ColumnValues]:
+        """Return accumulated values by column names and clear buffers"""
+        values = {
+            column.key: self._convert(buffer)
+            for column, buffer in zip(self.columns, self._buffers)
+        }
+        self._reset()
+        return values
+
+    def _reset(self) -> None:
+        self._buffers = [
+            array.array(typecode) if typecode else [] for typecode in self._typecodes
+        ]
+        self._size = 0
+
+    def _convert(self, buffer: Buffer) -> ColumnValues:
+        if not self.use_numpy:
+            return buffer
+        if isinstance(buffer, array.array):
+            return numpy.frombuffer(buffer, dtype=_NUMPY_DTYPES[buffer.typecode])
+        return numpy.array(buffer)
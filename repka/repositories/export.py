@@ -0,0 +1,153 @@
+"""
+Streaming export of entities to CSV / JSON Lines (used by repo.export)
+
+>>> encoder = RecordEncoder("csv")
+>>> print(encoder.encode({"id": 1, "title": "aue", "tags": ["a"]}), end="")
+id,title,tags
+1,aue,"[""a""]"
+>>> print(RecordEncoder("jsonl").encode({"id": 1, "title": "aue"}), end="")
+{"id": 1, "title": "aue"}
+"""
+import asyncio
+import csv
+import datetime as dt
+import inspect
+import io
+import json
+import os
+from types import TracebackType
+from typing import Any, List, Mapping, Optional, Type, Union, IO
+
+from typing_extensions import Literal
+
+ExportFormat = Literal["csv", "jsonl"]
+
+# File path, text / binary file object or async writer (asyncio.StreamWriter, aiofiles file, etc.)
+ExportSink = Union[str, "os.PathLike[str]", IO, Any]
+
+
+class RecordEncoder:
+    """
+    Encode records (serialized entities) to CSV or JSON Lines text
+
+    CSV header is encoded before the first record, columns are taken from its keys,
+    nested values (lists, dicts) are encoded as json.
+    Python primitives kept by serialize() (e.g. by SqliteRepository) are encoded as strings,
+    dates and datetimes in ISO format
+    """
+
+    def __init__(self, fmt: ExportFormat) -> None:
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError(f"Unknown export format: {fmt!r}, expected 'csv' or 'jsonl'")
+
+        self.fmt = fmt
+        self._buffer = io.StringIO()
+        self._csv_writer = csv.writer(self._buffer, lineterminator="\n")
+        self._csv_columns: Optional[List[str]] = None
+
+    def encode(self, record: Mapping) -> str:
+        if self.fmt == "jsonl":
+            return json.dumps(record, ensure_ascii=False, default=_json_default) + "\n"
+
+        if self._csv_columns is None:
+            self._csv_columns = list(record)
+            self._csv_writer.writerow(self._csv_columns)
+        self._csv_writer.writerow(
+            [_csv_value(record.get(column)) for column in self._csv_columns]
+        )
+
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
+
+
+class ExportWriter:
+    """
+    Write text to {sink} via buffer of {buffer_size} chars
+
+    Path sink is opened (and closed) by writer, binary sinks get utf-8 bytes,
+    async writers are awaited on flush (and drained if they have drain()) to apply back-pressure
+    """
+
+    def __init__(self, sink: ExportSink, buffer_size: int = 64 * 1024) -> None:
+        self.buffer_size = buffer_size
+        self._own_file: Optional[IO] = None
+        if isinstance(sink, (str, os.PathLike)):
+            sink = self._own_file = open(sink, "w", encoding="utf-8", newline="")
+        self.sink: Any = sink
+        self._binary = isinstance(sink, (io.RawIOBase, io.BufferedIOBase, asyncio.StreamWriter))
+        self._chunks: List[str] = []
+        self._size = 0
+
+    def write(self, text: str) -> bool:
+        """
+        Add text to buffer
+
+        :return: True if buffer is full and should be flushed
+        """
+        self._chunks.append(text)
+        self._size += len(text)
+        return self._size >= self.buffer_size
+
+    def flush(self) -> None:
+        """Write buffered text to sync sink"""
+        data = self._pop_buffer()
+        if data:
+            self.sink.write(data)
+
+    async def flush_async(self) -> None:
+        """Write buffered text to sink, async writers are awaited"""
+        data = self._pop_buffer()
+        if not data:
+            return
+
+        if self._own_file:
+            await asyncio.get_event_loop().run_in_executor(None, self.sink.write, data)
+            return
+
+        result = self.sink.write(data)
+        if inspect.isawaitable(result):
+            await result
+        drain = getattr(self.sink, "drain", None)
+        if drain:
+            await drain()
+
+    def close(self) -> None:
+        """Close file opened by writer"""
+        if self._own_file:
+            self._own_file.close()
+            self._own_file = None
+
+    def __enter__(self) -> "ExportWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def _pop_buffer(self) -> Union[str, bytes]:
+        text = "".join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return text.encode() if self._binary else text
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+    if isinstance(value, (str, int, float)):
+        return value
+    return _json_default(value)
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, (dt.date, dt.time)):
+        return value.isoformat()
+    return str(value)
@@ -1,28 +1,71 @@
 from abc import ABC
 from contextlib import asynccontextmanager
-from typing import Optional, Dict, Sequence, List, cast, Tuple, Any
+from contextvars import ContextVar
+from typing import (
+    Optional,
+    Dict,
+    Sequence,
+    List,
+    Tuple,
+    Any,
+    AsyncIterator,
+    Iterator,
+    Mapping,
+    cast,
+)
 
 from sqlalchemy.sql.elements import BinaryExpression
 
 from repka.repositories.base import GenericIdModel, Columns, Created, AsyncBaseRepo
+from repka.repositories.parallel import ProcessPoolDeserializer
 from repka.repositories.queries import Filters
 
+# Changes made inside transaction: entity id => entity or None if entity was deleted
+Overlay = Dict[int, Optional[GenericIdModel]]
+
+# Overlays of transactions opened in current context: repository => overlays (outermost first)
+# Tasks started inside transaction block share its overlays, like connection of real transaction
+_overlays: ContextVar[Mapping["FakeRepo", Tuple[Overlay, ...]]] = ContextVar(
+    "repka_fake_overlays", default={}
+)
+
 
 class FakeRepo(AsyncBaseRepo[GenericIdModel], ABC):
+    """
+    Repository that stores entities in memory, can be used as mock
+
+    Entities are copied on write and on read, so mutating returned entities doesn't affect
+    stored ones until they are passed to update methods.
+
+    Transactions are emulated with copy-on-write overlays:
+    each execute_in_transaction() block writes to its own overlay over committed {entities},
+    the overlay is merged into the parent overlay (or {entities}) on success
+    and dropped on exception, so nested blocks work like savepoints.
+    Overlays are stored per context, so concurrent tasks don't see each other's transactions.
+    Committed entities are indexed by id, so writes and lookups don't scan {entities}
+    (except deletion, which shifts positions of following entities).
+    """
+
     def __init__(self) -> None:
+        # Committed entities, can be mutated directly (e.g. to prepare test data)
         self.entities: List[GenericIdModel] = []
         self.id_counter = 1
+        # Index of committed entities: entity id => position in {entities}
+        self._positions: Dict[Optional[int], int] = {}
 
     async def first(
         self, *filters: BinaryExpression, orders: Optional[Columns] = None
     ) -> Optional[GenericIdModel]:
-        return next(iter(self.entities), None)
+        entity = next(self._iter_visible(), None)
+        return entity.copy() if entity else None
 
     async def get_by_ids(self, entity_ids: Sequence[int]) -> List[GenericIdModel]:
-        return [entity for entity in self.entities if entity.id in entity_ids]
+        entities = (self._lookup(entity_id) for entity_id in dict.fromkeys(entity_ids))
+        return [entity.copy() for entity in entities if entity]
 
     async def get_by_id(self, entity_id: int) -> Optional[GenericIdModel]:
-        return next((entity for entity in self.entities if entity.id == entity_id), None)
+        entity = self._lookup(entity_id)
+        return entity.copy() if entity else None
 
     async def get_or_create(
         self, filters: Filters = None, defaults: Dict = None
@@ -30,14 +73,17 @@ class FakeRepo(AsyncBaseRepo[GenericIdModel], ABC):
         raise NotImplementedError()
 
     async def get_all(
-        self, filters: Filters = None, orders: Columns = None
+        self,
+        filters: Filters = None,
+        orders: Columns = None,
+        process_pool: ProcessPoolDeserializer = None,
     ) -> List[GenericIdModel]:
-        return self.entities
+        return [entity.copy() for entity in self._iter_visible()]
 
     async def get_all_ids(
         self, filters: Sequence[BinaryExpression] = None, orders: Columns = None
     ) -> Sequence[int]:
-        return [cast(int, entity.id) for entity in self.entities]
+        return [cast(int, entity.id) for entity in self._iter_visible()]
 
     async def exists(self, *filters: BinaryExpression) -> bool:
         raise NotImplementedError()
@@ -45,13 +91,17 @@ class FakeRepo(AsyncBaseRepo[GenericIdModel], ABC):
     async def insert(self, entity: GenericIdModel) -> GenericIdModel:
         entity.id = self.id_counter
         self.id_counter += 1
-        self.entities.append(entity)
+        self._write(entity.id, entity.copy())
         return entity
 
     async def insert_many(self, entities: List[GenericIdModel]) -> List[GenericIdModel]:
-        return [await self.insert(entity) for entity in entities]
+        async with self.execute_in_transaction():
+            return [await self.insert(entity) for entity in entities]
 
     async def update(self, entity: GenericIdModel) -> GenericIdModel:
+        assert entity.id
+        if self._lookup(entity.id):
+            self._write(entity.id, entity.copy())
         return entity
 
     async def update_partial(
@@ -59,20 +109,122 @@ class FakeRepo(AsyncBaseRepo[GenericIdModel], ABC):
     ) -> GenericIdModel:
         for field, value in updated_values.items():
             setattr(entity, field, value)
-        return entity
+        return await self.update(entity)
 
     async def update_many(self, entities: List[GenericIdModel]) -> List[GenericIdModel]:
-        return entities
+        async with self.execute_in_transaction():
+            return [await self.update(entity) for entity in entities]
 
-    async def delete(self, *filters: Optional[BinaryExpression]) -> None:
+    async def delete(self, *filters: Optional[BinaryExpression]) -> int:
         raise NotImplementedError()
 
-    async def delete_by_id(self, entity_id: int) -> None:
-        self.entities = [entity for entity in self.entities if entity.id != entity_id]
+    async def delete_by_id(self, entity_id: int) -> int:
+        if not self._lookup(entity_id):
+            return 0
+        self._write(entity_id, None)
+        return 1
 
-    async def delete_by_ids(self, entity_ids: Sequence[int]) -> None:
-        self.entities = [entity for entity in self.entities if entity.id not in entity_ids]
+    async def delete_by_ids(
+        self, entity_ids: Sequence[int], chunk_size: int = None, commit_per_chunk: bool = False
+    ) -> int:
+        async with self.execute_in_transaction():
+            return sum([await self.delete_by_id(entity_id) for entity_id in entity_ids])
 
     @asynccontextmanager
-    def execute_in_transaction(self) -> Any:
-        yield None
+    async def execute_in_transaction(self, pipeline: bool = False) -> AsyncIterator[None]:
+        overlay: Overlay[GenericIdModel] = {}
+        token = _overlays.set({**_overlays.get(), self: (*self._overlays, overlay)})
+        try:
+            yield None
+        finally:
+            _overlays.reset(token)
+        self._commit(overlay)
+
+    # ==============
+    # PROTECTED & PRIVATE METHODS
+    # ==============
+
+    @property
+    def _overlays(self) -> Tuple[Overlay[GenericIdModel], ...]:
+        """Overlays of transactions opened in current context (outermost first)"""
+        return _overlays.get().get(self, ())
+
+    def _lookup(self, entity_id: int) -> Optional[GenericIdModel]:
+        """Find entity in overlays (innermost first) or in committed entities"""
+        for overlay in reversed(self._overlays):
+            if entity_id in overlay:
+                return overlay[entity_id]
+        position = self._position(entity_id)
+        return self.entities[position] if position is not None else None
+
+    def _iter_visible(self) -> Iterator[GenericIdModel]:
+        """
+        Iterate entities visible in current transaction without copying committed entities:
+        committed entities are replaced by overlays, then entities inserted in transaction follow
+        """
+        overlays = self._overlays
+        if not overlays:
+            yield from self.entities
+            return
+
+        committed_ids = set()
+        for entity in self.entities:
+            committed_ids.add(entity.id)
+            visible: Optional[GenericIdModel] = entity
+            for overlay in reversed(overlays):
+                if entity.id in overlay:
+                    visible = overlay[cast(int, entity.id)]
+                    break
+            if visible:
+                yield visible
+
+        inserted: Dict[int, Optional[GenericIdModel]] = {}
+        for overlay in overlays:
+            inserted.update(
+                (entity_id, entity)
+                for entity_id, entity in overlay.items()
+                if entity_id not in committed_ids
+            )
+        yield from (entity for entity in inserted.values() if entity)
+
+    def _write(self, entity_id: int, entity: Optional[GenericIdModel]) -> None:
+        """Write entity (None means delete) to current overlay or to committed entities"""
+        if self._overlays:
+            self._overlays[-1][entity_id] = entity
+        else:
+            self._commit({entity_id: entity})
+
+    def _commit(self, overlay: Overlay[GenericIdModel]) -> None:
+        """Merge overlay into parent overlay or into committed entities"""
+        if self._overlays:
+            self._overlays[-1].update(overlay)
+            return
+
+        deleted = set()
+        for entity_id, entity in overlay.items():
+            position = self._position(entity_id)
+            if entity is None:
+                if position is not None:
+                    deleted.add(entity_id)
+            elif position is None:
+                self._positions[entity_id] = len(self.entities)
+                self.entities.append(entity)
+            else:
+                self.entities[position] = entity
+        if deleted:
+            # Positions of following entities are shifted, so deletion costs O(len(entities))
+            self.entities[:] = [entity for entity in self.entities if entity.id not in deleted]
+            self._reindex()
+
+    def _position(self, entity_id: int) -> Optional[int]:
+        """Position of committed entity, index is rebuilt if {entities} were changed directly"""
+        if len(self._positions) != len(self.entities):
+            self._reindex()
+        position = self._positions.get(entity_id)
+        if position is not None and self.entities[position].id != entity_id:
+            self._reindex()
+            position = self._positions.get(entity_id)
+        return position
+
+    def _reindex(self) -> None:
+        self._positions = {entity.id: position for position, entity in enumerate(self.entities)}
@@ -0,0 +1,91 @@
+from typing import Generic, Mapping, Any, Dict, Callable, Type, Optional, TypeVar
+
+from pydantic import ValidationError, BaseModel
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class LazyEntity(Generic[Model]):
+    """
+    Row-backed entity proxy: field is converted and validated on first access,
+    entity is created only when other attributes (methods, etc.) are accessed or field is set
+
+    Fields are validated separately, so field validators get only previous validated fields
+    in {values}; root validators are run on entity creation only
+
+    >>> from repka.repositories.base import IdModel
+    >>> class Task(IdModel):
+    ...     title: str
+    ...     priority: int = 0
+    >>> task = LazyEntity(Task, {"id": 1, "title": "aue", "priority": "2"}, Task)
+    >>> task.priority
+    2
+    >>> task.materialized
+    False
+    >>> task.dict()
+    {'id': 1, 'title': 'aue', 'priority': 2}
+    """
+
+    __slots__ = ("_model_type", "_row", "_deserialize", "_values", "_entity")
+
+    def __init__(
+        self,
+        model_type: Type[Model],
+        row: Mapping,
+        deserialize: Callable[..., Model],
+    ) -> None:
+        """
+        :param model_type: Entity type, its fields are used to validate row values
+        :param row: Sql-row-dict
+        :param deserialize: Creates entity from row values, e.g. repo.deserialize
+        """
+        object.__setattr__(self, "_model_type", model_type)
+        object.__setattr__(self, "_row", row)
+        object.__setattr__(self, "_deserialize", deserialize)
+        object.__setattr__(self, "_values", {})
+        object.__setattr__(self, "_entity", None)
+
+    @property
+    def materialized(self) -> bool:
+        """True if entity is already created"""
+        return self._entity is not None
+
+    def materialize(self) -> Model:
+        """Create entity from row (once)"""
+        entity: Optional[Model] = self._entity
+        if entity is None:
+            entity = self._deserialize(**self._row)
+            object.__setattr__(self, "_entity", entity)
+        return entity
+
+    def __getattr__(self, name: str) -> Any:
+        if self._entity is not None or name not in self._model_type.__fields__:
+            return getattr(self.materialize(), name)
+
+        values: Dict[str, Any] = self._values
+        if name not in values:
+            values[name] = self._validate_field(name)
+        return values[name]
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.materialize(), name, value)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, LazyEntity):
+            other = other.materialize()
+        return self.materialize() == other
+
+    def __repr__(self) -> str:
+        return f"LazyEntity({self.materialize()!r})"
+
+    def _validate_field(self, name: str) -> Any:
+        field = self._model_type.__fields__[name]
+        try:
+            row_value = self._row[name]
+        except KeyError:
+            return field.get_default()
+
+        value, errors = field.validate(row_value, self._values, loc=name, cls=self._model_type)
+        if errors:
+            raise ValidationError([errors], self._model_type)
+        return value
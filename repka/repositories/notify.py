@@ -0,0 +1,352 @@
+"""
+Cross-process cache invalidation via PostgreSQL LISTEN / NOTIFY
+
+Write methods of repository with {notify_channel} send notification with table name and affected ids
+(NotifyingQueryExecutor), CacheInvalidationListener of every process applies them to local caches.
+Notifications are delivered on transaction commit only.
+
+>>> notification_payload("tasks", [1, 2])
+'{"table": "tasks", "ids": [1, 2]}'
+>>> parse_notification_payload('{"table": "tasks", "ids": [1, 2]}')
+('tasks', {1, 2})
+"""
+import asyncio
+import json
+from types import TracebackType
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
+
+import aiopg
+import sqlalchemy as sa
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, CollectionAggregate
+
+from repka.repositories.base import AsyncQueryExecutor, PipelineError
+from repka.repositories.cache import QueryCache
+from repka.repositories.queries import SqlAlchemyQuery
+from repka.utils import aiter_to_list
+
+# Max NOTIFY payload is 8000 bytes, ids are omitted from larger payloads (whole table is invalidated)
+MAX_PAYLOAD_SIZE = 7999
+
+# Table name => changed ids, None if any row could be changed
+Invalidations = Dict[str, Optional[Set[Any]]]
+
+# Called with invalidations of batch or with None if all tables should be invalidated (on reconnect)
+InvalidationCallback = Callable[[Optional[Invalidations]], Any]
+
+
+class NotifyingQueryExecutor(AsyncQueryExecutor):
+    """
+    Send NOTIFY to {channel} with table name and affected ids after INSERT, UPDATE and DELETE queries
+
+    Ids are taken from returned rows or from `id = ...` / `id = ANY(...)` filter,
+    notification without ids is sent if ids are unknown (e.g. update_values())
+    """
+
+    def __init__(self, query_executor: AsyncQueryExecutor, channel: str) -> None:
+        self.query_executor = query_executor
+        self.channel = channel
+
+    async def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
+        row = await self.query_executor.fetch_one(query, **sa_params)
+        if isinstance(query, UpdateBase):
+            await self._notify(query, [row] if row else [])
+        return row
+
+    async def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> AsyncIterator[Mapping]:
+        rows = await self.query_executor.fetch_all(query, **sa_params)
+        if not isinstance(query, UpdateBase):
+            return rows
+
+        rows_list = await aiter_to_list(rows)
+        await self._notify(query, rows_list)
+        return _list_aiter(rows_list)
+
+    async def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
+        value = await self.query_executor.fetch_val(query, **sa_params)
+        if isinstance(query, UpdateBase):
+            await self._notify(query, [])
+        return value
+
+    async def fetch_stream(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        return await self.query_executor.fetch_stream(query, **sa_params)
+
+    async def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
+        row = await self.query_executor.insert(query, **sa_params)
+        await self._notify(query, [row] if row else [])
+        return row
+
+    async def insert_many(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        rows = await aiter_to_list(await self.query_executor.insert_many(query, **sa_params))
+        await self._notify(query, rows)
+        return _list_aiter(rows)
+
+    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        count = await self.query_executor.update(query, **sa_params)
+        if count:
+            await self._notify(query, [])
+        return count
+
+    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        count = await self.query_executor.delete(query, **sa_params)
+        if count:
+            await self._notify(query, [])
+        return count
+
+    def execute_in_transaction(self) -> Any:
+        return self.query_executor.execute_in_transaction()
+
+    @property
+    def connection_key(self) -> Any:
+        return self.query_executor.connection_key
+
+    async def execute_batch(self, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]) -> None:
+        """
+        Execute queries with their notifications in single batch
+
+        :raise PipelineError with index of failed query, failed notification is attributed to its query
+        """
+        batch = list(queries)
+        query_indexes = list(range(len(queries)))
+        for index, (query, _) in enumerate(queries):
+            notify_query = self.notify_query(query, [])
+            if notify_query is not None:
+                batch.append((notify_query, {}))
+                query_indexes.append(index)
+
+        try:
+            await self.query_executor.execute_batch(batch)
+        except PipelineError as error:
+            if error.index is not None:
+                error.index = query_indexes[error.index]
+            raise
+
+    def notify_query(
+        self, query: SqlAlchemyQuery, rows: Sequence[Mapping]
+    ) -> Optional[SqlAlchemyQuery]:
+        """Create NOTIFY query for table written by {query}, None if query doesn't write table"""
+        table = getattr(query, "table", None)
+        if table is None:
+            return None
+
+        payload = notification_payload(table.name, _written_ids(query, rows))
+        return sa.select([sa.func.pg_notify(self.channel, payload)])
+
+    # ==============
+    # PROTECTED & PRIVATE METHODS
+    # ==============
+
+    async def _notify(self, query: SqlAlchemyQuery, rows: Sequence[Mapping]) -> None:
+        notify_query = self.notify_query(query, rows)
+        if notify_query is not None:
+            await self.query_executor.fetch_val(notify_query)
+
+
+class CacheInvalidationListener:
+    """
+    Listen to notifications sent by NotifyingQueryExecutor on dedicated aiopg connection
+    and invalidate tables of {caches}
+
+    Notifications received within {batch_interval} are applied together.
+    On connection error listener reconnects every {reconnect_interval} seconds,
+    all tables are invalidated on (re)connect since notifications could be missed.
+    Connection is checked with `SELECT 1` if no notifications are received within {ping_interval}:
+    aiopg doesn't wake up notifications waiter when connection is lost.
+
+    Usage:
+
+    async with CacheInvalidationListener(db_url, "repka_writes", caches=[cache]):
+        ...
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        channel: str,
+        caches: Sequence[QueryCache] = (),
+        on_invalidate: InvalidationCallback = None,
+        batch_interval: float = 0.05,
+        reconnect_interval: float = 1.0,
+        on_error: Callable[[Exception], Any] = None,
+        ping_interval: float = 10.0,
+    ) -> None:
+        """
+        :param on_invalidate: Called with invalidations of every batch (e.g. to invalidate entities by ids),
+            with None on (re)connect
+        :param on_error: Called with connection and invalidation errors before reconnect
+        """
+        self.dsn = dsn
+        self.channel = channel
+        self.caches = caches
+        self.on_invalidate = on_invalidate
+        self.batch_interval = batch_interval
+        self.reconnect_interval = reconnect_interval
+        self.on_error = on_error
+        self.ping_interval = ping_interval
+
+        # Set while listener is connected and listens to channel
+        self.listening = asyncio.Event()
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.ensure_future(self._listen_forever())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.listening.clear()
+
+    async def __aenter__(self) -> "CacheInvalidationListener":
+        self.start()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    def apply(self, payloads: Sequence[str]) -> Invalidations:
+        """
+        Invalidate tables of notification payloads batch
+
+        :return: Merged invalidations of batch
+        """
+        invalidations: Invalidations = {}
+        for payload in payloads:
+            try:
+                table, ids = parse_notification_payload(payload)
+            except ValueError:
+                continue
+
+            if table in invalidations:
+                merged_ids = invalidations[table]
+                both_known = merged_ids is not None and ids is not None
+                invalidations[table] = merged_ids | ids if both_known else None  # type: ignore
+            else:
+                invalidations[table] = ids
+
+        if invalidations:
+            for cache in self.caches:
+                cache.invalidate(*invalidations)
+            if self.on_invalidate:
+                self.on_invalidate(invalidations)
+        return invalidations
+
+    def invalidate_all(self) -> None:
+        for cache in self.caches:
+            cache.invalidate_all()
+        if self.on_invalidate:
+            self.on_invalidate(None)
+
+    # ==============
+    # PROTECTED & PRIVATE METHODS
+    # ==============
+
+    async def _listen_forever(self) -> None:
+        while True:
+            try:
+                async with aiopg.connect(self.dsn) as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(f'LISTEN "{_quote_identifier(self.channel)}"')
+                    self.invalidate_all()
+                    self.listening.set()
+
+                    while True:
+                        self.apply(await self._receive_batch(conn))
+            except asyncio.CancelledError:
+                # CancelledError is Exception before python 3.8, listener must stop on close
+                raise
+            except Exception as error:
+                self.listening.clear()
+                if self.on_error:
+                    self.on_error(error)
+                await asyncio.sleep(self.reconnect_interval)
+
+    async def _receive_batch(self, conn: aiopg.Connection) -> List[str]:
+        """
+        Wait for notification and collect notifications received within {batch_interval}
+
+        :raise psycopg2.Error if connection is lost
+        """
+        while True:
+            try:
+                notifications = [await asyncio.wait_for(conn.notifies.get(), self.ping_interval)]
+                break
+            except asyncio.TimeoutError:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT 1")
+
+        await asyncio.sleep(self.batch_interval)
+        while not conn.notifies.empty():
+            notifications.append(await conn.notifies.get())
+        return [notification.payload for notification in notifications]
+
+
+def notification_payload(table: str, ids: Optional[Sequence[Any]]) -> str:
+    """Serialize notification of table write, ids are omitted if payload is too large"""
+    payload = json.dumps({"table": table, "ids": ids}, default=str)
+    if len(payload.encode()) > MAX_PAYLOAD_SIZE:
+        payload = json.dumps({"table": table, "ids": None})
+    return payload
+
+
+def parse_notification_payload(payload: str) -> Tuple[str, Optional[Set[Any]]]:
+    """
+    Parse notification of table write
+
+    :raise ValueError if payload is malformed
+    """
+    try:
+        data = json.loads(payload)
+        table, ids = data["table"], data["ids"]
+        return table, set(ids) if ids is not None else None
+    except (TypeError, KeyError) as error:
+        raise ValueError(f"Malformed notification payload: {payload!r}") from error
+
+
+def _written_ids(query: SqlAlchemyQuery, rows: Sequence[Mapping]) -> Optional[List[Any]]:
+    """Ids of rows written by {query}: from `id = ...` filter or from returned rows, None if unknown"""
+    where = getattr(query, "_whereclause", None)
+    if isinstance(where, BinaryExpression) and getattr(where.left, "key", None) == "id":
+        right = where.right
+        if isinstance(right, BindParameter):
+            return [right.value]
+        if isinstance(right, CollectionAggregate):
+            values = getattr(right.element, "element", right.element)
+            if isinstance(values, BindParameter):
+                return list(values.value)
+
+    if rows and all("id" in row for row in rows):
+        return [row["id"] for row in rows]
+    return None
+
+
+def _quote_identifier(identifier: str) -> str:
+    return identifier.replace('"', '""')
+
+
+async def _list_aiter(rows: List[Mapping]) -> AsyncIterator[Mapping]:
+    for row in rows:
+        yield row
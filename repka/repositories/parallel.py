@@ -0,0 +1,151 @@
+"""
+Creation of entities from large result sets in process pool (used by repo.get_all(process_pool=...))
+
+>>> from repka.repositories.base import IdModel
+>>> deserialize_batch(IdModel, ("id",), [(1,), ("2",)])
+[IdModel(id=1), IdModel(id=2)]
+"""
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from types import TracebackType
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from pydantic import BaseModel
+
+Model = TypeVar("Model", bound=BaseModel)
+
+# Column names and row values of batch
+RowsBatch = Tuple[Tuple[str, ...], List[Tuple[Any, ...]]]
+
+
+def deserialize_batch(
+    model_type: Type[Model], keys: Sequence[str], rows: Sequence[Sequence[Any]]
+) -> List[Model]:
+    """Create entities from row values (executed by worker process)"""
+    return [model_type(**dict(zip(keys, row))) for row in rows]
+
+
+class ProcessPoolDeserializer:
+    """
+    Create entities from rows by batches in process pool, entities are returned in rows order
+
+    Batches are sent to workers as row value tuples, entities are created as {model_type}(**row),
+    so model type must be picklable (defined at module level).
+    At most 2 * {max_workers} batches are processed at once,
+    so rows are not read much faster than entities are consumed
+
+    Usage:
+
+    with ProcessPoolDeserializer(batch_size=5000, max_workers=4) as process_pool:
+        tasks = await repo.get_all(process_pool=process_pool)
+    """
+
+    def __init__(
+        self, batch_size: int = 1000, max_workers: int = None, executor: Executor = None
+    ) -> None:
+        """
+        :param max_workers: Number of worker processes, default is number of CPUs
+        :param executor: Executor used instead of own process pool, it is not shut down on close()
+        """
+        self.batch_size = batch_size
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = executor
+        self._own_executor = executor is None
+
+    @property
+    def executor(self) -> Executor:
+        """Process pool, created on first use"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers)
+        return self._executor
+
+    async def deserialize_aiter(
+        self, model_type: Type[Model], rows: AsyncIterator[Mapping]
+    ) -> AsyncIterator[Model]:
+        """Create entities from async iterator of sql-row-dicts"""
+        loop = asyncio.get_event_loop()
+        pending: Deque["asyncio.Future[List[Model]]"] = deque()
+        async for keys, batch in _batches_aiter(rows, self.batch_size):
+            pending.append(
+                loop.run_in_executor(self.executor, deserialize_batch, model_type, keys, batch)
+            )
+            if len(pending) >= 2 * self.max_workers:
+                for entity in await pending.popleft():
+                    yield entity
+
+        while pending:
+            for entity in await pending.popleft():
+                yield entity
+
+    def deserialize_iter(
+        self, model_type: Type[Model], rows: Iterable[Mapping]
+    ) -> Iterator[Model]:
+        """Create entities from iterable of sql-row-dicts"""
+        pending: Deque["Future[List[Model]]"] = deque()
+        for keys, batch in _batches(rows, self.batch_size):
+            pending.append(self.executor.submit(deserialize_batch, model_type, keys, batch))
+            if len(pending) >= 2 * self.max_workers:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+    def close(self) -> None:
+        """Shut down own process pool"""
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "ProcessPoolDeserializer":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+
+def _batches(rows: Iterable[Mapping], size: int) -> Iterator[RowsBatch]:
+    keys: Tuple[str, ...] = ()
+    batch: List[Tuple[Any, ...]] = []
+    for row in rows:
+        if not batch:
+            keys = tuple(row.keys())
+        batch.append(tuple(row.values()))
+        if len(batch) >= size:
+            yield keys, batch
+            batch = []
+    if batch:
+        yield keys, batch
+
+
+async def _batches_aiter(rows: AsyncIterator[Mapping], size: int) -> AsyncIterator[RowsBatch]:
+    keys: Tuple[str, ...] = ()
+    batch: List[Tuple[Any, ...]] = []
+    async for row in rows:
+        if not batch:
+            keys = tuple(row.keys())
+        batch.append(tuple(row.values()))
+        if len(batch) >= size:
+            yield keys, batch
+            batch = []
+    if batch:
+        yield keys, batch
@@ -0,0 +1,113 @@
+from abc import ABC
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Union, Optional, Mapping, Any, Iterator
+
+from sqlalchemy.engine import Engine, Connection
+
+from repka.repositories.base import GenericIdModel
+from repka.repositories.queries import SqlAlchemyQuery
+from repka.repositories.sync_base import SyncBaseRepo, SyncQueryExecutor
+
+EngineOrConnection = Union[Engine, Connection]
+
+# Connections checked out from engine pools by execute_in_transaction(): engine => connection
+# Repository methods called inside the transaction block (in the same thread) use these connections
+_transaction_connections: ContextVar[Mapping[Engine, Connection]] = ContextVar(
+    "repka_psycopg2_transaction_connections", default={}
+)
+
+
+class Psycopg2Repository(SyncBaseRepo[GenericIdModel], ABC):
+    """
+    Execute sql-queries, convert sql-row-dicts to/from pydantic models via psycopg2 in sync way
+
+    Repository should be created with sqlalchemy engine (psycopg2 connection pool)
+    to execute queries concurrently via map_concurrently():
+    every call checks out its own pool connection
+    """
+
+    def __init__(
+        self,
+        engine_or_connection_or_context_var: Union[
+            EngineOrConnection, ContextVar[EngineOrConnection]
+        ],
+    ) -> None:
+        self.engine_or_connection_or_context_var = engine_or_connection_or_context_var
+
+    @property
+    def _engine_or_connection(self) -> EngineOrConnection:
+        if isinstance(self.engine_or_connection_or_context_var, ContextVar):
+            return self.engine_or_connection_or_context_var.get()
+        else:
+            return self.engine_or_connection_or_context_var
+
+    @property
+    def query_executor(self) -> SyncQueryExecutor:
+        return Psycopg2QueryExecutor(self._engine_or_connection)
+
+
+class Psycopg2QueryExecutor(SyncQueryExecutor):
+    def __init__(self, engine_or_connection: EngineOrConnection) -> None:
+        self._engine_or_connection = engine_or_connection
+
+    def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
+        with self._acquire() as connection:
+            return connection.execute(query, **sa_params).first()
+
+    def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> Iterator[Mapping]:
+        """Stream rows via server-side cursor"""
+        with self._acquire() as connection:
+            rows = connection.execution_options(stream_results=True).execute(query, **sa_params)
+            yield from rows
+
+    def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
+        with self._acquire() as connection:
+            return connection.scalar(query, **sa_params)
+
+    def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
+        with self._acquire() as connection:
+            return connection.execute(query, **sa_params).first()
+
+    def insert_many(self, query: SqlAlchemyQuery, **sa_params: Any) -> Iterator[Mapping]:
+        with self._acquire() as connection:
+            return iter(connection.execute(query, **sa_params).fetchall())
+
+    def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        with self._acquire() as connection:
+            return connection.execute(query, **sa_params).rowcount
+
+    def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        with self._acquire() as connection:
+            return connection.execute(query, **sa_params).rowcount
+
+    @contextmanager
+    def execute_in_transaction(self) -> Iterator[Any]:
+        """
+        Execute queries in transaction
+
+        If executor uses engine, connection is checked out for the whole transaction
+        """
+        with self._acquire() as connection:
+            token = None
+            if isinstance(self._engine_or_connection, Engine):
+                token = _transaction_connections.set(
+                    {**_transaction_connections.get(), self._engine_or_connection: connection}
+                )
+            try:
+                with connection.begin() as transaction:
+                    yield transaction
+            finally:
+                if token:
+                    _transaction_connections.reset(token)
+
+    @contextmanager
+    def _acquire(self) -> Iterator[Connection]:
+        """Get connection of current transaction, pool connection or executor connection"""
+        if isinstance(self._engine_or_connection, Connection):
+            yield self._engine_or_connection
+        elif self._engine_or_connection in _transaction_connections.get():
+            yield _transaction_connections.get()[self._engine_or_connection]
+        else:
+            with self._engine_or_connection.connect() as connection:
+                yield connection
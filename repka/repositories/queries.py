@@ -1,9 +1,11 @@
 from dataclasses import dataclass, field
 from functools import reduce
-from typing import Sequence, Union, Mapping
+from typing import Sequence, Union, Mapping, Type
 
 import sqlalchemy as sa
 from sqlalchemy import Table
+from pydantic import BaseModel
+from sqlalchemy.sql import FromClause
 from sqlalchemy.sql.elements import BinaryExpression, ClauseElement
 
 Filters = Sequence[BinaryExpression]
@@ -17,18 +19,21 @@ SqlAlchemyQuery = Union[ClauseElement]
 
 @dataclass
 class SelectQuery:
-    """SQL SELECT query with customizable filters, orders, columns"""
+    """SQL SELECT query with customizable filters, orders, columns, grouping"""
 
     table: Table
     filters: Filters = field(default_factory=list)
     orders: Columns = field(default_factory=list)
     select_columns: Columns = field(default_factory=list)
+    group_by: Columns = field(default_factory=list)
 
     def __call__(self) -> SqlAlchemyQuery:
         """Create SQL SELECT query"""
         select_columns = self.select_columns if self.select_columns else [self.table]
-        query = sa.select(select_columns)
+        # FROM is explicit: columns may contain no table column (e.g. only aggregates)
+        query = sa.select(select_columns).select_from(self.table)
         query = self.apply_filters(query, self.filters)
+        query = self.apply_group_by(query, self.group_by)
         query = self.apply_orders(query, self.orders)
         return query
 
@@ -37,12 +42,62 @@ class SelectQuery:
         """Append WHERE clause to query"""
         return reduce(lambda query_, filter_: query_.where(filter_), filters, query)
 
+    @staticmethod
+    def apply_group_by(query: SqlAlchemyQuery, group_by: Columns) -> ClauseElement:
+        """Append GROUP BY clause to query"""
+        return query.group_by(*group_by) if group_by else query
+
     @staticmethod
     def apply_orders(query: SqlAlchemyQuery, orders: Columns) -> ClauseElement:
         """Append ORDER BY clause to query"""
         return reduce(lambda query_, order_by: query_.order_by(order_by), orders, query)
 
 
+@dataclass
+class Join:
+    """
+    Table joined to repository table, its row is deserialized to {model_type} set to entity {field}
+
+    Related columns are selected with "{field}__" label prefix
+    """
+
+    table: FromClause
+    on: ClauseElement
+    field: str
+    model_type: Type[BaseModel]
+    outer: bool = True
+
+    def label(self, column: sa.Column) -> str:
+        """Label of related {column} in joined SELECT query"""
+        return f"{self.field}__{column.key}"
+
+
+@dataclass
+class JoinedSelectQuery:
+    """SQL SELECT query of table columns and labeled columns of joined tables"""
+
+    table: Table
+    joins: Sequence[Join]
+    filters: Filters = field(default_factory=list)
+    orders: Columns = field(default_factory=list)
+
+    def __call__(self) -> SqlAlchemyQuery:
+        """Create SQL SELECT ... JOIN query"""
+        from_clause = reduce(
+            lambda from_, join: from_.join(join.table, join.on, isouter=join.outer),
+            self.joins,
+            self.table,
+        )
+        columns = [
+            *self.table.c,
+            *(column.label(join.label(column)) for join in self.joins for column in join.table.c),
+        ]
+        query = sa.select(columns).select_from(from_clause)
+        query = SelectQuery.apply_filters(query, self.filters)
+        query = SelectQuery.apply_orders(query, self.orders)
+        return query
+
+
 @dataclass
 class InsertQuery:
     """SQL INSERT query with customizable insert values and returning columns"""
@@ -77,33 +132,45 @@ class InsertManyQuery:
 
 @dataclass
 class UpdateQuery:
-    """SQL UPDATE query with customizable update values and filters"""
+    """SQL UPDATE query with customizable update values, filters and returning columns"""
 
     table: Table
     update_values: Mapping
     filters: Filters
+    returning_columns: Columns = field(default_factory=list)
 
     def __call__(self) -> SqlAlchemyQuery:
         """Create SQL UPDATE query"""
-        return SelectQuery.apply_filters(
+        query = SelectQuery.apply_filters(
             self.table.update().values(self.update_values), self.filters
         )
+        if self.returning_columns:
+            query = query.returning(*self.returning_columns)
+        return query
 
     @classmethod
     def by_id(
-        cls, id_: int, table: Table, update_values: Mapping, extra_filters: Filters = None
+        cls,
+        id_: int,
+        table: Table,
+        update_values: Mapping,
+        extra_filters: Filters = None,
+        returning_columns: Columns = None,
     ) -> 'UpdateQuery':
         """Create update query with id filter"""
         extra_filters = extra_filters or []
-        return UpdateQuery(table, update_values, [table.c.id == id_, *extra_filters])
+        return UpdateQuery(
+            table, update_values, [table.c.id == id_, *extra_filters], returning_columns or []
+        )
 
 
 @dataclass
 class DeleteQuery:
-    """SQL DELETE query with customizable filters"""
+    """SQL DELETE query with customizable filters and returning columns"""
 
     table: Table
     filters: Union[Filters, Sequence[None]]
+    returning_columns: Columns = field(default_factory=list)
 
     def __call__(self) -> SqlAlchemyQuery:
         """
@@ -127,4 +194,6 @@ class DeleteQuery:
 
         query = self.table.delete()
         query = SelectQuery.apply_filters(query, filters)
+        if self.returning_columns:
+            query = query.returning(*self.returning_columns)
         return query
@@ -0,0 +1,243 @@
+import asyncio
+import zlib
+from collections import defaultdict
+from itertools import chain
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+from sqlalchemy import Table
+
+from repka.repositories.base import AsyncBaseRepo, GenericIdModel
+from repka.repositories.queries import Columns, Filters
+
+T = TypeVar("T")
+
+# (shard key, number of shards) => shard index
+ShardFunction = Callable[[Any, int], int]
+
+
+def default_shard_function(shard_key: Any, shards_count: int) -> int:
+    """
+    Shard index of key, the same in all processes:
+    integers are sharded by modulo, other keys by crc32 of their string representation
+
+    >>> default_shard_function(5, 4)
+    1
+    >>> default_shard_function("tenant", 4)
+    2
+    """
+    if isinstance(shard_key, int):
+        return shard_key % shards_count
+    return zlib.crc32(str(shard_key).encode()) % shards_count
+
+
+class ShardedRepo(Generic[GenericIdModel]):
+    """
+    Route operations to repositories of shards (e.g. AiopgRepository of different databases)
+    by {shard_field} value
+
+    Single-key operations are executed by shard of the key,
+    multi-key operations are split per shard and executed concurrently, their results are merged
+
+    Usage:
+
+    repo = ShardedRepo([OrderRepo(conn) for conn in connections], shard_field="tenant_id")
+    order = await repo.insert(Order(tenant_id=1, price=100))
+    order = await repo.get_by_id(order.id, shard_key=1)
+    orders = await repo.get_all(shard_keys=[1, 2], sort_key=attrgetter("price"))
+    """
+
+    def __init__(
+        self,
+        shards: Sequence[AsyncBaseRepo[GenericIdModel]],
+        shard_field: str,
+        shard_function: ShardFunction = default_shard_function,
+    ) -> None:
+        """
+        :param shards: Repositories of shards, order matters: shard is chosen by index
+        :param shard_field: Entity field (and table column) entities are sharded by.
+            "id" works only with ids assigned by application (shard repositories must keep id
+            in serialize()): shard is chosen before insert, DB-generated ids collide across shards
+        :param shard_function: Returns index of shard by key and number of shards
+        """
+        if not shards:
+            raise ValueError("At least one shard repository is required")
+
+        self.shards = shards
+        self.shard_field = shard_field
+        self.shard_function = shard_function
+
+    @property
+    def table(self) -> Table:
+        return self.shards[0].table
+
+    def shard_index(self, shard_key: Any) -> int:
+        return self.shard_function(shard_key, len(self.shards))
+
+    def shard(self, shard_key: Any) -> AsyncBaseRepo[GenericIdModel]:
+        """Repository of shard storing entities with {shard_key}"""
+        return self.shards[self.shard_index(shard_key)]
+
+    # ==============
+    # SINGLE-KEY METHODS
+    # ==============
+
+    async def get_by_id(self, entity_id: int, shard_key: Any = None) -> Optional[GenericIdModel]:
+        """
+        Get entity with id = {entity_id} from shard of {shard_key}
+
+        :param shard_key: Required if entities are not sharded by id
+        """
+        shard_key = self._shard_key_or_id(shard_key, entity_id)
+        return await self.shard(shard_key).get_by_id(entity_id)
+
+    async def insert(self, entity: GenericIdModel) -> GenericIdModel:
+        """Insert entity to shard of its {shard_field}"""
+        return await self._entity_shard(entity).insert(entity)
+
+    async def update(self, entity: GenericIdModel) -> GenericIdModel:
+        """Update entity in shard of its {shard_field}"""
+        return await self._entity_shard(entity).update(entity)
+
+    async def update_partial(
+        self, entity: GenericIdModel, **updated_values: Any
+    ) -> GenericIdModel:
+        """Update particular entity fields in shard of its {shard_field}"""
+        return await self._entity_shard(entity).update_partial(entity, **updated_values)
+
+    async def delete_by_id(self, entity_id: int, shard_key: Any = None) -> int:
+        """
+        Delete entity with id = {entity_id} from shard of {shard_key}
+
+        :param shard_key: Required if entities are not sharded by id
+        """
+        shard_key = self._shard_key_or_id(shard_key, entity_id)
+        return await self.shard(shard_key).delete_by_id(entity_id)
+
+    # ==============
+    # MULTI-KEY METHODS
+    # ==============
+
+    async def get_by_ids(
+        self, entity_ids: Sequence[int], shard_keys: Sequence[Any] = None
+    ) -> List[GenericIdModel]:
+        """
+        Get entities with id from {entity_ids}
+
+        Ids are split per shard if entities are sharded by id,
+        otherwise entities are requested from shards of {shard_keys} (all shards if None)
+        """
+        if self.shard_field == "id":
+            ids_by_shard = self._group_by_shard(entity_ids)
+        else:
+            ids_by_shard = {index: list(entity_ids) for index in self._shard_indexes(shard_keys)}
+
+        results = await self._gather(
+            {index: self.shards[index].get_by_ids(ids) for index, ids in ids_by_shard.items()}
+        )
+        return list(chain.from_iterable(results.values()))
+
+    async def insert_many(self, entities: List[GenericIdModel]) -> List[GenericIdModel]:
+        """Insert entities to shards of their {shard_field}, entities are returned in the same order"""
+        positions_by_shard: Dict[int, List[int]] = defaultdict(list)
+        for position, entity in enumerate(entities):
+            positions_by_shard[self.shard_index(self._entity_shard_key(entity))].append(position)
+
+        results = await self._gather(
+            {
+                index: self.shards[index].insert_many([entities[pos] for pos in positions])
+                for index, positions in positions_by_shard.items()
+            }
+        )
+
+        inserted: List[Any] = [None] * len(entities)
+        for index, positions in positions_by_shard.items():
+            for position, entity in zip(positions, results[index]):
+                inserted[position] = entity
+        return inserted
+
+    async def get_all(
+        self,
+        filters: Filters = None,
+        orders: Columns = None,
+        shard_keys: Sequence[Any] = None,
+        sort_key: Callable[[GenericIdModel], Any] = None,
+        reverse: bool = False,
+    ) -> List[GenericIdModel]:
+        """
+        Get entities matching {filters} from shards concurrently
+
+        :param shard_keys: Get only entities with these {shard_field} values from their shards,
+            all shards are queried if None
+        :param sort_key: Sort merged entities by key,
+            otherwise entities are ordered by {orders} within shard only
+        """
+        filters = list(filters or [])
+        if shard_keys is None:
+            filters_by_shard = {index: filters for index in range(len(self.shards))}
+        else:
+            shard_column = self.table.c[self.shard_field]
+            filters_by_shard = {
+                index: [*filters, shard_column.in_(keys)]
+                for index, keys in self._group_by_shard(shard_keys).items()
+            }
+
+        results = await self._gather(
+            {
+                index: self.shards[index].get_all(shard_filters, orders)
+                for index, shard_filters in filters_by_shard.items()
+            }
+        )
+
+        entities = list(chain.from_iterable(results.values()))
+        if sort_key:
+            entities.sort(key=sort_key, reverse=reverse)
+        return entities
+
+    # ==============
+    # PROTECTED & PRIVATE METHODS
+    # ==============
+
+    def _entity_shard_key(self, entity: GenericIdModel) -> Any:
+        shard_key = getattr(entity, self.shard_field)
+        if shard_key is None:
+            raise ValueError(
+                f"Entity {self.shard_field} is required to choose shard "
+                f"(it can't be generated by shard DB): {entity!r}"
+            )
+        return shard_key
+
+    def _entity_shard(self, entity: GenericIdModel) -> AsyncBaseRepo[GenericIdModel]:
+        return self.shard(self._entity_shard_key(entity))
+
+    def _shard_key_or_id(self, shard_key: Any, entity_id: int) -> Any:
+        if shard_key is not None:
+            return shard_key
+        if self.shard_field == "id":
+            return entity_id
+        raise ValueError(f"shard_key is required for entities sharded by {self.shard_field}")
+
+    def _shard_indexes(self, shard_keys: Optional[Sequence[Any]]) -> List[int]:
+        if shard_keys is None:
+            return list(range(len(self.shards)))
+        return sorted({self.shard_index(shard_key) for shard_key in shard_keys})
+
+    def _group_by_shard(self, keys: Sequence[T]) -> Dict[int, List[T]]:
+        grouped: Dict[int, List[T]] = defaultdict(list)
+        for key in keys:
+            grouped[self.shard_index(key)].append(key)
+        return dict(sorted(grouped.items()))
+
+    async def _gather(self, calls: Dict[int, Awaitable[T]]) -> Dict[int, T]:
+        """Await calls of shards concurrently, results are returned by shard index"""
+        results: List[T] = await asyncio.gather(*calls.values())
+        return dict(zip(calls.keys(), results))
@@ -0,0 +1,403 @@
+import asyncio
+import sqlite3
+import threading
+from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import partial
+from typing import (
+    Union,
+    Optional,
+    Mapping,
+    Any,
+    AsyncIterator,
+    Callable,
+    TypeVar,
+    Sequence,
+    Tuple,
+    List,
+    Dict,
+    Iterator,
+)
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql.base import PGCompiler
+from sqlalchemy.dialects.sqlite.base import SQLiteCompiler
+from sqlalchemy.engine import Connection, ResultProxy
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import BinaryExpression
+
+from repka.repositories.base import (
+    GenericIdModel,
+    AsyncBaseRepo,
+    AsyncQueryExecutor,
+    PipelineError,
+    QueryTimeoutError,
+)
+from repka.repositories.queries import SqlAlchemyQuery
+from repka.utils import model_to_primitive
+
+T = TypeVar("T")
+
+# SQLite supports RETURNING clause since 3.35
+NATIVE_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+
+class SqliteCompiler(SQLiteCompiler):
+    """
+    SQLite statement compiler with RETURNING clause (SQLAlchemy 1.3 doesn't render it for SQLite)
+
+    On SQLite < 3.35 RETURNING of INSERT is omitted (returning columns are selected by rowid
+    after execution), UPDATE / DELETE with RETURNING raise NotImplementedError
+    """
+
+    def returning_clause(self, stmt: Any, returning_cols: Any) -> str:
+        if NATIVE_RETURNING:
+            # The same syntax as in PostgreSQL
+            return PGCompiler.returning_clause(self, stmt, returning_cols)
+        if not self.isinsert:
+            raise NotImplementedError(
+                f"UPDATE / DELETE ... RETURNING requires SQLite 3.35+, "
+                f"current version is {sqlite3.sqlite_version}"
+            )
+        return ""
+
+
+class SqliteConnection:
+    """
+    SQLAlchemy connection to SQLite database (file or :memory:)
+
+    sqlite3 is blocking and its connections can't be shared between threads,
+    so the connection is opened and used in a dedicated single thread executor
+    """
+
+    def __init__(self, database: str = ":memory:") -> None:
+        self.database = database
+        self._thread_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="repka-sqlite"
+        )
+        self._connection: Optional[Connection] = None
+        # Call executed in the dedicated thread (see running()), only it can be interrupted
+        self._running_call: Optional[threading.Event] = None
+        self._running_lock = threading.Lock()
+
+    async def connect(self) -> "SqliteConnection":
+        """Open connection in the dedicated thread"""
+        engine = sa.create_engine(f"sqlite:///{self.database}")
+        engine.dialect.statement_compiler = SqliteCompiler
+        self._connection = await self.run_in_thread(engine.connect)
+        return self
+
+    async def close(self) -> None:
+        """Close connection and shutdown the dedicated thread"""
+        if self._connection is not None:
+            await self.run_in_thread(self._connection.close)
+            self._connection = None
+        self._thread_executor.shutdown(wait=False)
+
+    async def run_sync(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Call {func} with sync SQLAlchemy connection in the dedicated thread
+
+        Usage:
+
+        await conn.run_sync(metadata.create_all)
+        """
+        return await self.run_in_thread(func, self.sa_connection, *args)
+
+    @contextmanager
+    def running(self, call: threading.Event) -> Iterator[None]:
+        """
+        Mark block executed in the dedicated thread as {call}, so it can be interrupted by interrupt()
+
+        :raise asyncio.CancelledError if call was interrupted before it started
+        """
+        with self._running_lock:
+            if call.is_set():
+                raise asyncio.CancelledError()
+            self._running_call = call
+        try:
+            yield
+        finally:
+            with self._running_lock:
+                self._running_call = None
+
+    def interrupt(self, call: threading.Event = None) -> None:
+        """
+        Abort query executed in the dedicated thread (sqlite3 allows it from any thread)
+
+        :param call: Abort query only if it is executed by this call (see running()),
+            call that is not started yet won't be started
+        """
+        with self._running_lock:
+            if call is not None:
+                call.set()
+                if self._running_call is not call:
+                    return
+            if self._connection is not None:
+                self._connection.connection.connection.interrupt()
+
+    @property
+    def sa_connection(self) -> Connection:
+        """Sync SQLAlchemy connection, should be used only in the dedicated thread"""
+        if self._connection is None:
+            raise RuntimeError("SqliteConnection is not connected, call connect() first")
+        return self._connection
+
+    async def run_in_thread(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._thread_executor, partial(func, *args))
+
+
+@asynccontextmanager
+async def create_sqlite_connection(database: str = ":memory:") -> AsyncIterator[SqliteConnection]:
+    """Create SQLite connection that executes queries in dedicated thread"""
+    connection = SqliteConnection(database)
+    await connection.connect()
+    try:
+        yield connection
+    finally:
+        await connection.close()
+
+
+class SqliteRepository(AsyncBaseRepo[GenericIdModel], ABC):
+    """
+    Execute sql-queries, convert sql-row-dicts to/from pydantic models via SQLite
+    """
+
+    def __init__(
+        self, connection_or_context_var: Union[SqliteConnection, ContextVar[SqliteConnection]]
+    ) -> None:
+        self.connection_or_context_var = connection_or_context_var
+
+    @property
+    def _connection(self) -> SqliteConnection:
+        if isinstance(self.connection_or_context_var, SqliteConnection):
+            return self.connection_or_context_var
+        else:
+            return self.connection_or_context_var.get()
+
+    @property
+    def query_executor(self) -> AsyncQueryExecutor:
+        return SqliteQueryExecutor(self._connection, self._timeout)
+
+    def serialize(self, entity: GenericIdModel) -> Dict:
+        """
+        Convert pydantic model to dict with python primitives
+
+        SQLite types of SQLAlchemy (e.g. sa.Date) accept only python objects, not strings
+        """
+        return model_to_primitive(
+            entity, without_id=True, exclude=self._join_fields(), keep_python_primitives=True
+        )
+
+    # SQLite < 3.32 allows max 999 params per query
+    ids_chunk_size = 500
+
+    def ids_filter(self, entity_ids: Sequence[int]) -> BinaryExpression:
+        """SQLite has no arrays, so ids are passed as separate params"""
+        return self.table.c.id.in_(entity_ids)
+
+
+class SqliteQueryExecutor(AsyncQueryExecutor):
+    """
+    Execute queries via SQLite
+
+    RETURNING clause is rendered by SqliteCompiler, on SQLite < 3.35
+    INSERT ... RETURNING is emulated by selecting inserted rows by rowid
+    and UPDATE / DELETE ... RETURNING (update_values(returning=True), delete_returning_ids(),
+    refresh_on_update) raise NotImplementedError
+
+    If statement timeout is set, query exceeding it or cancelled is interrupted by sqlite3,
+    rows of fetch_all() are fetched by chunks without timeout
+    """
+
+    fetch_size = 1000
+
+    def __init__(self, connection: SqliteConnection, timeout: float = None) -> None:
+        """:param timeout: Statement timeout in seconds, disabled if None or 0"""
+        self._connection = connection
+        self.timeout = timeout
+
+    async def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
+        return await self._run(_fetch_one, query, sa_params)
+
+    async def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> AsyncIterator[Mapping]:
+        if isinstance(query, UpdateBase):
+            _, written_rows = await self._run(_execute_write, query, sa_params)
+            return _list_aiter(written_rows)
+
+        rows = await self._run(_execute, query, sa_params)
+        return self._iter_rows(rows)
+
+    async def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
+        return await self._run(_fetch_val, query, sa_params)
+
+    async def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
+        rows = await self._run(_insert_returning, query, sa_params)
+        return rows[0] if rows else {}
+
+    async def insert_many(
+        self, query: SqlAlchemyQuery, **sa_params: Any
+    ) -> AsyncIterator[Mapping]:
+        rows = await self._run(_insert_returning, query, sa_params)
+        return _list_aiter(rows)
+
+    async def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        return await self._run(_execute_and_close, query, sa_params)
+
+    async def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        return await self._run(_execute_and_close, query, sa_params)
+
+    @asynccontextmanager
+    async def execute_in_transaction(self) -> AsyncIterator[Any]:
+        transaction = await self._connection.run_sync(Connection.begin)
+        try:
+            yield transaction
+        except BaseException:
+            await self._connection.run_in_thread(transaction.rollback)
+            raise
+        else:
+            await self._connection.run_in_thread(transaction.commit)
+
+    @property
+    def connection_key(self) -> Any:
+        return self._connection
+
+    async def execute_batch(self, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]) -> None:
+        """Execute queries one by one in single call of the dedicated thread"""
+        await self._run(_execute_batch, queries)
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Call {func} with connection in the dedicated thread with statement timeout of executor
+
+        If timeout is set, query is interrupted when it exceeds timeout or awaiting task is cancelled.
+        Timeout starts when {func} starts: calls of other executors queued before it don't consume it
+        and aren't interrupted by it
+        """
+        if not self.timeout:
+            return await self._connection.run_sync(func, *args)
+
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+        call = threading.Event()
+
+        def run(connection: Connection, *args: Any) -> T:
+            with self._connection.running(call):
+                loop.call_soon_threadsafe(started.set)
+                return func(connection, *args)
+
+        execution = asyncio.ensure_future(self._connection.run_sync(run, *args))
+        execution.add_done_callback(lambda _: started.set())  # e.g. failed to start
+        try:
+            await started.wait()
+            return await asyncio.wait_for(asyncio.shield(execution), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            self._connection.interrupt(call)
+            await asyncio.gather(execution, return_exceptions=True)
+            if isinstance(error, asyncio.CancelledError):
+                raise
+            if execution.exception() is None:  # query finished before interruption
+                return execution.result()
+            raise QueryTimeoutError(self.timeout) from None
+
+    async def _iter_rows(self, rows: ResultProxy) -> AsyncIterator[Mapping]:
+        """Fetch rows from the dedicated thread by chunks of {fetch_size}"""
+        try:
+            while True:
+                chunk = await self._connection.run_in_thread(rows.fetchmany, self.fetch_size)
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield row
+        finally:
+            await self._connection.run_in_thread(rows.close)
+
+
+# Following functions are executed in the dedicated thread
+
+
+def _execute(connection: Connection, query: SqlAlchemyQuery, sa_params: Mapping) -> ResultProxy:
+    return connection.execute(query, **sa_params)
+
+
+def _execute_and_close(connection: Connection, query: SqlAlchemyQuery, sa_params: Mapping) -> int:
+    result = connection.execute(query, **sa_params)
+    result.close()
+    return result.rowcount
+
+
+def _execute_batch(
+    connection: Connection, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]
+) -> None:
+    for index, (query, sa_params) in enumerate(queries):
+        try:
+            connection.execute(query, **sa_params).close()
+        except Exception as error:
+            raise PipelineError(error, index) from error
+
+
+def _fetch_one(
+    connection: Connection, query: SqlAlchemyQuery, sa_params: Mapping
+) -> Optional[Mapping]:
+    if isinstance(query, UpdateBase):
+        _, rows = _execute_write(connection, query, sa_params)
+        return rows[0] if rows else None
+    return connection.execute(query, **sa_params).first()
+
+
+def _fetch_val(connection: Connection, query: SqlAlchemyQuery, sa_params: Mapping) -> Any:
+    if isinstance(query, UpdateBase):
+        _, rows = _execute_write(connection, query, sa_params)
+        return rows[0][0] if rows else None
+    return connection.scalar(query, **sa_params)
+
+
+def _execute_write(
+    connection: Connection, query: SqlAlchemyQuery, sa_params: Mapping
+) -> Tuple[ResultProxy, List[Mapping]]:
+    """
+    Execute INSERT / UPDATE / DELETE query and fetch its RETURNING rows
+
+    Query is executed in transaction: SQLAlchemy commits write query right after execution,
+    but SQLite can't commit until all RETURNING rows are fetched
+    """
+    with nullcontext() if connection.in_transaction() else connection.begin():
+        result = connection.execute(query, **sa_params)
+        rows = result.fetchall() if result.returns_rows else []
+        result.close()
+    return result, rows
+
+
+def _insert_returning(
+    connection: Connection, query: SqlAlchemyQuery, sa_params: Mapping
+) -> List[Mapping]:
+    """
+    Execute INSERT query and return returning columns of inserted rows
+
+    SQLite < 3.35 doesn't return them, so they are selected by rowid:
+    rows inserted by single statement get sequential rowids ending with cursor.lastrowid
+    """
+    result, rows = _execute_write(connection, query, sa_params)
+    if rows:
+        return rows
+
+    returning = result.context.compiled.returning
+    if not returning or not result.rowcount:
+        return []
+
+    rowid = sa.literal_column("rowid")
+    last_rowid = result.lastrowid
+    select = (
+        sa.select(returning)
+        .where(rowid.between(last_rowid - result.rowcount + 1, last_rowid))
+        .order_by(rowid)
+    )
+    return connection.execute(select).fetchall()
+
+
+async def _list_aiter(rows: Sequence[Mapping]) -> AsyncIterator[Mapping]:
+    for row in rows:
+        yield row
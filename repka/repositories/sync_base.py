@@ -0,0 +1,581 @@
+from abc import abstractmethod, ABC
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Optional,
+    List,
+    Sequence,
+    Dict,
+    Any,
+    Tuple,
+    Mapping,
+    Iterator,
+    ContextManager,
+    Callable,
+    Iterable,
+    TypeVar,
+    Union,
+    cast,
+    overload,
+)
+
+import sqlalchemy as sa
+from sqlalchemy.sql.elements import BinaryExpression, ColumnElement
+from typing_extensions import Literal
+
+from repka.repositories.base import (
+    GenericIdModel,
+    BaseRepo,
+    Created,
+    InsertImpl,
+    InsertManyImpl,
+)
+from repka.repositories.columns import ColumnsBuffer, ColumnValues
+from repka.repositories.lazy import LazyEntity
+from repka.repositories.export import ExportFormat, ExportSink, ExportWriter, RecordEncoder
+from repka.repositories.parallel import ProcessPoolDeserializer
+from repka.utils import chunked
+from repka.repositories.queries import (
+    SelectQuery,
+    Filters,
+    Columns,
+    UpdateQuery,
+    DeleteQuery,
+    SqlAlchemyQuery,
+    JoinedSelectQuery,
+)
+
+T = TypeVar("T")
+
+
+class SyncQueryExecutor:
+    @abstractmethod
+    def fetch_one(self, query: SqlAlchemyQuery, **sa_params: Any) -> Optional[Mapping]:
+        """Execute SELECT query and return first result row"""
+
+    @abstractmethod
+    def fetch_all(self, query: SqlAlchemyQuery, **sa_params: Any) -> Iterator[Mapping]:
+        """Execute SELECT query and return all result rows"""
+
+    @abstractmethod
+    def fetch_val(self, query: SqlAlchemyQuery, **sa_params: Any) -> Any:
+        """Execute SELECT query and return first column of first result row"""
+
+    @abstractmethod
+    def insert(self, query: SqlAlchemyQuery, **sa_params: Any) -> Mapping:
+        """Execute INSERT query and return returning columns"""
+
+    @abstractmethod
+    def insert_many(self, query: SqlAlchemyQuery, **sa_params: Any) -> Iterator[Mapping]:
+        """Execute INSERT query and return list of returning columns"""
+
+    @abstractmethod
+    def update(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        """Execute UPDATE query and return number of updated rows"""
+
+    @abstractmethod
+    def delete(self, query: SqlAlchemyQuery, **sa_params: Any) -> int:
+        """Execute DELETE query and return number of deleted rows"""
+
+    @abstractmethod
+    def execute_in_transaction(self) -> ContextManager:
+        """Execute queries in transaction"""
+
+
+class SyncBaseRepo(BaseRepo[GenericIdModel], ABC):
+    """
+    Execute sql-queries, convert sql-row-dicts to/from pydantic models in sync way
+
+    Has same methods as repka.repositories.base.AsyncBaseRepo, *_aiter methods are named *_iter
+    """
+
+    @property
+    @abstractmethod
+    def query_executor(self) -> SyncQueryExecutor:
+        """repka.repositories.sync_base.SyncQueryExecutor instance"""
+
+    # ==============
+    # SELECT METHODS
+    # ==============
+
+    def first(
+        self, *filters: BinaryExpression, orders: Columns = None
+    ) -> Optional[GenericIdModel]:
+        """Get first entity from DB matching filters and orders"""
+        query = SelectQuery(self.table, filters, orders or [])()
+        row = self.query_executor.fetch_one(query)
+        return self.deserialize(**row) if row else None
+
+    def first_joined(
+        self, *filters: BinaryExpression, orders: Columns = None
+    ) -> Optional[GenericIdModel]:
+        """Same as first() but entity fields of {joins} are set via single joined query"""
+        query = JoinedSelectQuery(self.table, self.joins, filters, orders or [])()
+        row = self.query_executor.fetch_one(query)
+        return self._deserialize_joined(row) if row else None
+
+    def get_by_id(self, entity_id: int) -> Optional[GenericIdModel]:
+        """Get entity from DB with id = {entity_id}"""
+        return self.first(self.table.c.id == entity_id)
+
+    def get_or_create(
+        self, filters: Filters = None, defaults: Dict = None
+    ) -> Tuple[GenericIdModel, Created]:
+        """Get first entity from DB  matching filters or create it"""
+        entity = self.first(*(filters or []))
+        if entity:
+            return entity, False
+
+        entity = self.deserialize(**(defaults or {}))
+        entity = self.insert(entity)
+        return entity, True
+
+    def get_all(
+        self,
+        filters: Filters = None,
+        orders: Columns = None,
+        process_pool: ProcessPoolDeserializer = None,
+    ) -> List[GenericIdModel]:
+        """
+        Get all entities from DB matching filters and orders
+
+        :param process_pool: Create entities from batches of rows in process pool
+            (for large result sets, repository deserialize() is not used)
+        """
+        return list(self.get_all_iter(filters, orders, process_pool))
+
+    def get_all_iter(
+        self,
+        filters: Filters = None,
+        orders: Columns = None,
+        process_pool: ProcessPoolDeserializer = None,
+    ) -> Iterator[GenericIdModel]:
+        """Get all entities from DB matching filters and orders as an iterator"""
+        query = SelectQuery(self.table, filters or [], orders or [])()
+        rows = self.query_executor.fetch_all(query)
+        if process_pool:
+            return process_pool.deserialize_iter(self._process_pool_model_type(), rows)
+        return (self.deserialize(**row) for row in rows)
+
+    def get_all_joined(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> List[GenericIdModel]:
+        """Same as get_all() but entity fields of {joins} are set via single joined query"""
+        return list(self.get_all_joined_iter(filters, orders))
+
+    def get_all_joined_iter(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> Iterator[GenericIdModel]:
+        """Same as get_all_joined() but returns an iterator"""
+        query = JoinedSelectQuery(self.table, self.joins, filters or [], orders or [])()
+        rows = self.query_executor.fetch_all(query)
+        return (self._deserialize_joined(row) for row in rows)
+
+    def get_all_lazy(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> List[LazyEntity[GenericIdModel]]:
+        """
+        Same as get_all() but returns row-backed entity proxies (LazyEntity),
+        which convert fields on access and create entity only when needed (e.g. on update)
+        """
+        return list(self.get_all_lazy_iter(filters, orders))
+
+    def get_all_lazy_iter(
+        self, filters: Filters = None, orders: Columns = None
+    ) -> Iterator[LazyEntity[GenericIdModel]]:
+        """
+        Same as get_all_lazy() but returns an iterator
+
+        :raise ValueError if repository overrides deserialize()
+        """
+        entity_type = self._lazy_model_type()
+        query = SelectQuery(self.table, filters or [], orders or [])()
+        rows = self.query_executor.fetch_all(query)
+        return (LazyEntity(entity_type, row, self.deserialize) for row in rows)
+
+    def get_columns(
+        self,
+        columns: Columns,
+        filters: Filters = None,
+        orders: Columns = None,
+        use_numpy: bool = None,
+    ) -> Dict[str, ColumnValues]:
+        """
+        Get values of {columns} of rows matching filters and orders without entities creation
+
+        :param use_numpy: Return numpy arrays, default is True if numpy is installed
+        :return: Dict of column name => array.array for numeric columns (list for others)
+            or numpy array
+        """
+        return next(self.get_columns_iter(columns, filters, orders, None, use_numpy))
+
+    def get_columns_iter(
+        self,
+        columns: Columns,
+        filters: Filters = None,
+        orders: Columns = None,
+        chunk_size: Optional[int] = 100_000,
+        use_numpy: bool = None,
+    ) -> Iterator[Dict[str, ColumnValues]]:
+        """
+        Same as get_columns() but returns an iterator of chunks with {chunk_size} rows,
+        so result doesn't have to fit in memory. All rows are returned in single chunk if None
+        """
+        select_columns = self.resolve_columns(columns)
+        query = SelectQuery(self.table, filters or [], orders or [], select_columns)()
+        buffer = ColumnsBuffer(select_columns, use_numpy)
+        for row in self.query_executor.fetch_all(query):
+            buffer.append(row)
+            if len(buffer) == chunk_size:
+                yield buffer.flush()
+        if len(buffer) or chunk_size is None:
+            yield buffer.flush()
+
+    def get_by_ids(self, entity_ids: Sequence[int]) -> List[GenericIdModel]:
+        """Get all entities from DB with id from {entity_ids}"""
+        return list(self.get_by_ids_iter(entity_ids))
+
+    def get_by_ids_iter(self, entity_ids: Sequence[int]) -> Iterator[GenericIdModel]:
+        """Get all entities from DB with id from {entity_ids} as an iterator"""
+        return self.get_all_iter(filters=[self.table.c.id.in_(entity_ids)])
+
+    def get_by_ids_map(
+        self, entity_ids: Iterable[Optional[int]], chunk_size: int = None
+    ) -> Dict[int, GenericIdModel]:
+        """
+        Get entities with distinct ids from {entity_ids} (None ids are skipped) as id => entity dict
+
+        :param chunk_size: Max number of ids passed to single query, {ids_chunk_size} by default
+        """
+        unique_ids = list(dict.fromkeys(id_ for id_ in entity_ids if id_ is not None))
+        return {
+            cast(int, entity.id): entity
+            for chunk in chunked(unique_ids, chunk_size or self.ids_chunk_size)
+            for entity in self.get_all_iter(filters=[self.ids_filter(chunk)])
+        }
+
+    def prefetch(
+        self, entities: Iterable[Any], field: str, attach_to: str = None, chunk_size: int = None
+    ) -> Dict[int, GenericIdModel]:
+        """
+        Load entities of this repository referenced by {field} of {entities} (e.g. orders.customer_id)
+        via get_by_ids_map() instead of query per entity
+
+        :param attach_to: Set referenced entity (or None if not found) to this field of {entities}.
+            Field should be excluded from serialization of entities (e.g. via repo.serialize)
+        :return: Referenced entities by id
+        """
+        entities = list(entities)
+        related = self.get_by_ids_map((getattr(entity, field) for entity in entities), chunk_size)
+        if attach_to:
+            for entity in entities:
+                setattr(entity, attach_to, related.get(getattr(entity, field)))
+        return related
+
+    def get_all_ids(
+        self, filters: Sequence[BinaryExpression] = None, orders: Columns = None
+    ) -> Sequence[int]:
+        """Same as get_all() but returns only ids."""
+        query = SelectQuery(
+            self.table, filters or [], orders or [], select_columns=[self.table.c.id]
+        )()
+        rows = self.query_executor.fetch_all(query)
+        return [row["id"] for row in rows]
+
+    def exists(self, *filters: BinaryExpression) -> bool:
+        """Check entity matching filters exists in DB"""
+        query = SelectQuery(
+            self.table, filters, select_columns=[sa.func.count(self.table.c.id)]
+        )()
+        result = self.query_executor.fetch_val(query)
+        return bool(result)
+
+    @overload
+    def aggregate(
+        self,
+        metrics: Mapping[str, ColumnElement],
+        group_by: Columns = None,
+        filters: Filters = None,
+        orders: Columns = None,
+    ) -> List[Dict[str, Any]]:
+        ...
+
+    @overload
+    def aggregate(
+        self,
+        metrics: Mapping[str, ColumnElement],
+        group_by: Columns = None,
+        filters: Filters = None,
+        orders: Columns = None,
+        *,
+        record_type: Callable[..., T],
+    ) -> List[T]:
+        ...
+
+    def aggregate(
+        self,
+        metrics: Mapping[str, ColumnElement],
+        group_by: Columns = None,
+        filters: Filters = None,
+        orders: Columns = None,
+        *,
+        record_type: Callable[..., Any] = None,
+    ) -> List[Any]:
+        """
+        Aggregate rows matching filters on DB side
+
+        Usage:
+
+        price_by_date = repo.aggregate(
+            {"total": sa.func.sum(table.c.price), "count": sa.func.count()},
+            group_by=[table.c.date],
+        )  # [{"date": date(2020, 1, 1), "total": 300, "count": 2}, ...]
+
+        :param metrics: Result name => aggregate expression
+        :param group_by: Columns (or column names) to group rows by, they are included in results
+        :param orders: Result orders, e.g. table.c.date or sa.desc("total")
+        :param record_type: Type of results (e.g. pydantic model or NamedTuple),
+            result is created via record_type(**row); plain dicts are returned if not set
+        """
+        query = self.aggregate_query(metrics, group_by, filters, orders)
+        rows = self.query_executor.fetch_all(query)
+        return [record_type(**row) if record_type else dict(row) for row in rows]
+
+    def export(
+        self,
+        sink: ExportSink,
+        filters: Filters = None,
+        orders: Columns = None,
+        fmt: ExportFormat = "csv",
+        buffer_size: int = 64 * 1024,
+    ) -> int:
+        """
+        Stream entities matching filters and orders to {sink} as CSV or JSON Lines
+        Entities are encoded via serialize() (with id) one by one,
+        at most {buffer_size} chars are buffered before write to sink
+
+        :param sink: File path or file object
+        :return: Number of exported entities
+        """
+        encoder = RecordEncoder(fmt)
+        count = 0
+        with ExportWriter(sink, buffer_size) as writer:
+            for entity in self.get_all_iter(filters, orders):
+                if writer.write(encoder.encode(self._export_record(entity))):
+                    writer.flush()
+                count += 1
+            writer.flush()
+        return count
+
+    # ==============
+    # INSERT METHODS
+    # ==============
+
+    def insert(self, entity: GenericIdModel) -> GenericIdModel:
+        """Insert entity to DB"""
+        impl = InsertImpl(self)
+        row = self.query_executor.insert(impl.insert_query(entity))
+        return impl._set_ignored_fields(entity, row)
+
+    def insert_many(self, entities: List[GenericIdModel]) -> List[GenericIdModel]:
+        """Insert multiple entities to DB"""
+        return list(self.insert_many_iter(entities))
+
+    def insert_many_iter(self, entities: List[GenericIdModel]) -> Iterator[GenericIdModel]:
+        """Insert multiple entities to DB. Returns an iterator with inserted entities"""
+        if not entities:
+            return iter([])
+
+        impl = InsertManyImpl(self)
+        rows = self.query_executor.insert_many(impl.insert_many_query(entities))
+        return (impl._set_ignored_fields(entity, row) for entity, row in zip(entities, rows))
+
+    # ==============
+    # UPDATE METHODS
+    # ==============
+
+    def update(self, entity: GenericIdModel) -> GenericIdModel:
+        """Update entity in DB, {refresh_on_update} columns are set from DB"""
+        return self._update_by_id(entity, self.serialize(entity))
+
+    def update_partial(self, entity: GenericIdModel, **updated_values: Any) -> GenericIdModel:
+        """Update particular entity fields in DB"""
+        assert entity.id
+
+        for field, value in updated_values.items():
+            setattr(entity, field, value)
+
+        serialized_entity = self.serialize(entity)
+        serialized_values = {key: serialized_entity[key] for key in updated_values.keys()}
+
+        return self._update_by_id(entity, serialized_values)
+
+    def update_many(self, entities: List[GenericIdModel]) -> List[GenericIdModel]:
+        """Update multiple entities in DB sequentially in transaction"""
+        if not entities:
+            return entities
+
+        with self.execute_in_transaction():
+            entities = [self.update(entity) for entity in entities]
+
+        return entities
+
+    @overload
+    def update_values(
+        self, values: dict, filters: Filters, returning: Literal[False] = False
+    ) -> int:
+        ...
+
+    @overload
+    def update_values(
+        self, values: dict, filters: Filters, returning: Literal[True]
+    ) -> List[GenericIdModel]:
+        ...
+
+    def update_values(
+        self, values: dict, filters: Filters, returning: bool = False
+    ) -> Union[int, List[GenericIdModel]]:
+        """
+        Update particular entity fields for entities matching filters (perform SQL UPDATE)
+
+        :param returning: Return updated entities (via UPDATE ... RETURNING) instead of count
+        :return: Number of updated rows or updated entities
+        """
+        if not returning:
+            query = UpdateQuery(self.table, values, filters)()
+            return self.query_executor.update(query)
+
+        query = UpdateQuery(self.table, values, filters, returning_columns=[self.table])()
+        return [self.deserialize(**row) for row in self.query_executor.fetch_all(query)]
+
+    def update_or_insert_first_by_field(
+        self, entity: GenericIdModel, field: str
+    ) -> GenericIdModel:
+        """Update one entity with field or add it to DB"""
+        value = getattr(entity, field)
+        entity_with_field = self.first(self.table.c[field] == value)
+
+        if entity_with_field:
+            entity.id = entity_with_field.id
+            entity = self.update(entity)
+        else:
+            entity = self.insert(entity)
+
+        return entity
+
+    def update_or_insert_many_by_field(
+        self, entities: Sequence[GenericIdModel], field: str
+    ) -> Sequence[GenericIdModel]:
+        """Update all entities with field and add entities without it to DB"""
+        values = [getattr(e, field) for e in entities]
+        entities_with_field = self.get_all(filters=[self.table.c[field].in_(values)])
+        field_entities = {getattr(e, field): e for e in entities_with_field}
+
+        with self.execute_in_transaction():
+            entities_to_insert, entities_to_update = [], []
+            for e in entities:
+                if getattr(e, field) in field_entities:
+                    entities_to_update.append(e)
+                else:
+                    entities_to_insert.append(e)
+
+            entities_to_insert = self.insert_many(entities_to_insert)
+
+            for e in entities_to_update:
+                e.id = field_entities[getattr(e, field)].id
+            entities_to_update = self.update_many(entities_to_update)
+
+        return [*entities_to_insert, *entities_to_update]
+
+    # ==============
+    # DELETE METHODS
+    # ==============
+
+    def delete(self, *filters: Optional[BinaryExpression]) -> int:
+        """
+        Delete entities matching filters from DB
+
+        :return: Number of deleted rows
+        """
+        query = DeleteQuery(self.table, filters)()
+        return self.query_executor.delete(query)
+
+    def delete_returning_ids(self, *filters: Optional[BinaryExpression]) -> List[int]:
+        """Same as delete() but returns ids of deleted entities (via DELETE ... RETURNING)"""
+        query = DeleteQuery(self.table, filters, returning_columns=[self.table.c.id])()
+        return [row["id"] for row in self.query_executor.fetch_all(query)]
+
+    def delete_by_id(self, entity_id: int) -> int:
+        """Delete entity by id from DB"""
+        return self.delete(self.table.c.id == entity_id)
+
+    def delete_by_ids(
+        self, entity_ids: Sequence[int], chunk_size: int = None, commit_per_chunk: bool = False
+    ) -> int:
+        """
+        Delete multiple entities from DB with id in {entity_ids}
+
+        :param chunk_size: Delete entities by chunks of {chunk_size} ids via separate queries,
+            all entities are deleted via single query if not set
+        :param commit_per_chunk: If True, chunks are not wrapped in transaction,
+            so each chunk is committed separately (unless method is called in transaction)
+        :return: Number of deleted rows
+        """
+        if not entity_ids:
+            return 0
+
+        if not chunk_size or len(entity_ids) <= chunk_size:
+            return self.delete(self.ids_filter(entity_ids))
+
+        chunks = chunked(entity_ids, chunk_size)
+        if commit_per_chunk:
+            return sum(self.delete(self.ids_filter(chunk)) for chunk in chunks)
+
+        with self.execute_in_transaction():
+            return sum(self.delete(self.ids_filter(chunk)) for chunk in chunks)
+
+    # ==============
+    # OTHER METHODS
+    # ==============
+
+    def execute_in_transaction(self) -> ContextManager:
+        """
+        Execute queries in transaction
+
+        Usage:
+
+        with repo.execute_in_transaction():
+            repo.delete(...)
+            repo.insert(...)
+            ...
+        """
+        return self.query_executor.execute_in_transaction()
+
+    def map_concurrently(
+        self, func: Callable[..., T], *iterables: Iterable[Any], max_workers: int = None
+    ) -> List[T]:
+        """
+        Same as map(), but calls {func} concurrently in thread pool, returns results in order
+
+        Calls should be independent: they are not executed in current transaction
+
+        Usage:
+
+        shard_entities = repo.map_concurrently(
+            lambda shard: repo.get_all([table.c.shard == shard]), range(10)
+        )
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(func, *iterables))
+
+    # ==============
+    # PROTECTED & PRIVATE METHODS
+    # ==============
+
+    def _update_by_id(self, entity: GenericIdModel, values: Mapping) -> GenericIdModel:
+        query = self.update_by_id_query(entity, values)
+        if not self.refresh_on_update:
+            self.query_executor.update(query)
+            return entity
+
+        row = self.query_executor.fetch_one(query)
+        return self.refresh_entity(entity, row)
@@ -0,0 +1,136 @@
+import asyncio
+from typing import Generic, List, Tuple, Optional, Callable, Any, Type
+from types import TracebackType
+
+from repka.repositories.base import GenericIdModel, AsyncBaseRepo
+
+# Called with flush error and entities which were not inserted
+ErrorCallback = Callable[[Exception, List[GenericIdModel]], Any]
+
+
+class InsertBuffer(Generic[GenericIdModel]):
+    """
+    Write-behind buffer: collects inserted entities and inserts them via repo.insert_many()
+    when {max_size} entities are collected, every {flush_interval} seconds, on flush() and on close()
+
+    Usage:
+
+    async with InsertBuffer(repo, max_size=500, flush_interval=0.5) as buffer:
+        inserted = await buffer.insert(Task(title="aue"))
+        ...
+        task = await inserted  # task with id, available after flush
+    """
+
+    def __init__(
+        self,
+        repo: AsyncBaseRepo[GenericIdModel],
+        max_size: int = 1000,
+        flush_interval: Optional[float] = 1.0,
+        on_error: ErrorCallback = None,
+    ) -> None:
+        """
+        :param max_size: Buffer size, insert() of entity that fills buffer waits for flush
+            (back-pressure for producers that are faster than DB)
+        :param flush_interval: Max seconds entity waits in buffer, disables periodic flushes if None
+        :param on_error: Called on flush error with error and entities which were not inserted
+        """
+        self.repo = repo
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+
+        self._buffer: List[Tuple[GenericIdModel, "asyncio.Future[GenericIdModel]"]] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional["asyncio.Task[None]"] = None
+        self._closed = asyncio.Event()
+
+    async def insert(self, entity: GenericIdModel) -> "asyncio.Future[GenericIdModel]":
+        """
+        Add entity to buffer
+
+        :return: Future resolved with inserted entity (with id) after flush
+            or with flush error if insertion failed
+        :raise RuntimeError if buffer is closed
+        """
+        if self._closed.is_set():
+            raise RuntimeError("Insert buffer is closed")
+
+        self._start_periodic_flush()
+
+        future: "asyncio.Future[GenericIdModel]" = asyncio.get_event_loop().create_future()
+        self._buffer.append((entity, future))
+        if len(self._buffer) >= self.max_size:
+            await self._flush_reporting_errors()
+        return future
+
+    async def flush(self) -> None:
+        """
+        Insert buffered entities
+
+        :raise Exception raised by insertion (futures of entities are resolved with it too)
+        """
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+
+            entities = [entity for entity, _ in batch]
+            try:
+                inserted = await self.repo.insert_many(entities)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():  # e.g. cancelled by waiter
+                        future.set_exception(error)
+                if self.on_error:
+                    self.on_error(error, entities)
+                raise
+
+            for entity, (_, future) in zip(inserted, batch):
+                if not future.done():
+                    future.set_result(entity)
+
+    async def close(self) -> None:
+        """Stop periodic flushes and flush buffered entities, periodic flush in progress is awaited"""
+        self._closed.set()
+        if self._flush_task:
+            # flush in progress must not be cancelled: its entities would be lost
+            await asyncio.shield(self._flush_task)
+            self._flush_task = None
+        await self.flush()
+
+    async def __aenter__(self) -> "InsertBuffer[GenericIdModel]":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    # ==============
+    # PROTECTED & PRIVATE METHODS
+    # ==============
+
+    def _start_periodic_flush(self) -> None:
+        if self.flush_interval is not None and not self._flush_task:
+            self._flush_task = asyncio.ensure_future(self._flush_periodically())
+
+    async def _flush_periodically(self) -> None:
+        assert self.flush_interval is not None
+        while not self._closed.is_set():
+            try:
+                await asyncio.wait_for(self._closed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                await self._flush_reporting_errors()
+
+    async def _flush_reporting_errors(self) -> None:
+        """Flush buffer, errors are reported via futures and {on_error} only"""
+        try:
+            await self.flush()
+        except Exception:
+            pass
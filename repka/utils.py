@@ -66,3 +66,15 @@ async def mixed_zip(first: Iterator[T], second: AsyncIterator[F]) -> AsyncIterat
 async def aiter_to_list(aiter: AsyncIterator[T]) -> List[T]:
     """Converts an async iterator of entities to list"""
     return [entity async for entity in aiter]
+
+
+def chunked(sequence: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+    """
+    Split {sequence} to chunks of {size} elements
+
+    >>> list(chunked([1, 2, 3], 2))
+    [[1, 2], [3]]
+    """
+    for start in range(0, len(sequence), size):
+        end = start + size
+        yield sequence[start:end]
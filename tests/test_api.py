@@ -1,4 +1,7 @@
+import asyncio
 import datetime as dt
+import io
+import json
 import operator
 from contextlib import suppress
 from contextvars import ContextVar
@@ -12,6 +15,8 @@ from pydantic import validator
 from repka.api import BaseRepository, IdModel
 
 from repka.repositories.aiopg_ import AiopgQueryExecutor
+from repka.repositories.base import PipelineError, QueryTimeoutError
+from repka.repositories.notify import CacheInvalidationListener, Invalidations
 
 # Enable async tests (https://github.com/pytest-dev/pytest-asyncio#pytestmarkasyncio)
 pytestmark = pytest.mark.asyncio
@@ -279,6 +284,25 @@ async def test_delete_by_ids_deletes_multiple_objects(
     assert not await repo.get_all()
 
 
+async def test_delete_by_ids_by_chunks_returns_deleted_count(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    ids = [trans.id for trans in transactions if trans.id]
+
+    deleted = await repo.delete_by_ids(ids, chunk_size=2, commit_per_chunk=True)
+
+    assert deleted == len(ids)
+    assert not await repo.get_all()
+
+
+async def test_delete_returning_ids_returns_deleted_ids(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    deleted_ids = await repo.delete_returning_ids(transactions_table.c.price == 100)
+
+    assert sorted(deleted_ids) == sorted(t.id for t in transactions if t.id and t.price == 100)
+
+
 async def test_exists_returns_true_if_exists(
     repo: TransactionRepo, transactions: List[Transaction]
 ) -> None:
@@ -360,6 +384,54 @@ async def test_error_in_transaction_inside_transaction_rollback(conn: SAConnecti
     assert len(await repo.get_all()) == 0
 
 
+async def test_export_streams_rows_via_server_side_cursor(
+    repo: TransactionRepo, transactions: List[Transaction], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(AiopgQueryExecutor, "fetch_size", 2)
+    sink = io.StringIO()
+
+    async with repo.execute_in_transaction():
+        count = await repo.export(sink, orders=[transactions_table.c.id], fmt="jsonl")
+
+    assert count == len(transactions)
+    assert [json.loads(line)["id"] for line in sink.getvalue().splitlines()] == [
+        trans.id for trans in transactions
+    ]
+
+
+async def test_pipelined_transaction_sends_queued_updates_in_batch(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    async with repo.execute_in_transaction(pipeline=True):
+        await repo.update_values({"price": 1}, [transactions_table.c.price == 100])
+        await repo.delete_by_id(transactions[1].id)  # type: ignore
+
+        assert {trans.price for trans in await repo.get_all()} == {1}
+
+
+async def test_pipelined_transaction_error_refers_to_failed_query(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    with pytest.raises(PipelineError) as error_info:
+        async with repo.execute_in_transaction(pipeline=True):
+            await repo.update_values({"price": 1}, [transactions_table.c.price == 100])
+            await repo.update_values({"price": "aue"}, [transactions_table.c.price == 200])
+
+    assert error_info.value.index == 1
+    assert {trans.price for trans in await repo.get_all()} == {100, 200}
+
+
+async def test_pipelined_transaction_sends_single_queued_query_as_is(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    with pytest.raises(PipelineError) as error_info:
+        async with repo.execute_in_transaction(pipeline=True):
+            await repo.update_values({"price": "aue"}, [transactions_table.c.price == 200])
+
+    assert error_info.value.index == 0
+    assert {trans.price for trans in await repo.get_all()} == {100, 200}
+
+
 async def test___get_generic_type(repo: TransactionRepo) -> None:
     type_ = repo._get_generic_type()
     assert type_ is Transaction
@@ -499,6 +571,91 @@ async def test_update_values(repo: TransactionRepo) -> None:
     assert {t.price for t in await repo.get_all()} == {300, 200}
 
 
+async def test_update_values_returning_returns_updated_entities(repo: TransactionRepo) -> None:
+    trans = await repo.insert(Transaction(price=100))
+    await repo.insert(Transaction(price=200))
+
+    updated = await repo.update_values(
+        {"price": 300}, filters=[repo.table.c.price == 100], returning=True
+    )
+
+    assert updated == [Transaction(id=trans.id, date=trans.date, price=300)]
+
+
+async def test_update_partial_refreshes_refresh_on_update_columns(conn: SAConnection) -> None:
+    class RefreshDateRepo(TransactionRepo):
+        refresh_on_update = ["date"]
+
+    repo = RefreshDateRepo(conn)
+    trans = await repo.insert(Transaction(price=100, date=dt.date(2020, 1, 1)))
+    stale_trans = Transaction(id=trans.id, price=100, date=dt.date(2000, 1, 1))
+
+    updated = await repo.update_partial(stale_trans, price=200)
+
+    assert updated.date == dt.date(2020, 1, 1)
+
+
+async def test_notify_channel_invalidates_caches_of_listeners(
+    conn: SAConnection, db_url: str
+) -> None:
+    class NotifyingTransactionRepo(TransactionRepo):
+        notify_channel = "repka_writes"
+
+    repo = NotifyingTransactionRepo(conn)
+    received = asyncio.Queue()  # type: ignore
+
+    async with CacheInvalidationListener(
+        db_url, "repka_writes", on_invalidate=received.put_nowait, batch_interval=0.01
+    ) as listener:
+        await asyncio.wait_for(listener.listening.wait(), timeout=5)
+        assert await received.get() is None  # all tables are invalidated on connect
+
+        trans = await repo.insert(Transaction(price=100))
+        await repo.update_partial(trans, price=200)
+        invalidations: Invalidations = await asyncio.wait_for(received.get(), timeout=5)
+
+    assert invalidations == {"transactions": {trans.id}}
+
+
+async def test_statement_timeout_cancels_query_on_backend(repo: TransactionRepo) -> None:
+    slow_query = sa.text("select pg_sleep(5)")
+
+    with pytest.raises(QueryTimeoutError):
+        await repo.with_timeout(0.1).query_executor.fetch_val(slow_query)
+
+    task = asyncio.ensure_future(repo.with_timeout(10).query_executor.fetch_val(slow_query))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert await repo.query_executor.fetch_val(sa.text("show statement_timeout")) == "0"
+
+
+async def test_statement_timeout_is_reset_out_of_transaction(
+    repo: TransactionRepo, conn: SAConnection
+) -> None:
+    show_timeout = sa.text("show statement_timeout")
+
+    assert await repo.with_timeout(5).query_executor.fetch_val(show_timeout) == "5s"
+
+    # Pooled connection keeps DEFAULT
+    assert await conn.scalar(show_timeout) == "0"
+
+
+async def test_statement_timeout_is_set_locally_in_transaction(repo: TransactionRepo) -> None:
+    show_timeout = sa.text("show statement_timeout")
+    timeout_repo = repo.with_timeout(5)
+
+    async with timeout_repo.execute_in_transaction():
+        assert await timeout_repo.query_executor.fetch_val(show_timeout) == "5s"
+        async with repo.execute_in_transaction():
+            assert await repo.query_executor.fetch_val(show_timeout) == "0"
+        assert await timeout_repo.query_executor.fetch_val(show_timeout) == "5s"
+
+    assert await repo.query_executor.fetch_val(show_timeout) == "0"
+
+
 async def test_fetch_one_works_ok_with_sa_params(query_executor: AiopgQueryExecutor) -> None:
     query = sa.text("select :aue as col")
     res = await query_executor.fetch_one(query, aue=123)
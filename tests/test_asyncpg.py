@@ -0,0 +1,113 @@
+import datetime as dt
+from contextlib import suppress
+from typing import List, AsyncIterator
+
+import asyncpg
+import pytest
+import sqlalchemy as sa
+from asyncpg.pool import Pool
+
+from repka.repositories.asyncpg_ import AsyncpgRepository, AsyncpgQueryExecutor
+from repka.repositories.base import QueryTimeoutError
+from tests.test_api import (
+    Transaction,
+    transactions_table,
+    metadata,
+    DefaultFieldsModel,
+    default_fields_table,
+)
+
+# Enable async tests (https://github.com/pytest-dev/pytest-asyncio#pytestmarkasyncio)
+pytestmark = pytest.mark.asyncio
+
+
+class TransactionRepo(AsyncpgRepository[Transaction]):
+    table = transactions_table
+
+
+class DefaultFieldsRepo(AsyncpgRepository[DefaultFieldsModel]):
+    table = default_fields_table
+    ignore_default = ["a", "b", "seq_field"]
+
+
+@pytest.fixture()
+async def pool(db_url: str) -> AsyncIterator[Pool]:
+    # recreate all tables
+    engine = sa.create_engine(db_url)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    async with asyncpg.create_pool(db_url) as pool_:
+        yield pool_
+
+
+@pytest.fixture()
+async def repo(pool: Pool) -> TransactionRepo:
+    return TransactionRepo(pool)
+
+
+@pytest.fixture()
+async def transactions(repo: TransactionRepo) -> List[Transaction]:
+    return await repo.insert_many(
+        [
+            Transaction(price=100, date=dt.date(2019, 1, 3)),
+            Transaction(price=200),
+            Transaction(price=100, date=dt.date(2019, 1, 1)),
+        ]
+    )
+
+
+async def test_insert_sets_id(repo: TransactionRepo) -> None:
+    trans = await repo.insert(Transaction(price=100))
+
+    assert trans.id == 1
+    assert await repo.first() == trans
+
+
+async def test_insert_many_sets_ignore_default_fields(pool: Pool) -> None:
+    repo = DefaultFieldsRepo(pool)
+
+    res = await repo.insert_many([DefaultFieldsModel(), DefaultFieldsModel()])
+
+    assert [(e.a, e.b, e.seq_field) for e in res] == [(5, "aue", 1), (5, "aue", 2)]
+    assert res == await repo.get_all()
+
+
+async def test_get_all_return_all_rows_filtered_and_sorted(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    db_transactions = await repo.get_all(
+        filters=[transactions_table.c.price == 100], orders=[transactions_table.c.date]
+    )
+
+    assert db_transactions == [transactions[2], transactions[0]]
+
+
+async def test_update_and_delete(repo: TransactionRepo, transactions: List[Transaction]) -> None:
+    await repo.update_partial(transactions[0], price=300)
+    await repo.delete_by_id(transactions[1].id)  # type: ignore
+
+    assert {trans.price for trans in await repo.get_all()} == {300, 100}
+
+
+async def test_error_in_transaction_rollback(repo: TransactionRepo) -> None:
+    with suppress(ValueError):
+        async with repo.execute_in_transaction():
+            await repo.insert(Transaction(price=100))
+            assert len(await repo.get_all()) == 1
+            raise ValueError()
+
+    assert await repo.get_all() == []
+
+
+async def test_fetch_val_works_ok_with_sa_params(pool: Pool) -> None:
+    query = sa.text("select cast(:aue as int) as col")
+
+    assert await AsyncpgQueryExecutor(pool).fetch_val(query, aue=123) == 123
+
+
+async def test_statement_timeout_raises_query_timeout_error(pool: Pool) -> None:
+    query_executor = AsyncpgQueryExecutor(pool, timeout=0.1)
+
+    with pytest.raises(QueryTimeoutError):
+        await query_executor.fetch_val(sa.text("select pg_sleep(5)"))
@@ -0,0 +1,171 @@
+import asyncio
+from contextlib import suppress
+from typing import Iterator, List
+
+import pytest
+import sqlalchemy as sa
+
+from repka.api import FakeRepo, IdModel
+
+# Enable async tests (https://github.com/pytest-dev/pytest-asyncio#pytestmarkasyncio)
+pytestmark = pytest.mark.asyncio
+
+
+class Task(IdModel):
+    title: str
+
+
+tasks_table = sa.Table(
+    "tasks",
+    sa.MetaData(),
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("title", sa.String),
+)
+
+
+class FakeTaskRepo(FakeRepo[Task]):
+    table = tasks_table
+    query_executor = None  # type: ignore
+
+
+@pytest.fixture()
+def repo() -> FakeTaskRepo:
+    return FakeTaskRepo()
+
+
+@pytest.fixture()
+async def tasks(repo: FakeTaskRepo) -> List[Task]:
+    return await repo.insert_many([Task(title="first"), Task(title="second")])
+
+
+async def test_insert_sets_id(repo: FakeTaskRepo) -> None:
+    task = await repo.insert(Task(title="task"))
+
+    assert task.id == 1
+    assert await repo.get_by_id(1) == task
+
+
+async def test_mutating_returned_entity_does_not_change_stored_entity(
+    repo: FakeTaskRepo, tasks: List[Task]
+) -> None:
+    task = await repo.get_by_id(tasks[0].id)  # type: ignore
+    assert task
+    task.title = "changed"
+
+    assert (await repo.get_by_id(tasks[0].id)).title == "first"  # type: ignore
+
+
+async def test_transaction_commits_changes_on_success(
+    repo: FakeTaskRepo, tasks: List[Task]
+) -> None:
+    async with repo.execute_in_transaction():
+        await repo.update_partial(tasks[0], title="updated")
+        await repo.delete_by_id(tasks[1].id)  # type: ignore
+        await repo.insert(Task(title="third"))
+
+    assert [task.title for task in await repo.get_all()] == ["updated", "third"]
+
+
+async def test_transaction_drops_changes_on_error(repo: FakeTaskRepo, tasks: List[Task]) -> None:
+    with suppress(ValueError):
+        async with repo.execute_in_transaction():
+            await repo.update_partial(tasks[0], title="updated")
+            await repo.delete_by_id(tasks[1].id)  # type: ignore
+            await repo.insert(Task(title="third"))
+            raise ValueError()
+
+    assert [task.title for task in await repo.get_all()] == ["first", "second"]
+
+
+async def test_changes_are_visible_inside_transaction(
+    repo: FakeTaskRepo, tasks: List[Task]
+) -> None:
+    async with repo.execute_in_transaction():
+        await repo.delete_by_id(tasks[0].id)  # type: ignore
+        assert await repo.get_all_ids() == [tasks[1].id]
+
+
+async def test_nested_transaction_rollback_keeps_outer_changes(
+    repo: FakeTaskRepo, tasks: List[Task]
+) -> None:
+    async with repo.execute_in_transaction():
+        await repo.update_partial(tasks[0], title="outer")
+
+        with suppress(ValueError):
+            async with repo.execute_in_transaction():
+                await repo.update_partial(tasks[1], title="inner")
+                raise ValueError()
+
+    assert [task.title for task in await repo.get_all()] == ["outer", "second"]
+
+
+async def test_delete_by_ids_returns_deleted_count(repo: FakeTaskRepo, tasks: List[Task]) -> None:
+    assert await repo.delete_by_ids([tasks[0].id, 1000]) == 1  # type: ignore
+    assert await repo.get_all_ids() == [tasks[1].id]
+
+
+async def test_entities_appended_directly_are_visible(repo: FakeTaskRepo) -> None:
+    repo.entities.append(Task(id=10, title="prepared"))
+
+    assert await repo.get_by_id(10) == Task(id=10, title="prepared")
+    async with repo.execute_in_transaction():
+        await repo.delete_by_id(10)
+        assert await repo.get_all() == []
+    assert repo.entities == []
+
+
+async def test_index_of_entities_is_consistent_after_delete_and_rollback(
+    repo: FakeTaskRepo, tasks: List[Task]
+) -> None:
+    third = await repo.insert(Task(title="third"))
+    await repo.delete_by_id(tasks[0].id)  # type: ignore
+    with suppress(ValueError):
+        async with repo.execute_in_transaction():
+            await repo.delete_by_id(third.id)  # type: ignore
+            raise ValueError()
+
+    assert await repo.get_by_id(third.id) == third  # type: ignore
+    assert await repo.get_by_id(tasks[0].id) is None  # type: ignore
+    await repo.update_partial(third, title="updated")
+    assert [task.title for task in await repo.get_all()] == ["second", "updated"]
+
+
+async def test_writes_out_of_transaction_do_not_scan_entities(repo: FakeTaskRepo) -> None:
+    class ScanCountingList(list):
+        scans = 0
+
+        def __iter__(self) -> Iterator:
+            type(self).scans += 1
+            return super().__iter__()
+
+    repo.entities = ScanCountingList()
+    for index in range(100):
+        task = await repo.insert(Task(title=str(index)))
+    await repo.update_partial(task, title="updated")
+
+    assert await repo.get_by_id(task.id) == task  # type: ignore
+    assert ScanCountingList.scans <= 1  # initial index build
+
+
+async def test_concurrent_transactions_do_not_see_each_other(
+    repo: FakeTaskRepo, tasks: List[Task]
+) -> None:
+    deleted = asyncio.Event()
+
+    async def delete_and_fail() -> None:
+        async with repo.execute_in_transaction():
+            await repo.delete_by_id(tasks[0].id)  # type: ignore
+            deleted.set()
+            await asyncio.sleep(0.01)
+            raise ValueError()
+
+    async def read_after_delete() -> List[int]:
+        await deleted.wait()
+        async with repo.execute_in_transaction():
+            return list(await repo.get_all_ids())
+
+    results = await asyncio.gather(delete_and_fail(), read_after_delete(), return_exceptions=True)
+
+    assert isinstance(results[0], ValueError)
+    assert results[1] == [tasks[0].id, tasks[1].id]
+    assert await repo.get_all_ids() == [tasks[0].id, tasks[1].id]
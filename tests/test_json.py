@@ -1,10 +1,17 @@
+import asyncio
 import json
+import mmap
 import os
+import pickle
+import threading
 
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
 from _pytest.pytester import Testdir
-from typing import Sequence, Dict
+from typing import Sequence, Dict, List, Iterator
 
-from repka.json_ import DictJsonRepo
+from repka.codecs import PickleCodec, MarshalCodec, JsonCodec, Codec
+from repka.json_ import DictJsonRepo, AsyncDictJsonRepo
 
 
 def test_dict_json_repo_reads_json_file_as_list_of_dicts(testdir: Testdir) -> None:
@@ -42,3 +49,240 @@ def test_dict_json_repo_reads_file_if_exist(testdir: Testdir) -> None:
     repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo()
 
     assert repo.read_or_write_default(file, lambda: []) == (data, True)
+
+
+def test_dict_json_repo_cache_returns_cached_data_if_file_not_changed(testdir: Testdir) -> None:
+    file = testdir.makefile(".json", json.dumps([{"field": "value"}]))
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(cache_size=1)
+
+    assert repo.read(file) is repo.read(file)
+
+
+def test_dict_json_repo_cache_rereads_changed_file(testdir: Testdir) -> None:
+    file = testdir.makefile(".json", json.dumps([{"field": "value"}]))
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(cache_size=1)
+    repo.read(file)
+
+    data = [{"field": "new value"}]
+    file.write(json.dumps(data))
+    os.utime(file, ns=(0, 0))
+
+    assert repo.read(file) == data
+
+
+def test_dict_json_repo_cache_is_updated_on_write(testdir: Testdir) -> None:
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(str(testdir.tmpdir), cache_size=1)
+    data = [{"field": "value"}]
+
+    repo.write(data, "sam.json")
+
+    assert repo.read("sam.json") is data
+
+
+def test_dict_json_repo_cache_evicts_least_recently_used_file(testdir: Testdir) -> None:
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(str(testdir.tmpdir), cache_size=1)
+    first = repo.write([], "first.json")
+    repo.write([], "second.json")
+
+    assert repo.read("first.json") is not first
+
+
+def test_dict_json_repo_appends_records_as_json_lines(testdir: Testdir) -> None:
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(str(testdir.tmpdir))
+
+    repo.append({"event": 1}, "events.jsonl")
+    repo.append_many([{"event": 2}, {"event": 3}], "events.jsonl")
+
+    assert list(repo.iter_records("events.jsonl")) == [{"event": 1}, {"event": 2}, {"event": 3}]
+
+
+def test_dict_json_repo_skips_incomplete_json_line(testdir: Testdir) -> None:
+    testdir.tmpdir.join("events.jsonl").write('{"event": 1}\n{"eve')
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(str(testdir.tmpdir))
+
+    repo.append({"event": 2}, "events.jsonl")
+
+    assert list(repo.iter_records("events.jsonl")) == [{"event": 1}, {"event": 2}]
+
+
+def test_dict_json_repo_compacts_json_lines_file(testdir: Testdir) -> None:
+    testdir.tmpdir.join("events.jsonl").write('{"id": 1, "v": 1}\n{"eve\n{"id": 1, "v": 2}\n')
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(str(testdir.tmpdir))
+
+    count = repo.compact(
+        "events.jsonl", lambda records: {r["id"]: r for r in records}.values()  # type: ignore
+    )
+
+    assert count == 1
+    assert testdir.tmpdir.join("events.jsonl").read() == '{"id": 1, "v": 2}\n'
+    assert len(testdir.tmpdir.listdir()) == 1
+
+
+def test_dict_json_repo_compact_keeps_concurrent_appends_and_file_mode(
+    testdir: Testdir,
+) -> None:
+    file = testdir.tmpdir.join("events.jsonl")
+    file.write('{"id": 1}\n')
+    file.chmod(0o644)
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(str(testdir.tmpdir))
+    appending = threading.Thread(target=repo.append, args=({"id": 2}, "events.jsonl"))
+
+    def transform(records: Iterator) -> List:
+        appending.start()  # waits until file is replaced
+        return list(records)
+
+    repo.compact("events.jsonl", transform)
+    appending.join()
+
+    assert list(repo.iter_records("events.jsonl")) == [{"id": 1}, {"id": 2}]
+    assert file.stat().mode & 0o777 == 0o644
+
+
+def test_dict_json_repo_iter_items_reads_array_elements(testdir: Testdir) -> None:
+    data = [{"field": "value" * 10}, 12345, [True, None], "str"]
+    file = testdir.makefile(".json", json.dumps(data, indent=2))
+
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo()
+
+    assert list(repo.iter_items(file, chunk_size=3)) == data
+
+
+def test_dict_json_repo_iter_items_reads_object_entries(testdir: Testdir) -> None:
+    data = {"first": {"field": "value"}, "second": 1.5, "third": []}
+    file = testdir.makefile(".json", json.dumps(data))
+
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo()
+
+    assert list(repo.iter_items(file, chunk_size=3)) == list(data.items())
+
+
+@pytest.mark.asyncio
+async def test_async_dict_json_repo_concurrent_reads_share_file_read(
+    testdir: Testdir, monkeypatch: MonkeyPatch
+) -> None:
+    data = [{"field": "value"}]
+    file = testdir.makefile(".json", json.dumps(data))
+    repo: AsyncDictJsonRepo[Sequence[Dict]] = AsyncDictJsonRepo()
+    reads = []
+    read = repo.sync_repo.read
+
+    def counting_read(filename: str) -> Sequence[Dict]:
+        reads.append(filename)
+        return read(filename)
+
+    monkeypatch.setattr(repo.sync_repo, "read", counting_read)
+
+    results = await asyncio.gather(*(repo.read(file) for _ in range(5)))
+
+    assert results == [data] * 5
+    assert len(reads) == 1
+
+
+@pytest.mark.asyncio
+async def test_async_dict_json_repo_concurrent_read_or_write_default_writes_once(
+    testdir: Testdir,
+) -> None:
+    repo: AsyncDictJsonRepo[Sequence[Dict]] = AsyncDictJsonRepo(str(testdir.tmpdir))
+    defaults: List[Sequence[Dict]] = []
+
+    def default_factory() -> Sequence[Dict]:
+        defaults.append([])
+        return defaults[-1]
+
+    results = await asyncio.gather(
+        *(repo.read_or_write_default("sam.json", default_factory) for _ in range(5))
+    )
+
+    assert len(defaults) == 1
+    assert [exists for _, exists in results].count(False) == 1
+
+
+@pytest.mark.asyncio
+async def test_async_dict_json_repo_cancelled_write_holds_lock_until_written(
+    testdir: Testdir, monkeypatch: MonkeyPatch
+) -> None:
+    repo: AsyncDictJsonRepo[Sequence[Dict]] = AsyncDictJsonRepo(str(testdir.tmpdir))
+    writing = threading.Event()
+    release = threading.Event()
+    write = repo.sync_repo.write
+
+    def slow_write(data: Sequence[Dict], filename: str) -> Sequence[Dict]:
+        writing.set()
+        release.wait(5)
+        return write(data, filename)
+
+    monkeypatch.setattr(repo.sync_repo, "write", slow_write)
+    first = asyncio.ensure_future(repo.write([{"v": 1}], "sam.json"))
+    await asyncio.get_running_loop().run_in_executor(None, writing.wait, 5)
+    first.cancel()
+    second = asyncio.ensure_future(repo.read_or_write_default("sam.json", list))
+    await asyncio.sleep(0.01)
+
+    assert not second.done()
+    release.set()
+    assert await second == ([{"v": 1}], True)
+
+
+def test_dict_json_repo_write_creates_file_with_current_umask(
+    testdir: Testdir, monkeypatch: MonkeyPatch
+) -> None:
+    repo: DictJsonRepo[Dict] = DictJsonRepo(str(testdir.tmpdir))
+    umask = os.umask(0o027)
+    try:
+        monkeypatch.setattr(os, "umask", None)  # umask must not be changed by repo
+        repo.write({"v": 1}, "sam.json")
+    finally:
+        monkeypatch.undo()
+        os.umask(umask)
+
+    assert testdir.tmpdir.join("sam.json").stat().mode & 0o777 == 0o640
+
+
+def test_dict_json_repo_write_keeps_mapped_file_content(testdir: Testdir) -> None:
+    repo: DictJsonRepo[Dict] = DictJsonRepo(str(testdir.tmpdir), use_mmap=True)
+    repo.write({"v": 1}, "sam.json")
+    os.chmod(testdir.tmpdir.join("sam.json"), 0o640)
+
+    with open(testdir.tmpdir.join("sam.json"), "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            repo.write({"v": 22}, "sam.json")
+
+            assert json.loads(mapped[:]) == {"v": 1}
+
+    assert repo.read("sam.json") == {"v": 22}
+    assert testdir.tmpdir.join("sam.json").stat().mode & 0o777 == 0o640
+    assert len(testdir.tmpdir.listdir()) == 1
+
+
+def test_dict_json_repo_uses_codec_by_file_extension(testdir: Testdir) -> None:
+    data = {"field": ("value", 1)}
+    repo: DictJsonRepo[Dict] = DictJsonRepo(
+        str(testdir.tmpdir), extension_codecs={".pickle": PickleCodec()}
+    )
+
+    repo.write(data, "sam.pickle")
+
+    assert repo.read("sam.pickle") == data
+    with open(testdir.tmpdir.join("sam.pickle"), "rb") as f:
+        assert pickle.load(f) == data
+
+
+def test_dict_json_repo_uses_codec_for_all_files(testdir: Testdir) -> None:
+    data = {"field": [1, 2]}
+    repo: DictJsonRepo[Dict] = DictJsonRepo(str(testdir.tmpdir), codec=MarshalCodec())
+
+    repo.write(data, "sam.bin")
+
+    assert repo.read("sam.bin") == data
+
+
+@pytest.mark.parametrize("codec", [JsonCodec(), MarshalCodec(), PickleCodec()])
+def test_dict_json_repo_reads_memory_mapped_file(testdir: Testdir, codec: Codec) -> None:
+    data = [{"field": "value"}]
+    repo: DictJsonRepo[Sequence[Dict]] = DictJsonRepo(
+        str(testdir.tmpdir), codec=codec, use_mmap=True
+    )
+
+    repo.write(data, "sam.json")
+
+    assert repo.read("sam.json") == data
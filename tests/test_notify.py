@@ -0,0 +1,168 @@
+import asyncio
+from types import TracebackType
+from typing import Any, List, Mapping, Optional, Sequence, Tuple, Type
+
+import aiopg
+import psycopg2
+import pytest
+import sqlalchemy as sa
+from _pytest.monkeypatch import MonkeyPatch
+
+from repka.repositories.base import PipelineError
+from repka.repositories.cache import QueryCache
+from repka.repositories.notify import (
+    CacheInvalidationListener,
+    Invalidations,
+    NotifyingQueryExecutor,
+    notification_payload,
+)
+from repka.repositories.queries import SqlAlchemyQuery
+from tests.test_sqlite import transactions_table
+
+
+def test_notify_query_contains_ids_of_filter() -> None:
+    executor = NotifyingQueryExecutor(None, "writes")  # type: ignore
+    ids_param = sa.literal([1, 2], type_=sa.ARRAY(sa.Integer))
+    query = transactions_table.delete().where(transactions_table.c.id == sa.any_(ids_param))
+
+    notify_query = executor.notify_query(query, [])
+
+    assert notify_query is not None
+    payload = notification_payload("transactions", [1, 2])
+    assert payload in notify_query.compile().params.values()
+
+
+def test_listener_merges_batch_and_invalidates_caches() -> None:
+    cache = QueryCache()
+    cache.set("query", ["transactions"], [1])
+    invalidations: List[Optional[Invalidations]] = []
+    listener = CacheInvalidationListener(
+        "", "writes", caches=[cache], on_invalidate=invalidations.append
+    )
+
+    listener.apply(
+        [
+            notification_payload("transactions", [1]),
+            notification_payload("transactions", [2]),
+            notification_payload("products", None),
+            notification_payload("products", [3]),
+            "malformed",
+        ]
+    )
+
+    assert invalidations == [{"transactions": {1, 2}, "products": None}]
+    assert cache.get("query", ["transactions"]) == (False, None)
+
+
+class FailingBatchExecutor:
+    """Query executor stub that fails batch on query with {failed_index}"""
+
+    def __init__(self, failed_index: int) -> None:
+        self.failed_index = failed_index
+        self.batches: List[Sequence[Tuple[SqlAlchemyQuery, Mapping]]] = []
+
+    async def execute_batch(self, queries: Sequence[Tuple[SqlAlchemyQuery, Mapping]]) -> None:
+        self.batches.append(queries)
+        raise PipelineError(Exception("failed"), self.failed_index)
+
+
+@pytest.mark.asyncio
+async def test_notify_failure_in_batch_is_attributed_to_its_query() -> None:
+    query_executor = FailingBatchExecutor(failed_index=3)
+    executor = NotifyingQueryExecutor(query_executor, "writes")  # type: ignore
+    queries: List[Tuple[SqlAlchemyQuery, Mapping]] = [
+        (transactions_table.update().where(transactions_table.c.id == 1), {}),
+        (transactions_table.update().where(transactions_table.c.id == 2), {}),
+    ]
+
+    with pytest.raises(PipelineError) as error_info:
+        await executor.execute_batch(queries)
+
+    # Batch is [update 1, update 2, notify 1, notify 2]
+    assert len(query_executor.batches[0]) == 4
+    assert error_info.value.index == 1
+
+
+class FakeListenConnection:
+    """aiopg connection stub: executes nothing, notifications are put to {notifies} by test"""
+
+    def __init__(self) -> None:
+        self.notifies: "asyncio.Queue[Any]" = asyncio.Queue()
+        self.queries: List[str] = []
+        self.closed = False
+
+    async def __aenter__(self) -> "FakeListenConnection":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.closed = True
+
+    def cursor(self) -> "FakeListenConnection":
+        return self
+
+    async def execute(self, query: str) -> None:
+        if self.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+        self.queries.append(query)
+
+
+@pytest.fixture()
+def connections(monkeypatch: MonkeyPatch) -> List[FakeListenConnection]:
+    """Connections opened by listener"""
+    connections: List[FakeListenConnection] = []
+
+    def connect(dsn: str) -> FakeListenConnection:
+        connections.append(FakeListenConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(aiopg, "connect", connect)
+    return connections
+
+
+@pytest.mark.asyncio
+async def test_listener_stops_on_close(connections: List[FakeListenConnection]) -> None:
+    errors: List[Exception] = []
+    listener = CacheInvalidationListener(
+        "", "writes", on_error=errors.append, reconnect_interval=0
+    )
+
+    listener.start()
+    await asyncio.wait_for(listener.listening.wait(), 1)
+    task = listener._task
+    await asyncio.wait_for(listener.close(), 1)
+
+    assert task is not None and task.cancelled()
+    assert not listener.listening.is_set()
+    assert errors == []
+    assert len(connections) == 1 and connections[0].closed
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnects_on_lost_connection(
+    connections: List[FakeListenConnection],
+) -> None:
+    invalidations: List[Optional[Invalidations]] = []
+    errors: List[Exception] = []
+    listener = CacheInvalidationListener(
+        "",
+        "writes",
+        on_invalidate=invalidations.append,
+        on_error=errors.append,
+        reconnect_interval=0,
+        ping_interval=0.01,
+    )
+
+    async with listener:
+        await asyncio.wait_for(listener.listening.wait(), 1)
+        connections[0].closed = True
+        while len(connections) < 2 or not listener.listening.is_set():
+            await asyncio.sleep(0.01)
+
+    assert [type(error) for error in errors] == [psycopg2.InterfaceError]
+    assert invalidations == [None, None]
+    assert connections[1].queries == ['LISTEN "writes"']
@@ -0,0 +1,106 @@
+import datetime as dt
+from contextlib import suppress
+from typing import Any, List, Iterator
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+
+from repka.repositories.psycopg2_ import Psycopg2Repository
+from tests.test_api import (
+    Transaction,
+    transactions_table,
+    metadata,
+    DefaultFieldsModel,
+    default_fields_table,
+)
+
+
+class TransactionRepo(Psycopg2Repository[Transaction]):
+    table = transactions_table
+
+
+class DefaultFieldsRepo(Psycopg2Repository[DefaultFieldsModel]):
+    table = default_fields_table
+    ignore_default = ["a", "b", "seq_field"]
+
+
+@pytest.fixture()
+def engine(db_url: str) -> Iterator[Engine]:
+    engine_ = sa.create_engine(db_url, pool_size=4)
+    # recreate all tables
+    metadata.drop_all(engine_)
+    metadata.create_all(engine_)
+    yield engine_
+    engine_.dispose()
+
+
+@pytest.fixture()
+def repo(engine: Engine) -> TransactionRepo:
+    return TransactionRepo(engine)
+
+
+@pytest.fixture()
+def transactions(repo: TransactionRepo) -> List[Transaction]:
+    return repo.insert_many(
+        [
+            Transaction(price=100, date=dt.date(2019, 1, 3)),
+            Transaction(price=200),
+            Transaction(price=100, date=dt.date(2019, 1, 1)),
+        ]
+    )
+
+
+def test_insert_sets_id(repo: TransactionRepo) -> None:
+    trans = repo.insert(Transaction(price=100))
+
+    assert trans.id == 1
+    assert repo.first() == trans
+
+
+def test_insert_many_sets_ignore_default_fields(engine: Engine) -> None:
+    repo = DefaultFieldsRepo(engine)
+
+    res = repo.insert_many([DefaultFieldsModel(), DefaultFieldsModel()])
+
+    assert [(e.a, e.b, e.seq_field) for e in res] == [(5, "aue", 1), (5, "aue", 2)]
+    assert res == repo.get_all()
+
+
+def test_get_all_return_all_rows_filtered_and_sorted(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    db_transactions = repo.get_all(
+        filters=[transactions_table.c.price == 100], orders=[transactions_table.c.date]
+    )
+
+    assert db_transactions == [transactions[2], transactions[0]]
+
+
+def test_error_in_transaction_rollback(repo: TransactionRepo) -> None:
+    with suppress(ValueError):
+        with repo.execute_in_transaction():
+            repo.insert(Transaction(price=100))
+            assert len(repo.get_all()) == 1
+            raise ValueError()
+
+    assert repo.get_all() == []
+
+
+def test_map_concurrently_returns_results_in_order(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    res = repo.map_concurrently(
+        lambda price: repo.get_all_ids([transactions_table.c.price == price]), [200, 100]
+    )
+
+    assert res == [[transactions[1].id], [transactions[0].id, transactions[2].id]]
+
+
+def test_get_all_lazy_rejects_overridden_deserialize(engine: Engine) -> None:
+    class PriceInCentsRepo(TransactionRepo):
+        def deserialize(self, **kwargs: Any) -> Transaction:
+            return Transaction(**{**kwargs, "price": kwargs["price"] * 100})
+
+    with pytest.raises(ValueError):
+        PriceInCentsRepo(engine).get_all_lazy()
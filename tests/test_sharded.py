@@ -0,0 +1,112 @@
+from contextlib import AsyncExitStack
+from operator import attrgetter
+from typing import AsyncIterator, Dict, List, Optional
+
+import pytest
+import sqlalchemy as sa
+
+from repka.api import IdModel, SqliteRepository
+from repka.repositories.sharded import ShardedRepo
+from repka.repositories.sqlite_ import create_sqlite_connection
+from repka.utils import model_to_primitive
+
+# Enable async tests (https://github.com/pytest-dev/pytest-asyncio#pytestmarkasyncio)
+pytestmark = pytest.mark.asyncio
+
+
+class Order(IdModel):
+    tenant_id: int
+    price: int
+
+
+metadata = sa.MetaData()
+
+orders_table = sa.Table(
+    "orders",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("tenant_id", sa.Integer),
+    sa.Column("price", sa.Integer),
+)
+
+
+class OrderRepo(SqliteRepository[Order]):
+    table = orders_table
+
+
+@pytest.fixture()
+async def shards() -> AsyncIterator[List[OrderRepo]]:
+    async with AsyncExitStack() as stack:
+        repos = []
+        for _ in range(2):
+            conn = await stack.enter_async_context(create_sqlite_connection())
+            await conn.run_sync(metadata.create_all)
+            repos.append(OrderRepo(conn))
+        yield repos
+
+
+@pytest.fixture()
+async def repo(shards: List[OrderRepo]) -> ShardedRepo[Order]:
+    return ShardedRepo(shards, shard_field="tenant_id")
+
+
+async def test_single_key_operations_are_routed_to_shard_of_key(
+    repo: ShardedRepo[Order], shards: List[OrderRepo]
+) -> None:
+    order = await repo.insert(Order(tenant_id=3, price=100))
+    await repo.update_partial(order, price=200)
+
+    assert await shards[0].get_all() == []
+    assert await repo.get_by_id(order.id, shard_key=3) == Order(  # type: ignore
+        id=order.id, tenant_id=3, price=200
+    )
+    with pytest.raises(ValueError):
+        await repo.get_by_id(order.id)  # type: ignore
+
+
+async def test_multi_key_operations_are_split_per_shard(
+    repo: ShardedRepo[Order], shards: List[OrderRepo]
+) -> None:
+    orders = await repo.insert_many(
+        [
+            Order(tenant_id=1, price=300),
+            Order(tenant_id=2, price=100),
+            Order(tenant_id=3, price=200),
+        ]
+    )
+
+    assert [(order.tenant_id, order.id) for order in orders] == [(1, 1), (2, 1), (3, 2)]
+    assert [order.tenant_id for order in await shards[1].get_all()] == [1, 3]
+
+    tenant_orders = await repo.get_all(shard_keys=[2, 3], sort_key=attrgetter("price"))
+    assert [order.tenant_id for order in tenant_orders] == [2, 3]
+
+    all_orders = await repo.get_all(sort_key=attrgetter("price"), reverse=True)
+    assert [order.price for order in all_orders] == [300, 200, 100]
+
+
+async def test_entities_sharded_by_id_are_got_by_ids_from_their_shards(
+    shards: List[OrderRepo],
+) -> None:
+    class AppIdOrderRepo(OrderRepo):
+        def serialize(self, entity: Order) -> Dict:
+            return model_to_primitive(entity, keep_python_primitives=True)
+
+    repo = ShardedRepo(
+        [AppIdOrderRepo(shard.connection_or_context_var) for shard in shards], shard_field="id"
+    )
+    await repo.insert_many(
+        [Order(id=1, tenant_id=1, price=100), Order(id=2, tenant_id=1, price=200)]
+    )
+
+    orders: List[Optional[Order]] = await repo.get_by_ids([1, 2])  # type: ignore
+
+    assert [(order.id, order.price) for order in orders] == [(2, 200), (1, 100)]  # type: ignore
+    assert [order.id for order in await shards[1].get_all()] == [1]
+
+
+async def test_entities_sharded_by_id_require_id_on_insert(shards: List[OrderRepo]) -> None:
+    repo = ShardedRepo(shards, shard_field="id")
+
+    with pytest.raises(ValueError):
+        await repo.insert(Order(tenant_id=1, price=100))
@@ -0,0 +1,624 @@
+import asyncio
+import datetime as dt
+import io
+import json
+from pathlib import Path
+from array import array
+from contextlib import suppress
+from typing import List, Optional, AsyncIterator, NamedTuple, Any
+
+import pytest
+import sqlalchemy as sa
+
+from repka.api import IdModel, SqliteRepository
+from repka.repositories.base import PipelineError, QueryTimeoutError
+from repka.repositories.cache import QueryCache
+from repka.repositories.parallel import ProcessPoolDeserializer
+from repka.repositories.queries import Join
+from repka.repositories import sqlite_
+from repka.repositories.sqlite_ import (
+    SqliteConnection,
+    SqliteQueryExecutor,
+    create_sqlite_connection,
+)
+
+# Enable async tests (https://github.com/pytest-dev/pytest-asyncio#pytestmarkasyncio)
+pytestmark = pytest.mark.asyncio
+
+
+class Transaction(IdModel):
+    date: Optional[dt.date]
+    price: int
+
+
+class DefaultFieldsModel(IdModel):
+    a: int = 0
+
+
+metadata = sa.MetaData()
+
+transactions_table = sa.Table(
+    "transactions",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("date", sa.Date),
+    sa.Column("price", sa.Integer),
+)
+
+default_fields_table = sa.Table(
+    "default_fields",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("a", sa.Integer, default=5),
+)
+
+
+categories_table = sa.Table(
+    "categories",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("title", sa.String),
+)
+
+products_table = sa.Table(
+    "products",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("title", sa.String),
+    sa.Column("category_id", sa.Integer),
+)
+
+
+class Category(IdModel):
+    title: str
+
+
+class Product(IdModel):
+    title: str
+    category_id: Optional[int]
+    category: Optional[Category]
+
+
+class CategoryRepo(SqliteRepository[Category]):
+    table = categories_table
+
+
+class ProductRepo(SqliteRepository[Product]):
+    table = products_table
+    joins = [
+        Join(
+            categories_table,
+            products_table.c.category_id == categories_table.c.id,
+            "category",
+            Category,
+        )
+    ]
+
+
+class TransactionRepo(SqliteRepository[Transaction]):
+    table = transactions_table
+
+
+class DefaultFieldsRepo(SqliteRepository[DefaultFieldsModel]):
+    table = default_fields_table
+    ignore_default = ["a"]
+
+
+@pytest.fixture()
+async def conn() -> AsyncIterator[SqliteConnection]:
+    async with create_sqlite_connection() as conn_:
+        await conn_.run_sync(metadata.create_all)
+        yield conn_
+
+
+@pytest.fixture()
+async def repo(conn: SqliteConnection) -> TransactionRepo:
+    return TransactionRepo(conn)
+
+
+@pytest.fixture()
+async def transactions(repo: TransactionRepo) -> List[Transaction]:
+    return await repo.insert_many(
+        [
+            Transaction(price=100, date=dt.date(2019, 1, 3)),
+            Transaction(price=200, date=dt.date(2019, 1, 2)),
+            Transaction(price=100, date=dt.date(2019, 1, 1)),
+        ]
+    )
+
+
+async def test_insert_sets_id(repo: TransactionRepo) -> None:
+    trans = await repo.insert(Transaction(price=100))
+
+    assert trans.id == 1
+    assert await repo.first() == trans
+
+
+async def test_insert_many_sets_ids(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    assert [trans.id for trans in transactions] == [1, 2, 3]
+
+
+async def test_insert_sets_ignore_default_fields(conn: SqliteConnection) -> None:
+    repo = DefaultFieldsRepo(conn)
+
+    res = await repo.insert_many([DefaultFieldsModel(), DefaultFieldsModel(a=60)])
+
+    assert [e.a for e in res] == [5, 60]
+    assert res == await repo.get_all()
+
+
+async def test_get_all_return_all_rows_filtered_and_sorted(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    db_transactions = await repo.get_all(
+        filters=[transactions_table.c.price == 100], orders=[transactions_table.c.date]
+    )
+
+    assert db_transactions == [transactions[2], transactions[0]]
+
+
+async def test_get_all_deserializes_rows_in_process_pool(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    with ProcessPoolDeserializer(batch_size=2, max_workers=1) as process_pool:
+        entities = await repo.get_all(process_pool=process_pool)
+
+    assert entities == transactions
+
+
+async def test_export_streams_serialized_entities_as_csv(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    sink = io.StringIO()
+
+    count = await repo.export(sink, orders=[transactions_table.c.id], fmt="csv", buffer_size=10)
+
+    assert count == 3
+    assert sink.getvalue().splitlines() == [
+        "id,date,price",
+        "1,2019-01-03,100",
+        "2,2019-01-02,200",
+        "3,2019-01-01,100",
+    ]
+
+
+async def test_export_bypasses_query_cache(
+    conn: SqliteConnection, transactions: List[Transaction]
+) -> None:
+    class CachedTransactionRepo(TransactionRepo):
+        query_cache = QueryCache()
+
+    repo = CachedTransactionRepo(conn)
+
+    assert await repo.export(io.StringIO(), fmt="jsonl") == 3
+    assert len(repo.query_cache) == 0
+
+
+async def test_export_writes_json_lines_to_file_and_async_writer(
+    repo: TransactionRepo, transactions: List[Transaction], tmp_path: Path
+) -> None:
+    class AsyncWriter:
+        def __init__(self) -> None:
+            self.chunks: List[str] = []
+
+        async def write(self, data: str) -> None:
+            self.chunks.append(data)
+
+    path = tmp_path / "transactions.jsonl"
+    writer = AsyncWriter()
+
+    await repo.export(path, filters=[transactions_table.c.price == 200], fmt="jsonl")
+    await repo.export(writer, filters=[transactions_table.c.price == 200], fmt="jsonl")
+
+    expected = {"id": 2, "date": "2019-01-02", "price": 200}
+    assert json.loads(path.read_text()) == expected
+    assert json.loads("".join(writer.chunks)) == expected
+
+
+async def test_get_all_lazy_converts_fields_on_access(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    lazy_transactions = await repo.get_all_lazy(orders=[transactions_table.c.id])
+
+    assert [trans.price for trans in lazy_transactions] == [100, 200, 100]
+    assert lazy_transactions[0].date == transactions[0].date
+    assert not lazy_transactions[0].materialized
+    assert lazy_transactions == transactions
+
+
+async def test_lazy_entity_can_be_updated(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    lazy_trans = (await repo.get_all_lazy(orders=[transactions_table.c.id]))[0]
+    lazy_trans.price = 300
+
+    await repo.update(lazy_trans.materialize())
+
+    assert (await repo.get_by_id(transactions[0].id)).price == 300  # type: ignore
+
+
+async def test_get_all_lazy_rejects_overridden_deserialize(conn: SqliteConnection) -> None:
+    class PriceInCentsRepo(TransactionRepo):
+        def deserialize(self, **kwargs: Any) -> Transaction:
+            return Transaction(**{**kwargs, "price": kwargs["price"] * 100})
+
+    with pytest.raises(ValueError):
+        await PriceInCentsRepo(conn).get_all_lazy()
+
+
+async def test_get_columns_returns_arrays(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    columns = await repo.get_columns(
+        ["id", transactions_table.c.price], orders=[transactions_table.c.id], use_numpy=False
+    )
+
+    assert columns == {"id": array("q", [1, 2, 3]), "price": array("q", [100, 200, 100])}
+
+
+async def test_get_columns_returns_numpy_arrays(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    numpy = pytest.importorskip("numpy")
+
+    columns = await repo.get_columns(["price", "date"], use_numpy=True)
+
+    assert columns["price"].dtype == numpy.int64
+    assert columns["price"].sum() == 400
+    assert list(columns["date"]) == [trans.date for trans in transactions]
+
+
+async def test_get_columns_aiter_returns_chunks(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    chunks = await repo.get_columns_aiter(
+        ["price"], orders=[transactions_table.c.id], chunk_size=2, use_numpy=False
+    )
+
+    assert [list(chunk["price"]) async for chunk in chunks] == [[100, 200], [100]]
+
+
+async def test_aggregate_groups_rows_on_db_side(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    result = await repo.aggregate(
+        {"total": sa.func.sum(transactions_table.c.price), "count": sa.func.count()},
+        group_by=["price"],
+        orders=[transactions_table.c.price],
+    )
+
+    assert result == [
+        {"price": 100, "total": 200, "count": 2},
+        {"price": 200, "total": 200, "count": 1},
+    ]
+
+
+async def test_aggregate_returns_records(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    class Stats(NamedTuple):
+        total: int
+        max_price: int
+
+    result = await repo.aggregate(
+        {
+            "total": sa.func.sum(transactions_table.c.price),
+            "max_price": sa.func.max(transactions_table.c.price),
+        },
+        filters=[transactions_table.c.price > 100],
+        record_type=Stats,
+    )
+
+    assert result == [Stats(total=200, max_price=200)]
+
+
+async def test_aggregate_without_group_by_selects_from_table(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    result = await repo.aggregate({"count": sa.func.count()})
+
+    assert result == [{"count": 3}]
+
+
+async def test_prefetch_loads_referenced_entities_by_chunks(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    class Refund(IdModel):
+        transaction_id: Optional[int]
+        transaction: Optional[Transaction]
+
+    refunds = [
+        Refund(transaction_id=transactions[0].id),
+        Refund(transaction_id=transactions[0].id),
+        Refund(transaction_id=transactions[2].id),
+        Refund(transaction_id=1000),
+        Refund(transaction_id=None),
+    ]
+
+    related = await repo.prefetch(
+        refunds, "transaction_id", attach_to="transaction", chunk_size=1
+    )
+
+    assert related == {trans.id: trans for trans in [transactions[0], transactions[2]]}
+    assert [refund.transaction for refund in refunds] == [
+        transactions[0],
+        transactions[0],
+        transactions[2],
+        None,
+        None,
+    ]
+
+
+async def test_get_all_joined_sets_nested_models(conn: SqliteConnection) -> None:
+    category = await CategoryRepo(conn).insert(Category(title="books"))
+    repo = ProductRepo(conn)
+    await repo.insert_many(
+        [Product(title="repka", category_id=category.id), Product(title="no category")]
+    )
+
+    products = await repo.get_all_joined(orders=[products_table.c.id])
+
+    assert [(product.title, product.category) for product in products] == [
+        ("repka", category),
+        ("no category", None),
+    ]
+    assert await repo.first_joined(products_table.c.title == "repka") == products[0]
+
+    products[0].title = "turnip"
+    await repo.update(products[0])
+    assert (await repo.get_by_id(products[0].id)).title == "turnip"  # type: ignore
+
+
+async def test_update_and_delete(repo: TransactionRepo, transactions: List[Transaction]) -> None:
+    await repo.update_partial(transactions[0], price=300)
+    await repo.delete_by_id(transactions[1].id)  # type: ignore
+
+    assert [trans.price for trans in await repo.get_all()] == [300, 100]
+    assert await repo.exists(transactions_table.c.price == 300)
+
+
+async def test_delete_by_ids_by_chunks_returns_deleted_count(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    ids = [trans.id for trans in transactions if trans.id]
+
+    assert await repo.delete_by_ids([*ids, 1000], chunk_size=2) == len(ids)
+    assert await repo.get_all() == []
+    assert await repo.delete_by_ids([]) == 0
+
+
+async def test_pipelined_delete_by_ids_returns_unknown_count(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    ids = [trans.id for trans in transactions if trans.id]
+
+    async with repo.execute_in_transaction(pipeline=True):
+        assert await repo.delete_by_ids(ids, chunk_size=2) == -1
+
+    assert await repo.get_all() == []
+
+
+async def test_update_values_returns_updated_count(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    updated = await repo.update_values({"price": 1}, [transactions_table.c.price == 100])
+
+    assert updated == 2
+
+
+async def test_update_and_delete_return_rows(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    updated = await repo.update_values(
+        {"price": 1}, [transactions_table.c.price == 100], returning=True
+    )
+    deleted_ids = await repo.delete_returning_ids(transactions_table.c.price == 200)
+
+    assert {trans.id for trans in updated} == {transactions[0].id, transactions[2].id}
+    assert {trans.price for trans in updated} == {1}
+    assert deleted_ids == [transactions[1].id]
+
+
+async def test_update_refreshes_columns_on_update(
+    conn: SqliteConnection, transactions: List[Transaction]
+) -> None:
+    class RefreshDateRepo(TransactionRepo):
+        refresh_on_update = ["date"]
+
+    stale_trans = Transaction(id=transactions[0].id, price=100, date=dt.date(2000, 1, 1))
+
+    updated = await RefreshDateRepo(conn).update_partial(stale_trans, price=300)
+
+    assert updated.date == transactions[0].date
+
+
+async def test_returning_is_emulated_for_insert_on_old_sqlite(
+    repo: TransactionRepo, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(sqlite_, "NATIVE_RETURNING", False)
+
+    inserted = await repo.insert_many([Transaction(price=1), Transaction(price=2)])
+
+    assert [trans.id for trans in inserted] == [1, 2]
+    with pytest.raises(NotImplementedError):
+        await repo.delete_returning_ids(transactions_table.c.price == 1)
+
+
+async def test_error_in_transaction_rollback(repo: TransactionRepo) -> None:
+    with suppress(ValueError):
+        async with repo.execute_in_transaction():
+            await repo.insert(Transaction(price=100))
+            raise ValueError()
+
+    assert await repo.get_all() == []
+
+
+async def test_pipelined_transaction_queues_updates_until_read(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    async with repo.execute_in_transaction(pipeline=True):
+        assert await repo.update_values({"price": 1}, [transactions_table.c.price == 100]) == -1
+        await repo.delete_by_id(transactions[1].id)  # type: ignore
+
+        assert [trans.price for trans in await repo.get_all()] == [1, 1]
+
+        await repo.update_partial(transactions[0], price=2)
+
+    assert [trans.price for trans in await repo.get_all()] == [2, 1]
+
+
+async def test_pipelined_transaction_error_refers_to_queued_call(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    with pytest.raises(PipelineError) as error_info:
+        async with repo.execute_in_transaction(pipeline=True):
+            await repo.update_values({"price": 1}, [transactions_table.c.price == 100])
+            await repo.update_values({"unknown": 1}, [transactions_table.c.price == 200])
+
+    error = error_info.value
+    assert error.index == 1
+    assert error.origin
+    assert [frame.name for frame in error.origin[:2]] == [
+        "update_values",
+        "test_pipelined_transaction_error_refers_to_queued_call",
+    ]
+    assert {trans.price for trans in await repo.get_all()} == {100, 200}
+
+
+async def test_query_cache_returns_cached_rows_until_table_write(
+    conn: SqliteConnection, transactions: List[Transaction]
+) -> None:
+    class CachedTransactionRepo(TransactionRepo):
+        query_cache = QueryCache()
+
+    repo = CachedTransactionRepo(conn)
+    assert len(await repo.get_all()) == 3
+    assert not await repo.exists(transactions_table.c.price == 1)
+
+    # write bypassing repository is not seen until invalidation
+    await SqliteQueryExecutor(conn).update(transactions_table.update().values(price=1))
+    assert [trans.price for trans in await repo.get_all()] == [100, 200, 100]
+    assert not await repo.exists(transactions_table.c.price == 1)
+
+    await repo.insert(Transaction(price=300))
+
+    assert [trans.price for trans in await repo.get_all()] == [1, 1, 1, 300]
+    assert await repo.exists(transactions_table.c.price == 1)
+
+
+async def test_query_cache_is_invalidated_on_transaction_end(
+    conn: SqliteConnection, transactions: List[Transaction]
+) -> None:
+    class CachedTransactionRepo(TransactionRepo):
+        query_cache = QueryCache()
+
+    repo = CachedTransactionRepo(conn)
+    await repo.get_all()
+
+    async with repo.execute_in_transaction():
+        await repo.update_values({"price": 1}, [])
+        assert [trans.price for trans in await repo.get_all()] == [1, 1, 1]
+
+    assert [trans.price for trans in await repo.get_all()] == [1, 1, 1]
+
+
+async def test_query_cache_drops_rows_read_during_write(
+    conn: SqliteConnection, transactions: List[Transaction], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    class CachedTransactionRepo(TransactionRepo):
+        query_cache = QueryCache()
+
+    repo = CachedTransactionRepo(conn)
+    write_started = asyncio.Event()
+    write_allowed = asyncio.Event()
+    update = SqliteQueryExecutor.update
+
+    async def slow_update(self: SqliteQueryExecutor, query: Any, **sa_params: Any) -> int:
+        write_started.set()
+        await write_allowed.wait()
+        return await update(self, query, **sa_params)
+
+    monkeypatch.setattr(SqliteQueryExecutor, "update", slow_update)
+    write = asyncio.ensure_future(repo.update_values({"price": 1}, []))
+    await write_started.wait()
+    assert [trans.price for trans in await repo.get_all()] == [100, 200, 100]
+
+    write_allowed.set()
+    await write
+
+    assert [trans.price for trans in await repo.get_all()] == [1, 1, 1]
+
+
+def test_query_cache_evicts_expired_and_least_recently_used_entries() -> None:
+    cache = QueryCache(ttl=0)
+    cache.set("a", ["t"], [1])
+    assert cache.get("a", ["t"]) == (False, None)
+
+    cache = QueryCache(max_memory=500)
+    cache.set("a", ["t"], "a" * 200)
+    cache.set("b", ["t"], "b" * 200)
+    cache.get("a", ["t"])
+    cache.set("c", ["t"], "c" * 200)
+
+    assert [cache.get(key, ["t"])[0] for key in "abc"] == [True, False, True]
+    assert cache.memory <= 500
+
+
+# Never ending query, it can only be interrupted
+endless_query = sa.text(
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+)
+
+
+async def test_query_exceeding_timeout_is_interrupted(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    repo = repo.with_timeout(0.05)
+
+    with pytest.raises(QueryTimeoutError):
+        await repo.query_executor.fetch_val(endless_query)
+
+    assert len(await repo.get_all()) == len(transactions)
+
+
+async def test_timeout_starts_when_query_starts_and_interrupts_only_it(
+    repo: TransactionRepo,
+) -> None:
+    slow_query = sa.text(
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 300000) "
+        "SELECT count(*) FROM c"
+    )
+    slow = asyncio.ensure_future(repo.query_executor.fetch_val(slow_query))
+    await asyncio.sleep(0)  # slow query is started first
+    # queued after slow query for longer than its timeout
+    fast = asyncio.ensure_future(
+        repo.with_timeout(0.05).query_executor.fetch_val(sa.text("select 1"))
+    )
+
+    assert await asyncio.gather(slow, fast) == [300000, 1]
+
+
+async def test_cancelled_query_is_interrupted(
+    repo: TransactionRepo, transactions: List[Transaction]
+) -> None:
+    class TimeoutTransactionRepo(TransactionRepo):
+        query_timeout = 60
+
+    repo = TimeoutTransactionRepo(repo.connection_or_context_var)
+    task = asyncio.ensure_future(repo.query_executor.fetch_val(endless_query))
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert repo.with_timeout(0).query_executor.timeout == 0
+    assert len(await repo.get_all()) == len(transactions)
+
+
+async def test_fetch_all_works_ok_with_sa_params(conn: SqliteConnection) -> None:
+    query = sa.text("select :aue as col")
+    res = [e async for e in await SqliteQueryExecutor(conn).fetch_all(query, aue=123)]
+
+    assert res[0]["col"] == 123
@@ -0,0 +1,105 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+
+from repka.repositories.sqlite_ import SqliteConnection, create_sqlite_connection
+from repka.repositories.write_buffer import InsertBuffer
+from tests.test_sqlite import Transaction, TransactionRepo, metadata
+
+# Enable async tests (https://github.com/pytest-dev/pytest-asyncio#pytestmarkasyncio)
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+async def conn() -> AsyncIterator[SqliteConnection]:
+    async with create_sqlite_connection() as conn_:
+        await conn_.run_sync(metadata.create_all)
+        yield conn_
+
+
+@pytest.fixture()
+async def repo(conn: SqliteConnection) -> TransactionRepo:
+    return TransactionRepo(conn)
+
+
+async def test_buffer_inserts_entities_when_full(repo: TransactionRepo) -> None:
+    buffer = InsertBuffer(repo, max_size=2, flush_interval=None)
+
+    first = await buffer.insert(Transaction(price=100))
+    assert not first.done()
+
+    second = await buffer.insert(Transaction(price=200))
+
+    assert [(await first).id, (await second).id] == [1, 2]
+    assert len(buffer) == 0
+    assert [trans.price for trans in await repo.get_all()] == [100, 200]
+
+
+async def test_buffer_flushes_periodically(repo: TransactionRepo) -> None:
+    async with InsertBuffer(repo, flush_interval=0.01) as buffer:
+        inserted = await buffer.insert(Transaction(price=100))
+
+        trans = await asyncio.wait_for(inserted, timeout=1)
+
+        assert trans.id == 1
+
+
+async def test_buffer_flushes_on_close(repo: TransactionRepo) -> None:
+    async with InsertBuffer(repo, flush_interval=None) as buffer:
+        await buffer.insert(Transaction(price=100))
+        assert await repo.get_all() == []
+
+    assert [trans.price for trans in await repo.get_all()] == [100]
+
+
+async def test_buffer_reports_flush_errors(repo: TransactionRepo) -> None:
+    errors: List[Exception] = []
+
+    async def fail(entities: List[Transaction]) -> List[Transaction]:
+        raise ValueError()
+
+    repo.insert_many = fail  # type: ignore
+    buffer = InsertBuffer(
+        repo, max_size=1, flush_interval=None, on_error=lambda error, _: errors.append(error)
+    )
+
+    inserted = await buffer.insert(Transaction(price=100))
+
+    with pytest.raises(ValueError):
+        await inserted
+    assert len(errors) == 1
+
+
+async def test_buffer_close_waits_for_periodic_flush(repo: TransactionRepo) -> None:
+    insert_many = repo.insert_many
+    flush_started = asyncio.Event()
+
+    async def slow_insert_many(entities: List[Transaction]) -> List[Transaction]:
+        flush_started.set()
+        await asyncio.sleep(0.05)
+        return await insert_many(entities)
+
+    repo.insert_many = slow_insert_many  # type: ignore
+    buffer = InsertBuffer(repo, flush_interval=0.01)
+    inserted = await buffer.insert(Transaction(price=100))
+    await flush_started.wait()
+
+    await buffer.close()
+
+    assert (await inserted).id == 1
+    assert [trans.price for trans in await repo.get_all()] == [100]
+
+
+async def test_buffer_flush_skips_cancelled_futures(repo: TransactionRepo) -> None:
+    buffer = InsertBuffer(repo, flush_interval=None)
+    first = await buffer.insert(Transaction(price=100))
+    second = await buffer.insert(Transaction(price=200))
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(first, timeout=0.01)
+
+    await buffer.flush()
+
+    assert first.cancelled()
+    assert (await second).id == 2
+    assert [trans.price for trans in await repo.get_all()] == [100, 200]